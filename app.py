@@ -31,10 +31,11 @@ def init_openai_service():
             openai_service = OpenAIService(api_key)
             # Temporarily commenting out to fix Step 3 error
             # multipage_processor = MultiPageProcessor(openai_service)
-            return openai_service
         except Exception as e:
             print(f"Failed to initialize OpenAI service: {e}")
             return None
+    # No-op unless enabled; re-warms in the background once the provider cache has expired
+    openai_service.warmup_prompt_cache()
     return openai_service
 
 # Ensure directories exist
@@ -211,9 +212,10 @@ def api_step1_classify(doc_id):
         return jsonify({'success': False, 'error': 'Document not found'}), 404
     
     try:
-        # Process PDF
-        pdf_processor = PDFProcessor(doc.filepath)
-        page_data = pdf_processor.extract_text_and_structure(page_num=0)
+        # Process PDF (text_blocks are built lazily, so read them while the PDF is open)
+        with PDFProcessor(doc.filepath) as pdf_processor:
+            page_data = pdf_processor.extract_text_and_structure(page_num=0)
+            text_blocks = page_data['text_blocks']
         
         # Classify structure using OpenAI
         service = init_openai_service()
@@ -222,11 +224,11 @@ def api_step1_classify(doc_id):
         
         print(f"DEBUG - Starting structure classification for doc {doc_id}")
         print(f"DEBUG - Text length: {len(page_data['text'])}")
-        print(f"DEBUG - Text blocks: {len(page_data['text_blocks'])}")
+        print(f"DEBUG - Text blocks: {len(text_blocks)}")
         
         result = service.classify_structure(
             page_data['text'], 
-            page_data['text_blocks']
+            text_blocks
         )
         
         print(f"DEBUG - Classification result type: {type(result)}")
@@ -248,8 +250,6 @@ def api_step1_classify(doc_id):
         if 'usage' in result:
             cost_tracker.log_usage(result.get('usage'), doc_id)
         
-        pdf_processor.close()
-        
         return jsonify({
             'success': True, 
             'result': result,
@@ -316,8 +316,8 @@ def api_step2_identify_fields(doc_id):
         print(f"DEBUG Step2 - Starting PDF processing for {doc_id}")
 
         # Get PDF text
-        pdf_processor = PDFProcessor(doc.filepath)
-        page_data = pdf_processor.extract_text_and_structure(page_num=0)
+        with PDFProcessor(doc.filepath) as pdf_processor:
+            page_data = pdf_processor.extract_text_and_structure(page_num=0)
 
         print(f"DEBUG Step2 - PDF text extracted, length: {len(page_data['text'])}")
         print(f"DEBUG Step2 - Classification: {step1_result.get('classification', 'unknown')}")
@@ -380,8 +380,6 @@ def api_step2_identify_fields(doc_id):
         if 'usage' in result:
             cost_tracker.log_usage(result.get('usage'), doc_id)
         
-        pdf_processor.close()
-        
         return jsonify({
             'success': True, 
             'result': result,
@@ -522,8 +520,8 @@ def api_step2_refine(doc_id):
         current_result = doc.get_step_result(2)
         
         # Get PDF text
-        pdf_processor = PDFProcessor(doc.filepath)
-        page_data = pdf_processor.extract_text_and_structure(page_num=0)
+        with PDFProcessor(doc.filepath) as pdf_processor:
+            page_data = pdf_processor.extract_text_and_structure(page_num=0)
         
         print(f"DEBUG Step2 Refine - Starting with feedback: {user_feedback[:100]}...")
         print(f"DEBUG Step2 Refine - Current iteration: {len(doc.get_feedback_history(2)) + 1}")
@@ -566,8 +564,6 @@ def api_step2_refine(doc_id):
         if 'usage' in result:
             cost_tracker.log_usage(result.get('usage'), doc_id)
         
-        pdf_processor.close()
-        
         # Prepare response message
         iteration_num = len(doc.get_feedback_history(2))
         message = f'Extraction refined based on your feedback (Iteration {iteration_num})'
@@ -630,8 +626,8 @@ def api_step2_field_boundaries(doc_id):
     
     try:
         # Get PDF text and coordinates
-        pdf_processor = PDFProcessor(doc.filepath)
-        page_data = pdf_processor.extract_text_and_structure(page_num=0)
+        with PDFProcessor(doc.filepath) as pdf_processor:
+            page_data = pdf_processor.extract_text_and_structure(page_num=0)
         
         # Get word coordinates
         word_coordinates = page_data.get('word_coordinates', [])
@@ -686,7 +682,7 @@ def api_step2_field_boundaries(doc_id):
                         'text_type': 'field_name' if is_field_candidate else 'value_or_content',
                         'confidence': 0.8 if is_field_candidate else 0.6
                     },
-                    'words': cluster,
+                    'words': [word.as_dict() for word in cluster],
                     'suggested_assignment': {
                         'field_name': cluster_text if is_field_candidate else None,
                         'field_value': cluster_text if not is_field_candidate else None,
@@ -694,8 +690,6 @@ def api_step2_field_boundaries(doc_id):
                     }
                 })
         
-        pdf_processor.close()
-        
         return jsonify({
             'success': True,
             'page_dimensions': {
@@ -722,8 +716,8 @@ def api_step2_preprocessing_preview(doc_id):
     
     try:
         # Get PDF text and coordinates
-        pdf_processor = PDFProcessor(doc.filepath)
-        page_data = pdf_processor.extract_text_and_structure(page_num=0)
+        with PDFProcessor(doc.filepath) as pdf_processor:
+            page_data = pdf_processor.extract_text_and_structure(page_num=0)
         
         # Initialize spatial preprocessor
         preprocessor = SpatialPreprocessor()
@@ -736,10 +730,11 @@ def api_step2_preprocessing_preview(doc_id):
         
         # Get spatially processed text
         if word_coordinates:
-            processed_text = preprocessor.preprocess_document(word_coordinates)
+            # Group words into lines once and share them across the analyses below
+            lines = preprocessor.group_words_into_lines(word_coordinates)
+            processed_text = preprocessor.preprocess_document(word_coordinates, lines)
             
             # Get detailed analysis
-            lines = preprocessor.group_words_into_lines(word_coordinates)
             line_analysis = []
             
             for i, line_words in enumerate(lines):
@@ -779,7 +774,9 @@ def api_step2_preprocessing_preview(doc_id):
             spacing_stats = preprocessor.calculate_word_spacing_stats(word_coordinates)
             
             # Get table regions
-            table_regions = preprocessor.identify_table_regions(word_coordinates)
+            table_regions = preprocessor.identify_table_regions(word_coordinates, lines)
+            for region in table_regions:
+                region['lines'] = [[word.as_dict() for word in line] for line in region['lines']]
             
         else:
             processed_text = original_text
@@ -787,8 +784,6 @@ def api_step2_preprocessing_preview(doc_id):
             spacing_stats = {}
             table_regions = []
         
-        pdf_processor.close()
-        
         return jsonify({
             'success': True,
             'original_text': original_text,
@@ -844,8 +839,8 @@ def api_step3_extract_data(doc_id):
     
     try:
         # Get PDF text
-        pdf_processor = PDFProcessor(doc.filepath)
-        page_data = pdf_processor.extract_text_and_structure(page_num=0)
+        with PDFProcessor(doc.filepath) as pdf_processor:
+            page_data = pdf_processor.extract_text_and_structure(page_num=0)
         
         # Extract data using OpenAI
         service = init_openai_service()
@@ -888,8 +883,6 @@ def api_step3_extract_data(doc_id):
         if 'usage' in result:
             cost_tracker.log_usage(result.get('usage'), doc_id)
         
-        pdf_processor.close()
-        
         return jsonify({
             'success': True, 
             'result': result,
@@ -986,6 +979,13 @@ def costs_dashboard():
                          cost_analysis=cost_analysis,
                          suggestions=suggestions)
 
+@app.route('/api/prompt-cache-stats', methods=['GET'])
+def prompt_cache_stats():
+    """Cached vs uncached prompt tokens per task type since startup"""
+    if not openai_service:
+        return jsonify({})
+    return jsonify(openai_service.get_prompt_cache_stats())
+
 @app.errorhandler(404)
 def not_found(error):
     return render_template('404.html'), 404
@@ -42,9 +42,61 @@ class GPTConfig:
     FIELD_IDENTIFICATION_MAX_TOKENS = int(os.environ.get('FIELD_IDENTIFICATION_MAX_TOKENS', '12000'))
     DATA_EXTRACTION_MAX_TOKENS = int(os.environ.get('DATA_EXTRACTION_MAX_TOKENS', '12000'))
     
+    # Context window of the extraction models; the document text in a prompt is truncated
+    # at a paragraph break so prompt + max_tokens output + margin fit inside it
+    MODEL_CONTEXT_TOKENS = int(os.environ.get('MODEL_CONTEXT_TOKENS', '128000'))
+    PROMPT_TOKEN_MARGIN = int(os.environ.get('PROMPT_TOKEN_MARGIN', '128'))
+    
+    # Upper bound on feedback-derived enhancement instructions injected into a single prompt
+    MAX_ENHANCEMENTS = int(os.environ.get('MAX_ENHANCEMENTS', '25'))
+    
+    # Classify clearly form-only or table-only pages with layout rules instead of an LLM call
+    ENABLE_FAST_CLASSIFICATION = os.environ.get('ENABLE_FAST_CLASSIFICATION', 'true').lower() == 'true'
+    
+    # Pages of a multi-page document extracted concurrently (one request in flight per page)
+    MAX_CONCURRENT_PAGES = int(os.environ.get('MAX_CONCURRENT_PAGES', '4'))
+    
+    # Completion window for Batch API submissions (offline multi-page extraction)
+    BATCH_COMPLETION_WINDOW = os.environ.get('BATCH_COMPLETION_WINDOW', '24h')
+    
+    # Multi-page form extraction packs pages into one request up to these limits
+    MAX_BATCH_INPUT_TOKENS = int(os.environ.get('MAX_BATCH_INPUT_TOKENS', '24000'))
+    MAX_PAGES_PER_BATCH = int(os.environ.get('MAX_PAGES_PER_BATCH', '8'))
+    
+    # Apply Step 3 feedback by asking only for the changed fields/tables and merging them
+    # into the previous result, instead of re-running the full feedback-analysis extraction
+    ENABLE_DELTA_REFINEMENT = os.environ.get('ENABLE_DELTA_REFINEMENT', 'false').lower() == 'true'
+    
+    # Prime the provider prompt cache with every template prefix at startup (costs one
+    # tiny request per template); re-warmed once the cache TTL has passed
+    ENABLE_PROMPT_WARMUP = os.environ.get('ENABLE_PROMPT_WARMUP', 'false').lower() == 'true'
+    PROMPT_CACHE_TTL = int(os.environ.get('PROMPT_CACHE_TTL', '300'))
+    PROMPT_CACHE_MIN_TOKENS = int(os.environ.get('PROMPT_CACHE_MIN_TOKENS', '1024'))
+    # Requests whose first N characters match share a prompt_cache_key, so the provider
+    # routes them to the same cache (0 disables the key)
+    PROMPT_CACHE_KEY_PREFIX_CHARS = int(os.environ.get('PROMPT_CACHE_KEY_PREFIX_CHARS', '2048'))
+    
+    # Ask the API for JSON-mode responses so every reply parses as a JSON object
+    ENABLE_JSON_MODE = os.environ.get('ENABLE_JSON_MODE', 'true').lower() == 'true'
+    # Models that accept strict json_schema response formats (matched by name prefix);
+    # templates with a fixed response shape use them, other models fall back to JSON mode
+    STRUCTURED_OUTPUT_MODELS = tuple(
+        prefix.strip() for prefix in
+        os.environ.get('STRUCTURED_OUTPUT_MODELS', 'gpt-4o,gpt-4.1,gpt-5,o1,o3,o4').split(',')
+        if prefix.strip()
+    )
+    
+    # Write every vision response to debug_responses/ (on a background thread)
+    SAVE_VISION_DEBUG_RESPONSES = os.environ.get('SAVE_VISION_DEBUG_RESPONSES', 'false').lower() == 'true'
+    
     # Cost tracking
     ENABLE_COST_TRACKING = os.environ.get('ENABLE_COST_TRACKING', 'true').lower() == 'true'
     
+    @classmethod
+    def supports_structured_outputs(cls, model: str) -> bool:
+        """Whether the model accepts a strict json_schema response_format"""
+        return model.startswith(cls.STRUCTURED_OUTPUT_MODELS)
+    
     @classmethod
     def get_model_config(cls, task_type: str) -> dict:
         """Get optimized model configuration for specific task"""
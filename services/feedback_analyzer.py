@@ -3,6 +3,7 @@ Intelligent feedback analysis to create enhanced extraction templates
 """
 import json
 from typing import Dict, Any, List, TYPE_CHECKING
+from .prompts import ENHANCEMENT_GENERATION, FEEDBACK_ANALYSIS
 
 if TYPE_CHECKING:
     from .openai_service import OpenAIService
@@ -45,7 +46,9 @@ class FeedbackAnalyzer:
                 'extraction_enhancements': enhanced_instructions['enhancements'],
                 'validation_rules': enhanced_instructions['validation_rules'],
                 'enhanced_instructions': enhanced_instructions['prompt_additions'],
-                'confidence_score': analysis_result.get('confidence', 0.8)
+                'confidence_score': analysis_result.get('confidence', 0.8),
+                # Generic enhancements stood in for a failed generation step
+                'fallback_used': bool(enhanced_instructions.get('fallback_used'))
             }
 
 
@@ -59,102 +62,21 @@ class FeedbackAnalyzer:
                                       feedback_history: List[Dict] = None) -> str:
         """Build intelligent prompt for feedback analysis"""
 
-        return f"""
-        You are an expert in document extraction feedback analysis. Your job is to understand user corrections and derive intelligent extraction rules.
-
-        ## CONTEXT
-
-        **Original Extraction Result:**
-        {json.dumps(original_result.get('extracted_data', {}), indent=2)}
-
-        **Document Structure (Fields and Tables):**
-        {json.dumps(document_structure, indent=2)}
-
-        **Current User Feedback:**
-        "{user_feedback}"
-
-        **Previous Feedback History:**
-        {self._format_feedback_history(feedback_history)}
-
-        ## ANALYSIS TASK
-
-        Analyze BOTH the current feedback AND the previous feedback history to understand:
-        1. What specific extraction errors occurred in this iteration?
-        2. What patterns emerge from the previous feedback history?
-        3. What recurring issues need to be addressed?
-        4. What general principles can prevent similar errors across all extractions?
-        5. How should the extraction logic be enhanced to incorporate ALL learned improvements?
-
-        CRITICAL: Consider feedback history to build cumulative learning. Don't just fix this issue - apply all previous learnings too.
-        Focus on creating rules that will work for ALL pages and ALL previously encountered scenarios.
-
-        ## REQUIRED JSON RESPONSE
-
-        {{
-            "error_analysis": {{
-                "identified_errors": [
-                    {{
-                        "error_type": "field_misassignment|missing_field|wrong_format|spatial_error|validation_failure",
-                        "affected_field": "field_name",
-                        "description": "What went wrong",
-                        "root_cause": "Why it happened"
-                    }}
-                ],
-                "error_patterns": ["generalized pattern description"]
-            }},
-            "enhancement_rules": {{
-                "field_detection": {{
-                    "improved_patterns": ["new detection patterns to add"],
-                    "validation_checks": ["validation rules to add"],
-                    "spatial_refinements": ["spatial analysis improvements"]
-                }},
-                "data_extraction": {{
-                    "format_standardization": ["format rules to apply"],
-                    "value_validation": ["value validation rules"],
-                    "error_prevention": ["prevention strategies"]
-                }}
-            }},
-            "generalized_principles": [
-                "Universal principles that apply to all similar documents"
-            ],
-            "confidence": 0.85,
-            "complexity_assessment": "simple|moderate|complex"
-        }}
-        """
+        return FEEDBACK_ANALYSIS(
+            original_result=json.dumps(original_result.get('extracted_data', {}), indent=2),
+            document_structure=json.dumps(document_structure, indent=2),
+            user_feedback=user_feedback,
+            feedback_history=self._format_feedback_history(feedback_history)
+        )
 
     def _generate_enhanced_instructions(self, analysis_result: Dict[str, Any],
                                       document_structure: Dict[str, Any]) -> Dict[str, Any]:
         """Generate enhanced extraction instructions from analysis"""
 
-        enhancement_prompt = f"""
-        Based on this feedback analysis, generate specific extraction enhancements:
-
-        **Analysis Result:**
-        {json.dumps(analysis_result, indent=2)}
-
-        **Document Structure:**
-        {json.dumps(document_structure, indent=2)}
-
-        Generate practical extraction instructions that can be added to prompts.
-
-        Response format:
-        {{
-            "enhancements": {{
-                "detection_improvements": ["specific instructions for better field detection"],
-                "extraction_refinements": ["specific instructions for better data extraction"],
-                "spatial_adjustments": ["spatial analysis improvements"],
-                "format_standardizations": ["format handling improvements"]
-            }},
-            "validation_rules": [
-                "Rule 1: Validation check to perform",
-                "Rule 2: Another validation check"
-            ],
-            "prompt_additions": [
-                "Specific instruction to add to extraction prompt",
-                "Another specific instruction"
-            ]
-        }}
-        """
+        enhancement_prompt = ENHANCEMENT_GENERATION(
+            analysis_result=json.dumps(analysis_result, indent=2),
+            document_structure=json.dumps(document_structure, indent=2)
+        )
 
         try:
             response = self.openai_service._make_gpt_request(
@@ -185,7 +107,8 @@ class FeedbackAnalyzer:
             'extraction_enhancements': self._fallback_enhancements(),
             'validation_rules': [f"Review extraction carefully based on: {user_feedback}"],
             'enhanced_instructions': [f"Apply user guidance: {user_feedback}"],
-            'confidence_score': 0.3
+            'confidence_score': 0.3,
+            'fallback_used': True
         }
 
     def _fallback_enhancements(self) -> Dict[str, Any]:
@@ -198,7 +121,8 @@ class FeedbackAnalyzer:
                 'format_standardizations': ["Maintain consistent data formatting"]
             },
             'validation_rules': ["Validate extracted data types match expected patterns"],
-            'prompt_additions': ["Be more precise with field boundary detection and value extraction"]
+            'prompt_additions': ["Be more precise with field boundary detection and value extraction"],
+            'fallback_used': True
         }
 
     def create_enhanced_extraction_prompt(self, base_prompt: str,
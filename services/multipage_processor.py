@@ -2,7 +2,9 @@
 Multi-page PDF processing with intelligent template creation and application
 """
 import json
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 from .pdf_processor import PDFProcessor
@@ -18,11 +20,12 @@ class MultiPageProcessor:
 
     def get_page_thumbnails(self, pdf_path: str) -> List[Dict[str, Any]]:
         """Get thumbnail info for all pages for user selection"""
-        pdf_processor = PDFProcessor(pdf_path)
+        with PDFProcessor(pdf_path) as pdf_processor:
+            pages = pdf_processor.extract_all_pages()
 
         thumbnails = []
-        for page_num in range(pdf_processor.get_page_count()):
-            page_data = pdf_processor.extract_text_and_structure(page_num)
+        for page_data in pages:
+            page_num = page_data['page_num']
 
             # Get text preview for user to identify page content
             text_preview = page_data['text'][:200] + "..." if len(page_data['text']) > 200 else page_data['text']
@@ -38,16 +41,14 @@ class MultiPageProcessor:
                 'has_tables': self._detect_potential_tables(page_data['text'])
             })
 
-        pdf_processor.close()
         return thumbnails
 
     def extract_validation_page(self, pdf_path: str, validation_page_num: int,
                               step1_result: Dict[str, Any], step2_result: Dict[str, Any]) -> Dict[str, Any]:
         """Extract data from user-selected validation page"""
-        pdf_processor = PDFProcessor(pdf_path)
-
         # Extract the specific validation page
-        page_data = pdf_processor.extract_text_and_structure(validation_page_num)
+        with PDFProcessor(pdf_path) as pdf_processor:
+            page_data = pdf_processor.extract_text_and_structure(validation_page_num)
 
         # Use existing extraction logic
         if step2_result.get('extraction_method') == 'vision':
@@ -66,7 +67,6 @@ class MultiPageProcessor:
             'extraction_timestamp': datetime.now().isoformat()
         }
 
-        pdf_processor.close()
         return result
 
     def create_enhanced_template(self, validation_result: Dict[str, Any],
@@ -96,54 +96,171 @@ class MultiPageProcessor:
 
         return enhanced_template
 
-    def process_all_pages(self, pdf_path: str, enhanced_template: Dict[str, Any]) -> Dict[str, Any]:
-        """Process all pages using the enhanced template"""
-        pdf_processor = PDFProcessor(pdf_path)
-        total_pages = pdf_processor.get_page_count()
+    def process_all_pages(self, pdf_path: str, enhanced_template: Dict[str, Any],
+                          checkpoint_path: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Process all pages using the enhanced template, several pages at a time.
+        With checkpoint_path, each finished page is appended to that JSONL file and
+        pages already recorded there are not processed again.
+        """
+        with PDFProcessor(pdf_path) as pdf_processor:
+            pages = pdf_processor.extract_all_pages()
 
         # Track processing progress
         processing_status = {
-            'total_pages': total_pages,
+            'total_pages': len(pages),
             'completed_pages': 0,
             'failed_pages': [],
             'page_results': [],
             'processing_start_time': datetime.now().isoformat()
         }
 
-        # Process each page
-        for page_num in range(total_pages):
+        completed = self._load_checkpoint(checkpoint_path)
+        if completed:
+            print(f"DEBUG - Resuming from checkpoint with {len(completed)} completed pages")
+        processing_status['page_results'].extend(completed.values())
+        processing_status['completed_pages'] = len(completed)
+        pending = [page_data for page_data in pages if page_data['page_num'] + 1 not in completed]
+
+        # LLM calls are network bound, so pages are dispatched concurrently
+        workers = max(1, min(self.openai_service.config.MAX_CONCURRENT_PAGES, len(pending)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self._process_single_page, pdf_path, page_data, enhanced_template): page_data['page_num']
+                for page_data in pending
+            }
+            for future in as_completed(futures):
+                page_num = futures[future]
+                try:
+                    page_result = future.result()
+                    processing_status['page_results'].append(page_result)
+                    processing_status['completed_pages'] += 1
+                    self._append_checkpoint(checkpoint_path, page_result)
+
+                except Exception as e:
+                    error_info = {
+                        'page_number': page_num + 1,
+                        'error': str(e),
+                        'timestamp': datetime.now().isoformat()
+                    }
+                    processing_status['failed_pages'].append(error_info)
+                    print(f"ERROR processing page {page_num + 1}: {str(e)}")
+
+        processing_status['page_results'].sort(key=lambda result: result['page_metadata']['page_number'])
+        processing_status['failed_pages'].sort(key=lambda error: error['page_number'])
+        processing_status['processing_end_time'] = datetime.now().isoformat()
+
+        return processing_status
+
+    def submit_all_pages_batch(self, pdf_path: str, enhanced_template: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Queue every page for offline extraction through the Batch API (half the cost of
+        realtime requests); collect the results later with collect_all_pages_batch
+        """
+        if enhanced_template.get('extraction_method') == 'vision':
+            with PDFProcessor(pdf_path) as pdf_processor:
+                total_pages = pdf_processor.get_page_count()
+
+            # Every page shares the template prompt; each request carries its own page image
+            prompt = self.openai_service.build_enhanced_vision_prompt(enhanced_template)
+            batch_id = self.openai_service.submit_vision_batch(
+                pdf_path, {str(page_num): (prompt, page_num) for page_num in range(total_pages)}
+            )
+
+            return {
+                'batch_id': batch_id,
+                'total_pages': total_pages,
+                'submitted_at': datetime.now().isoformat()
+            }
+
+        with PDFProcessor(pdf_path) as pdf_processor:
+            pages = pdf_processor.extract_all_pages()
+
+        requests = {
+            str(page_data['page_num']): (
+                self.openai_service.build_enhanced_extraction_prompt(
+                    page_data['text'], enhanced_template, page_data.get('word_coordinates')
+                ),
+                'data_extraction'
+            )
+            for page_data in pages
+        }
+        batch_id = self.openai_service.submit_batch(requests)
+
+        return {
+            'batch_id': batch_id,
+            'total_pages': len(pages),
+            'submitted_at': datetime.now().isoformat()
+        }
+
+    def collect_all_pages_batch(self, pdf_path: str, batch_id: str,
+                                enhanced_template: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Processing status for a submitted batch, in the process_all_pages shape, or None while it runs"""
+        batch_results = self.openai_service.collect_batch(batch_id)
+        if batch_results is None:
+            return None
+
+        is_vision = enhanced_template.get('extraction_method') == 'vision'
+        with PDFProcessor(pdf_path) as pdf_processor:
+            if is_vision:
+                # Vision pages only need their numbers; the text layer is never read
+                pages = [{'page_num': page_num} for page_num in range(pdf_processor.get_page_count())]
+            else:
+                pages = pdf_processor.extract_all_pages()
+
+        processing_status = {
+            'total_pages': len(pages),
+            'completed_pages': 0,
+            'failed_pages': [],
+            'page_results': [],
+            'batch_id': batch_id,
+            'processing_start_time': datetime.now().isoformat()
+        }
+
+        for page_data in pages:
+            page_num = page_data['page_num']
             try:
-                page_result = self._process_single_page(
-                    pdf_processor, page_num, enhanced_template
-                )
+                # Pages missing from the batch output go through the realtime fallback
+                result = batch_results.get(str(page_num), {"success": False, "error": "Missing from batch output"})
+                if is_vision:
+                    if result.get('success'):
+                        self.openai_service.vision_extractor.annotate_enhanced_result(result['data'], page_num)
+                    page_result = self.openai_service.finish_enhanced_vision_extraction(
+                        result, pdf_path, enhanced_template, page_num
+                    )
+                else:
+                    page_result = self.openai_service.finish_enhanced_extraction(
+                        result, page_data['text'], enhanced_template, page_data.get('word_coordinates')
+                    )
+                page_result['page_metadata'] = {
+                    'page_number': page_num + 1,
+                    'extraction_timestamp': datetime.now().isoformat(),
+                    'template_version': enhanced_template['template_metadata']['template_version']
+                }
                 processing_status['page_results'].append(page_result)
                 processing_status['completed_pages'] += 1
 
             except Exception as e:
-                error_info = {
+                processing_status['failed_pages'].append({
                     'page_number': page_num + 1,
                     'error': str(e),
                     'timestamp': datetime.now().isoformat()
-                }
-                processing_status['failed_pages'].append(error_info)
+                })
                 print(f"ERROR processing page {page_num + 1}: {str(e)}")
 
-        pdf_processor.close()
         processing_status['processing_end_time'] = datetime.now().isoformat()
 
         return processing_status
 
-    def _process_single_page(self, pdf_processor: PDFProcessor, page_num: int,
+    def _process_single_page(self, pdf_path: str, page_data: Dict[str, Any],
                            enhanced_template: Dict[str, Any]) -> Dict[str, Any]:
         """Process a single page with enhanced template"""
-
-        # Extract page data
-        page_data = pdf_processor.extract_text_and_structure(page_num)
+        page_num = page_data['page_num']
 
         # Use enhanced extraction logic
         if enhanced_template.get('extraction_method') == 'vision':
             result = self.openai_service.extract_data_with_vision_enhanced(
-                pdf_processor.pdf_path, enhanced_template, page_num=page_num
+                pdf_path, enhanced_template, page_num=page_num
             )
         else:
             result = self.openai_service.extract_data_enhanced(
@@ -159,6 +276,33 @@ class MultiPageProcessor:
 
         return result
 
+    def _load_checkpoint(self, checkpoint_path: Optional[str]) -> Dict[int, Dict[str, Any]]:
+        """Page results recorded by an earlier run, keyed by page number"""
+        if not checkpoint_path or not os.path.exists(checkpoint_path):
+            return {}
+
+        completed = {}
+        with open(checkpoint_path, 'rb+') as f:
+            checkpoint = f.read()
+            if checkpoint and not checkpoint.endswith(b'\n'):
+                # Cut the partial line of an interrupted write, so this run's appends start on a fresh line
+                checkpoint = checkpoint[:checkpoint.rfind(b'\n') + 1]
+                f.truncate(len(checkpoint))
+        for line in checkpoint.splitlines():
+            try:
+                page_result = json.loads(line)
+                completed[page_result['page_metadata']['page_number']] = page_result
+            except (ValueError, KeyError, TypeError):
+                continue  # Unreadable record: that page is simply extracted again
+        return completed
+
+    def _append_checkpoint(self, checkpoint_path: Optional[str], page_result: Dict[str, Any]):
+        """Record one finished page so an interrupted run can resume after it"""
+        if not checkpoint_path:
+            return
+        with open(checkpoint_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(page_result, default=str) + "\n")
+
     def merge_page_results(self, page_results: List[Dict[str, Any]],
                          enhanced_template: Dict[str, Any]) -> Dict[str, Any]:
         """Merge all page extraction results into final document"""
@@ -1,24 +1,130 @@
-from openai import OpenAI
+from openai import DefaultHttpxClient, OpenAI
+import httpx
 import json,os
-from typing import Dict, Any, List
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
 import time
 from config import GPTConfig
-from .prompts import PromptTemplates
+from .prompts import (
+    CompiledPrompt, PromptTemplates, estimate_tokens, render_extraction_prompt,
+    render_unified_extraction_prompt, serialize_field_names, format_page_blocks,
+    BATCHED_FORM_DATA_EXTRACTION, COMPREHENSIVE_DATA_EXTRACTION,
+    COMPREHENSIVE_FIELD_EXTRACTION, EMPLOYEE_PROFILE_TABLE_EXTRACTION,
+    FORM_DATA_REFINE_DELTA, FORM_FIELD_IDENTIFICATION, STRUCTURE_CLASSIFICATION,
+    TABLE_DATA_EXTRACTION, TABLE_HEADER_IDENTIFICATION, UNIFIED_SCHEMA_EXTRACTION_BACKUP,
+)
 from .spatial_preprocessor import SpatialPreprocessor
 from .coordinate_table_extractor import CoordinateTableExtractor
 from .vision_extractor import VisionBasedExtractor
 from .feedback_analyzer import FeedbackAnalyzer
 
+# A line starting with a short label followed by a colon ("Employee Name: ..." or "SSN:")
+_LABEL_LINE = re.compile(r"^\s*[A-Za-z][\w .,#/()&'-]{0,40}:(?:\s|$)")
+# JSON object inside a markdown code block, and the outermost braces anywhere in a response
+_JSON_CODE_BLOCK = re.compile(r'```(?:json)?\s*(\{[\s\S]*?\})\s*```')
+_JSON_OBJECT = re.compile(r'(\{[\s\S]*\})')
+# Comma directly before a closing brace or bracket
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
 class OpenAIService:
+    # Max number of formatted field structures kept in memory
+    FIELD_STRUCTURE_CACHE_SIZE = 64
+    # Feedback analysis cache bounds (entries, seconds)
+    FEEDBACK_ANALYSIS_CACHE_SIZE = 256
+    FEEDBACK_ANALYSIS_CACHE_TTL = 3600
+    # Max number of deterministic (temperature 0) GPT responses kept in memory
+    RESPONSE_CACHE_SIZE = 128
+    # Templates primed by warmup_prompt_cache, with the task type whose model serves them
+    WARMUP_TEMPLATES = (
+        (STRUCTURE_CLASSIFICATION, 'classification'),
+        (FORM_FIELD_IDENTIFICATION, 'field_identification'),
+        (TABLE_HEADER_IDENTIFICATION, 'field_identification'),
+        (COMPREHENSIVE_FIELD_EXTRACTION, 'field_identification'),
+        (COMPREHENSIVE_DATA_EXTRACTION, 'data_extraction'),
+        (EMPLOYEE_PROFILE_TABLE_EXTRACTION, 'data_extraction'),
+        # Also primes the enhanced unified variant, which shares this static prefix
+        (UNIFIED_SCHEMA_EXTRACTION_BACKUP, 'data_extraction'),
+        (BATCHED_FORM_DATA_EXTRACTION, 'data_extraction'),
+        (TABLE_DATA_EXTRACTION, 'data_extraction'),
+    )
+    WARMUP_CONCURRENCY = 4
+    # Keep-alive pool shared by the text and vision clients, sized for concurrent page
+    # extraction plus prompt warmup so requests reuse open TLS connections
+    HTTP_MAX_CONNECTIONS = 64
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 32
+    # Rule-based structure classification: minimum non-empty lines, and the vertical
+    # distance (points) within which spans count as one row
+    FAST_CLASSIFICATION_MIN_LINES = 8
+    FAST_CLASSIFICATION_ROW_TOLERANCE = 3.0
+    # Enhancement kinds rendered into enhanced extraction prompts, in output order
+    ENHANCEMENT_SECTION_HEADERS = (
+        ('detection_improvements', "### ENHANCED FIELD DETECTION"),
+        ('extraction_refinements', "### EXTRACTION REFINEMENTS"),
+        ('spatial_adjustments', "### SPATIAL ANALYSIS IMPROVEMENTS"),
+        ('format_standardizations', "### FORMAT STANDARDIZATION"),
+    )
+
     def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
+        self._http_client = DefaultHttpxClient(limits=httpx.Limits(
+            max_connections=self.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=self.HTTP_MAX_KEEPALIVE_CONNECTIONS
+        ))
+        self.client = OpenAI(api_key=api_key, http_client=self._http_client)
         self.config = GPTConfig()
         self.prompts = PromptTemplates()
         self.spatial_preprocessor = SpatialPreprocessor()
-        self.vision_extractor = VisionBasedExtractor(api_key)
+        self.vision_extractor = VisionBasedExtractor(api_key, http_client=self._http_client)
         self.feedback_analyzer = FeedbackAnalyzer(self)
+        self._field_structure_cache = OrderedDict()  # LRU of formatted field structures
+        self._feedback_analysis_cache = OrderedDict()  # key -> (timestamp, analysis)
+        self._response_cache = OrderedDict()  # request digest -> serialized parsed response
+        self._response_cache_lock = threading.Lock()  # pages may be extracted concurrently
+        self.response_cache_hits = 0
+        self.response_cache_misses = 0
+        self.prompt_cache_tokens = Counter()  # (task_type, 'hit' | 'miss') -> prompt tokens
+        self._prompt_cache_stats_lock = threading.Lock()
+        self.warmup_completed_at = None
+        self._warmup_lock = threading.Lock()
+        self._warmup_running = False
+    
+    def _response_format_kwargs(self, model: str, response_format: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """response_format request argument: the template's strict schema where the model supports it, else JSON mode"""
+        if not self.config.ENABLE_JSON_MODE:
+            return {}
+        if response_format is not None and self.config.supports_structured_outputs(model):
+            return {'response_format': response_format}
+        # Constrained decoding: the reply is always a single JSON object
+        return {'response_format': {"type": "json_object"}}
+    
+    def _prompt_for(self, template: CompiledPrompt, task_type: str) -> CompiledPrompt:
+        """Template variant to render: schema-enforced requests omit the inline JSON example"""
+        model = self.config.get_model_config(task_type)['model']
+        if (self.config.ENABLE_JSON_MODE and template.schema_prompt is not None
+                and self.config.supports_structured_outputs(model)):
+            return template.schema_prompt
+        return template
+    
+    def _prompt_token_budget(self, task_type: str) -> int:
+        """Prompt tokens available for task_type once its output allowance is reserved"""
+        task_config = self.config.get_model_config(task_type)
+        return self.config.MODEL_CONTEXT_TOKENS - task_config['max_tokens'] - self.config.PROMPT_TOKEN_MARGIN
+    
+    def _prompt_cache_key(self, prompt: str) -> Optional[str]:
+        """
+        Routing key for the provider prompt cache: requests sharing their leading text
+        (the template's static prefix) are sent to the same cache
+        """
+        prefix_chars = self.config.PROMPT_CACHE_KEY_PREFIX_CHARS
+        if prefix_chars <= 0:
+            return None
+        return "pdfx-" + hashlib.sha256(prompt[:prefix_chars].encode('utf-8')).hexdigest()[:16]
     
-    def _make_gpt_request(self, prompt: str, task_type: str) -> Dict[str, Any]:
+    def _make_gpt_request(self, prompt: str, task_type: str,
+                          response_format: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Make a GPT request with task-specific model selection and cost tracking"""
         
         # Get optimized config for this task
@@ -26,16 +132,50 @@ class OpenAIService:
         
         request_start = time.time()
         
+        # Identical prompts at temperature 0 are deterministic, so serve repeats from memory
+        cache_key = None
+        if task_config['temperature'] == 0:
+            # Hash the prompt's UTF-8 bytes directly rather than via an escaped JSON copy
+            digest = hashlib.sha256(f"{task_config['model']}\0{task_config['max_tokens']}\0".encode('utf-8'))
+            digest.update(prompt.encode('utf-8'))
+            cache_key = digest.hexdigest()
+            with self._response_cache_lock:
+                cached = self._response_cache.get(cache_key)
+                if cached is not None:
+                    self._response_cache.move_to_end(cache_key)
+                    self.response_cache_hits += 1
+                else:
+                    self.response_cache_misses += 1
+            if cached is not None:
+                print(f"DEBUG - Response cache hit for {task_type}")
+                return {
+                    "success": True,
+                    "data": json.loads(cached),  # Fresh copy, callers mutate results
+                    "usage": {},
+                    "model_used": task_config['model'],
+                    "task_type": task_type,
+                    "response_time": time.time() - request_start,
+                    "cache_hit": True
+                }
+        
         for attempt in range(self.config.MAX_RETRIES):
             try:
+                request_kwargs = self._response_format_kwargs(task_config['model'], response_format)
+                cache_routing_key = self._prompt_cache_key(prompt)
+                if cache_routing_key:
+                    request_kwargs['extra_body'] = {"prompt_cache_key": cache_routing_key}
+                
                 response = self.client.chat.completions.create(
                     model=task_config['model'],
                     messages=[{"role": "user", "content": prompt}],
                     temperature=task_config['temperature'],
                     max_tokens=task_config['max_tokens'],
-                    timeout=self.config.TIMEOUT
+                    timeout=self.config.TIMEOUT,
+                    **request_kwargs
                 )
                 
+                self._record_prompt_cache_usage(response, task_type)
+                
                 # Track usage and cost if enabled
                 usage_info = {}
                 if self.config.ENABLE_COST_TRACKING:
@@ -44,7 +184,6 @@ class OpenAIService:
                 content = response.choices[0].message.content.strip()
                 
                 # Save prompt and response for debugging
-                import os
                 debug_dir = "debug_responses"
                 os.makedirs(debug_dir, exist_ok=True)
                 debug_file = os.path.join(debug_dir, f"debug_{task_type}_{int(time.time())}.txt")
@@ -69,15 +208,26 @@ class OpenAIService:
                 print(f"DEBUG - Prompt & response saved to: {debug_file}")
                 
                 # Try to parse JSON, with fallback handling
+                # Only a complete reply that parsed as-is is cached; repaired or fallback results
+                # (and replies cut off at max_tokens) must be retried, not replayed from memory
+                cacheable = response.choices[0].finish_reason == "stop"
                 try:
                     result = json.loads(content)
                 except json.JSONDecodeError:
+                    cacheable = False
                     # Try multiple JSON extraction strategies
                     result = self._extract_json_from_response(content, task_config['model'], task_type)
                     if not result["success"]:
                         return result
                     result = result["data"]
                 
+                if cache_key is not None and cacheable:
+                    serialized = json.dumps(result)
+                    with self._response_cache_lock:
+                        self._response_cache[cache_key] = serialized
+                        if len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                            self._response_cache.popitem(last=False)
+                
                 return {
                     "success": True, 
                     "data": result,
@@ -112,12 +262,173 @@ class OpenAIService:
         
         return {"success": False, "error": "Maximum retries exceeded"}
     
+    def close(self):
+        """Close the shared HTTP connection pool and the vision extractor's document handles"""
+        self.vision_extractor.close()
+        self._http_client.close()
+    
+    def warmup_prompt_cache(self, force: bool = False) -> bool:
+        """Prime the provider prompt cache with every template prefix on a background thread"""
+        if not self.config.ENABLE_PROMPT_WARMUP:
+            return False
+        
+        with self._warmup_lock:
+            if self._warmup_running:
+                return False
+            fresh = (self.warmup_completed_at is not None and
+                     time.time() - self.warmup_completed_at < self.config.PROMPT_CACHE_TTL)
+            if fresh and not force:
+                return False
+            self._warmup_running = True
+        
+        threading.Thread(target=self._run_prompt_warmup, daemon=True).start()
+        return True
+    
+    def _run_prompt_warmup(self):
+        """Send one max_tokens=1 request per template whose prefix is long enough to be cached"""
+        # Rendering with empty inputs yields each template's static text in request order
+        warmup_prompts = [
+            (self._prompt_for(template, task_type)(**dict.fromkeys(template.fields, "")), task_type,
+             template.response_format)
+            for template, task_type in self.WARMUP_TEMPLATES
+        ]
+        warmup_prompts += [
+            (render_extraction_prompt("", [], employee_profile=employee_profile), 'data_extraction', None)
+            for employee_profile in (False, True)
+        ]
+        # The provider only caches prompts above a minimum length
+        warmup_prompts = [
+            item for item in warmup_prompts
+            if estimate_tokens(item[0]) >= self.config.PROMPT_CACHE_MIN_TOKENS
+        ]
+        
+        def warm(item):
+            prompt, task_type, response_format = item
+            task_config = self.config.get_model_config(task_type)
+            # Same response_format as the real request, since it is part of the cached prefix
+            request_kwargs = self._response_format_kwargs(task_config['model'], response_format)
+            cache_routing_key = self._prompt_cache_key(prompt)
+            if cache_routing_key:
+                request_kwargs['extra_body'] = {"prompt_cache_key": cache_routing_key}
+            try:
+                self.client.chat.completions.create(
+                    model=task_config['model'],
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=task_config['temperature'],
+                    max_tokens=1,
+                    timeout=self.config.TIMEOUT,
+                    **request_kwargs
+                )
+            except Exception as e:
+                print(f"DEBUG - Prompt cache warmup request failed: {e}")
+        
+        try:
+            with ThreadPoolExecutor(max_workers=self.WARMUP_CONCURRENCY) as executor:
+                list(executor.map(warm, warmup_prompts))
+            self.warmup_completed_at = time.time()
+            print(f"DEBUG - Prompt cache warmed for {len(warmup_prompts)} templates")
+        finally:
+            self._warmup_running = False
+    
+    def submit_batch(self, requests: Dict[str, Tuple[str, str]]) -> str:
+        """
+        Submit prompts to the Batch API (half price, results within the completion window).
+        requests maps custom_id -> (prompt, task_type); returns the batch id.
+        """
+        lines = []
+        for custom_id, (prompt, task_type) in requests.items():
+            task_config = self.config.get_model_config(task_type)
+            body = {
+                "model": task_config['model'],
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": task_config['temperature'],
+                "max_tokens": task_config['max_tokens'],
+                **self._response_format_kwargs(task_config['model'])
+            }
+            cache_routing_key = self._prompt_cache_key(prompt)
+            if cache_routing_key:
+                body["prompt_cache_key"] = cache_routing_key
+            lines.append(json.dumps({
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            }, ensure_ascii=False))
+
+        return self._create_batch(lines)
+
+    def submit_vision_batch(self, pdf_path: str, requests: Dict[str, Tuple[str, int]]) -> str:
+        """
+        Vision counterpart of submit_batch: requests maps custom_id -> (prompt, page_num)
+        and each request carries the rendered page image; returns the batch id
+        """
+        # Render every page up front, in parallel, before building the request lines
+        images = self.vision_extractor.render_pages(pdf_path, [page_num for _, page_num in requests.values()])
+        lines = [
+            json.dumps(self.vision_extractor.build_batch_request(custom_id, prompt, images[page_num]),
+                       ensure_ascii=False)
+            for custom_id, (prompt, page_num) in requests.items()
+        ]
+        return self._create_batch(lines)
+
+    def _create_batch(self, lines: List[str]) -> str:
+        """Upload JSONL request lines and start a Batch API job over them"""
+        batch_file = self.client.files.create(
+            file=("batch_requests.jsonl", "\n".join(lines).encode('utf-8')),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.config.BATCH_COMPLETION_WINDOW
+        )
+        print(f"DEBUG - Submitted batch {batch.id} with {len(lines)} requests")
+        return batch.id
+
+    def collect_batch(self, batch_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+        """
+        Results of a submitted batch keyed by custom_id, in the _make_gpt_request result
+        shape, or None while the batch is still running
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("validating", "in_progress", "finalizing"):
+            return None
+        if batch.status != "completed":
+            print(f"ERROR - Batch {batch_id} ended with status {batch.status}")
+
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                body = response.get("body") or {}
+                if entry.get("error") or response.get("status_code") != 200:
+                    error = entry.get("error") or body.get("error")
+                    results[entry["custom_id"]] = {"success": False, "error": f"Batch request failed: {error}"}
+                    continue
+
+                model = body.get("model", "")
+                content = body["choices"][0]["message"]["content"].strip()
+                try:
+                    data = json.loads(content)
+                except json.JSONDecodeError:
+                    parsed = self._extract_json_from_response(content, model, 'batch')
+                    if not parsed["success"]:
+                        results[entry["custom_id"]] = parsed
+                        continue
+                    data = parsed["data"]
+                results[entry["custom_id"]] = {"success": True, "data": data, "model_used": model}
+
+        return results
+
     def _extract_json_from_response(self, content: str, model: str, task_type: str) -> Dict[str, Any]:
         """Extract JSON from response using multiple fallback strategies"""
-        import re
-        
         # Strategy 1: Extract from markdown code blocks
-        json_match = re.search(r'```(?:json)?\s*(\{[\s\S]*?\})\s*```', content)
+        json_match = _JSON_CODE_BLOCK.search(content)
         if json_match:
             try:
                 json_str = json_match.group(1).strip()
@@ -128,7 +439,7 @@ class OpenAIService:
                 print(f"DEBUG - JSON in code block failed: {e}")
         
         # Strategy 2: Extract from response without code blocks
-        json_match = re.search(r'(\{[\s\S]*\})', content)
+        json_match = _JSON_OBJECT.search(content)
         if json_match:
             try:
                 json_str = json_match.group(1).strip()
@@ -199,8 +510,7 @@ class OpenAIService:
     def _clean_json_string(self, json_str: str) -> str:
         """Clean common JSON formatting issues"""
         # Remove any trailing commas before closing brackets/braces
-        import re
-        cleaned = re.sub(r',\s*([}\]])', r'\1', json_str)
+        cleaned = _TRAILING_COMMA.sub(r'\1', json_str)
         
         # Fix any unescaped quotes in strings (basic attempt)
         # This is a simple fix - for more complex cases, might need more sophisticated parsing
@@ -219,6 +529,39 @@ class OpenAIService:
             
         return cleaned
     
+    @staticmethod
+    def _cached_prompt_tokens(usage) -> int:
+        """Prompt tokens the provider served from its prefix cache (0 when not reported)"""
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return (getattr(details, 'cached_tokens', None) or 0) if details is not None else 0
+    
+    def _record_prompt_cache_usage(self, response, task_type: str) -> None:
+        """Count cached vs uncached prompt tokens per task type, to verify prefix reuse"""
+        usage = getattr(response, 'usage', None)
+        if usage is None or not usage.prompt_tokens:
+            return
+        cached = self._cached_prompt_tokens(usage)
+        with self._prompt_cache_stats_lock:
+            self.prompt_cache_tokens[(task_type, 'hit')] += cached
+            self.prompt_cache_tokens[(task_type, 'miss')] += usage.prompt_tokens - cached
+        print(f"DEBUG - Prompt cache [{task_type}]: {cached}/{usage.prompt_tokens} prompt tokens cached "
+              f"(hit ratio {cached / usage.prompt_tokens:.2f})")
+    
+    def get_prompt_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Cumulative cached/uncached prompt tokens and hit ratio per task type"""
+        with self._prompt_cache_stats_lock:
+            counts = dict(self.prompt_cache_tokens)
+        stats = {}
+        for task_type in sorted({task for task, _ in counts}):
+            hit = counts.get((task_type, 'hit'), 0)
+            miss = counts.get((task_type, 'miss'), 0)
+            stats[task_type] = {
+                'cached_tokens': hit,
+                'uncached_tokens': miss,
+                'hit_ratio': round(hit / (hit + miss), 4) if hit + miss else 0.0
+            }
+        return stats
+    
     def _track_usage(self, response, task_type: str, model: str) -> Dict[str, Any]:
         """Track token usage and estimated costs"""
         
@@ -235,6 +578,7 @@ class OpenAIService:
             input_tokens = usage.prompt_tokens
             output_tokens = usage.completion_tokens
             total_tokens = usage.total_tokens
+            cached_tokens = self._cached_prompt_tokens(usage)
             
             # Calculate cost
             model_pricing = pricing.get(model, {'input': 0.01, 'output': 0.01})  # fallback
@@ -244,6 +588,7 @@ class OpenAIService:
             
             return {
                 'input_tokens': input_tokens,
+                'cached_input_tokens': cached_tokens,
                 'output_tokens': output_tokens,
                 'total_tokens': total_tokens,
                 'estimated_cost': round(total_cost, 6),
@@ -256,6 +601,13 @@ class OpenAIService:
     def classify_structure(self, text: str, text_blocks: list) -> Dict[str, Any]:
         """Step 1: Classify PDF structure as Form, Table, or Mixed"""
         
+        # Unambiguous pages are classified by layout rules without an LLM round-trip
+        if self.config.ENABLE_FAST_CLASSIFICATION:
+            fast_result = self._classify_structure_fast(text, text_blocks)
+            if fast_result is not None:
+                print(f"DEBUG - Rule-based classification: {fast_result['classification']}")
+                return fast_result
+        
         # Create a simplified representation of the document
         doc_info = {
             "text_length": len(text),
@@ -263,13 +615,13 @@ class OpenAIService:
             "sample_text":  text
         }
         
-        prompt = self.prompts.STRUCTURE_CLASSIFICATION.format(
+        prompt = self._prompt_for(STRUCTURE_CLASSIFICATION, 'classification')(
             text_length=doc_info['text_length'],
             total_blocks=doc_info['total_blocks'],
             sample_text=doc_info['sample_text']
         )
         
-        result = self._make_gpt_request(prompt, 'classification')
+        result = self._make_gpt_request(prompt, 'classification', response_format=STRUCTURE_CLASSIFICATION.response_format)
         
         if result["success"]:
             return result["data"]
@@ -282,6 +634,40 @@ class OpenAIService:
                 "error": result["error"]
             }
     
+    def _classify_structure_fast(self, text: str, text_blocks: list) -> Optional[Dict[str, Any]]:
+        """Classify pages that are clearly a form or clearly a table; None defers to the LLM"""
+        lines = [line for line in text.splitlines() if line.strip()]
+        if len(lines) < self.FAST_CLASSIFICATION_MIN_LINES:
+            return None
+        
+        # "Label: value" / "Label:" lines mark form fields
+        label_lines = sum(1 for line in lines if _LABEL_LINE.match(line))
+        
+        # Spans sharing a vertical centre form one visual row; rows of 3+ spans are table-like
+        rows = Counter(
+            round((block["bbox"][1] + block["bbox"][3]) / 2 / self.FAST_CLASSIFICATION_ROW_TOLERANCE)
+            for block in text_blocks
+        )
+        table_rows = sum(1 for span_count in rows.values() if span_count >= 3)
+        
+        if label_lines >= 3 and label_lines / len(lines) >= 0.3 and table_rows < 3:
+            classification = "form"
+            reasoning = f"{label_lines} of {len(lines)} lines are label/value pairs and no columnar rows were found"
+        elif table_rows >= 5 and table_rows / max(len(rows), 1) >= 0.5 and label_lines <= 2:
+            classification = "table"
+            reasoning = f"{table_rows} of {len(rows)} rows have three or more aligned columns and there are no label/value pairs"
+        else:
+            # Both or neither pattern dominates - leave it to the LLM
+            return None
+        
+        return {
+            "classification": classification,
+            "confidence": 0.9,
+            "reasoning": reasoning,
+            "regions": [],
+            "classification_method": "rule_based"
+        }
+    
     def identify_fields(self, text: str, classification_result: Dict[str, Any], user_feedback: str = "", feedback_history: list = None, word_coordinates: list = None) -> Dict[str, Any]:
         """Step 2: Comprehensive field and table extraction with spatial preprocessing support"""
         
@@ -306,7 +692,8 @@ class OpenAIService:
         feedback_context = self._prepare_feedback_context(user_feedback, feedback_history)
         
         # Use single comprehensive extraction prompt with enhanced feedback handling
-        prompt = self.prompts.COMPREHENSIVE_FIELD_EXTRACTION.format(
+        prompt = COMPREHENSIVE_FIELD_EXTRACTION.render_within(
+            self._prompt_token_budget('field_identification'),
             text=processed_text,
             user_feedback=feedback_context
         )
@@ -489,10 +876,11 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         """Identify form field labels and values"""
         
         print(f"DEBUG - Starting form field identification, text length: {len(text)}")
-        prompt = self.prompts.FORM_FIELD_IDENTIFICATION.format(text=text)
+        template = self._prompt_for(FORM_FIELD_IDENTIFICATION, 'field_identification')
+        prompt = template.render_within(self._prompt_token_budget('field_identification'), text=text)
         print(f"DEBUG - Form prompt length: {len(prompt)}")
         
-        result = self._make_gpt_request(prompt, 'field_identification')
+        result = self._make_gpt_request(prompt, 'field_identification', response_format=FORM_FIELD_IDENTIFICATION.response_format)
         print(f"DEBUG - Form field result: {result.get('success', False)}")
         
         if result["success"]:
@@ -504,10 +892,11 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         """Identify table headers and structure"""
         
         print(f"DEBUG - Starting table header identification, text length: {len(text)}")
-        prompt = self.prompts.TABLE_HEADER_IDENTIFICATION.format(text=text)
+        template = self._prompt_for(TABLE_HEADER_IDENTIFICATION, 'field_identification')
+        prompt = template.render_within(self._prompt_token_budget('field_identification'), text=text)
         print(f"DEBUG - Table prompt length: {len(prompt)}")
         
-        result = self._make_gpt_request(prompt, 'field_identification')
+        result = self._make_gpt_request(prompt, 'field_identification', response_format=TABLE_HEADER_IDENTIFICATION.response_format)
         print(f"DEBUG - Table header result: {result.get('success', False)}")
         
         if result["success"]:
@@ -627,6 +1016,13 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         print(f"DEBUG Step3 - Normalized form fields: {type(form_fields_schema)} with {len(form_fields_schema) if isinstance(form_fields_schema, (dict, list)) else 0} items")
         print(f"DEBUG Step3 - Tables schema: {len(tables_schema)} tables")
 
+        # Refine the previous result with a delta request when enabled
+        if user_feedback.strip() and self.config.ENABLE_DELTA_REFINEMENT and previous_result:
+            refined = self._refine_unified_schema_data(text, user_feedback, previous_result)
+            if refined is not None:
+                return refined
+            print(f"DEBUG Step3 - Delta refinement failed, falling back to full extraction")
+
         # Use enhanced feedback analysis if user feedback is provided
         if user_feedback.strip():
             print(f"DEBUG Step3 - Using enhanced feedback analysis for prompt generation")
@@ -636,10 +1032,8 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         else:
             # Use standard unified schema extraction
             print(f"DEBUG Step3 - Using standard unified schema extraction")
-            prompt = self.prompts.UNIFIED_SCHEMA_EXTRACTION_BACKUP.format(
-                form_fields_schema=form_fields_str,
-                tables_schema=tables_str,
-                text=text
+            prompt = render_unified_extraction_prompt(
+                form_fields_str, tables_str, text, max_tokens=self._prompt_token_budget('data_extraction')
             )
 
         print(f"DEBUG Step3 - Unified prompt length: {len(prompt)}")
@@ -685,6 +1079,57 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
                 }
             }
 
+    def _refine_unified_schema_data(self, text: str, user_feedback: str,
+                                    previous_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Apply feedback by requesting only the changed fields/tables and merging them into previous_result"""
+        form_data = dict(previous_result.get("extracted_data") or {})
+        table_data = list(previous_result.get("table_data") or [])
+        previous_extraction = json.dumps(
+            {"form_data": form_data, "table_data": table_data}, ensure_ascii=False, separators=(",", ":")
+        )
+
+        prompt = FORM_DATA_REFINE_DELTA.render_within(
+            self._prompt_token_budget('data_extraction'), text=text, previous_extraction=previous_extraction, user_feedback=user_feedback.strip()
+        )
+        print(f"DEBUG Step3 - Delta refinement prompt length: {len(prompt)}")
+
+        result = self._make_gpt_request(prompt, 'data_extraction')
+        if not result["success"]:
+            print(f"ERROR Step3 - Delta refinement failed: {result.get('error')}")
+            return None
+
+        delta = result["data"]
+        corrected_fields = delta.get("form_data") or {}
+        corrected_tables = delta.get("table_data") or []
+        form_data.update(corrected_fields)
+
+        # Changed tables come back whole and replace the previous table of the same name
+        table_index = {table.get("table_name"): i for i, table in enumerate(table_data)}
+        for table in corrected_tables:
+            i = table_index.get(table.get("table_name"))
+            if i is None:
+                table_data.append(table)
+            else:
+                table_data[i] = table
+
+        print(f"DEBUG Step3 - Delta refinement changed {len(corrected_fields)} fields and {len(corrected_tables)} tables")
+
+        previous_summary = previous_result.get("extraction_summary", {})
+        return {
+            "extracted_data": form_data,
+            "table_data": table_data,
+            "extraction_summary": {
+                "total_extracted_fields": len(form_data),
+                "total_extracted_tables": len(table_data),
+                "total_table_rows_extracted": sum(len(table.get("rows", [])) for table in table_data),
+                "extraction_success": True,
+                "extraction_method": "unified_schema_delta",
+                "extraction_confidence": previous_summary.get("extraction_confidence", 0.9),
+                "corrected_fields": list(corrected_fields),
+                "corrected_tables": [table.get("table_name") for table in corrected_tables]
+            }
+        }
+
     def _normalize_form_fields_schema(self, form_fields) -> Dict[str, Any]:
         """Normalize different Step2 form field formats to consistent schema"""
 
@@ -763,9 +1208,8 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         field_names = [field["label"] for field in fields]
         
         # Use enhanced employee profile extraction prompt
-        prompt = self.prompts.EMPLOYEE_PROFILE_EXTRACTION.format(
-            field_names=field_names,
-            text=text
+        prompt = render_extraction_prompt(
+            text, field_names, employee_profile=True, max_tokens=self._prompt_token_budget('data_extraction')
         )
         
         print("=== CLAUDE DEBUG: About to call _make_gpt_request for data_extraction ===")
@@ -783,8 +1227,9 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         header_names = [header["name"] for header in headers]
         
         # Use enhanced employee profile table extraction prompt
-        prompt = self.prompts.EMPLOYEE_PROFILE_TABLE_EXTRACTION.format(
-            header_names=header_names,
+        prompt = EMPLOYEE_PROFILE_TABLE_EXTRACTION.render_within(
+            self._prompt_token_budget('data_extraction'),
+            header_names=serialize_field_names(header_names),
             text=text
         )
         
@@ -812,28 +1257,20 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
             field_names = [field.get('field_name', str(field)) for field in form_fields]
         else:
             field_names = form_fields
-        field_names_str = ', '.join(field_names)
-
+        # Feedback, when given, adds a refinement section to the shared extraction prompt
+        prompt = render_extraction_prompt(
+            text,
+            field_names,
+            user_feedback=user_feedback,
+            max_tokens=self._prompt_token_budget('data_extraction')  # Truncates text to fit the context window
+        )
         if user_feedback.strip():
-            # Use feedback-enhanced prompt
-            prompt = self.prompts.FORM_DATA_EXTRACTION_WITH_FEEDBACK.format(
-                field_names=field_names_str,
-                text=text[:4000],  # Limit text to prevent context overflow
-                user_feedback=user_feedback
-            )
             print(f"DEBUG Step3 - Using feedback-enhanced prompt for form field extraction")
         else:
-            # Use standard prompt
-            prompt = self.prompts.FORM_DATA_EXTRACTION.format(
-                field_names=field_names_str,
-                text=text[:4000]  # Limit text to prevent context overflow
-            )
             print(f"DEBUG Step3 - Using standard prompt for form field extraction")
 
         # Save additional context to debug file
         try:
-            import os
-            import time
             debug_dir = "debug_responses"
             os.makedirs(debug_dir, exist_ok=True)
             context_file = os.path.join(debug_dir, f"step3_form_extraction_context_{int(time.time())}.txt")
@@ -874,6 +1311,67 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
                 "extracted_data": {}
             }
     
+    def extract_form_data_batched(self, page_texts: Dict[int, str], field_names: List[str]) -> Dict[int, Dict[str, Any]]:
+        """Extract the same form fields from several pages, packing as many pages per request as fit"""
+        if not page_texts:
+            return {}
+
+        # Split pages into batches that stay under the input budget
+        template = BATCHED_FORM_DATA_EXTRACTION
+        field_names_json = serialize_field_names(field_names)
+        overhead = template.estimate_tokens(field_names=field_names_json, pages="")
+        budget = self.config.MAX_BATCH_INPUT_TOKENS - overhead
+
+        batches = []
+        current, used = [], 0
+        for page_id, text in sorted(page_texts.items()):
+            cost = estimate_tokens(text) + 8  # plus its <<<PAGE id=N>>> delimiter line
+            if current and (used + cost > budget or len(current) >= self.config.MAX_PAGES_PER_BATCH):
+                batches.append(current)
+                current, used = [], 0
+            current.append((page_id, text))
+            used += cost
+        if current:
+            batches.append(current)
+
+        print(f"DEBUG - Batched form extraction: {len(page_texts)} pages in {len(batches)} requests")
+
+        results = {}
+        for batch in batches:
+            if len(batch) == 1:
+                # A lone page (including one that exceeds the budget by itself) uses the single-page prompt
+                page_id, text = batch[0]
+                results[page_id] = self._extract_form_fields_llm(text, field_names)
+                continue
+
+            prompt = template(field_names=field_names_json, pages=format_page_blocks(batch))
+            result = self._make_gpt_request(prompt, 'data_extraction')
+
+            if not result["success"]:
+                print(f"DEBUG - Batched form extraction failed: {result.get('error')}")
+                for page_id, _text in batch:
+                    results[page_id] = {"success": False, "error": result["error"], "extracted_data": {}}
+                continue
+
+            batch_ids = {page_id for page_id, _text in batch}
+            for entry in result["data"].get("pages", []):
+                try:
+                    page_id = int(entry.get("page_id"))
+                except (TypeError, ValueError):
+                    continue
+                if page_id in batch_ids:
+                    results[page_id] = {"success": True, "extracted_data": entry.get("extracted_data", {})}
+
+            # Pages the model skipped are reported as failures rather than silently dropped
+            for page_id, _text in batch:
+                results.setdefault(page_id, {
+                    "success": False,
+                    "error": "Page missing from batched response",
+                    "extracted_data": {}
+                })
+
+        return results
+
     def _extract_table_data_llm(self, text: str, headers: List[str]) -> Dict[str, Any]:
         """Extract table data using LLM as fallback"""
 
@@ -892,10 +1390,11 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         print(f"DEBUG - _extract_table_data_llm called with headers: {headers}")
         print(f"DEBUG - Using TABLE_DATA_EXTRACTION prompt")
 
-        headers_str = ', '.join(headers)
-        prompt = self.prompts.TABLE_DATA_EXTRACTION.format(
+        headers_str = serialize_field_names(headers)
+        prompt = TABLE_DATA_EXTRACTION.render_within(
+            self._prompt_token_budget('data_extraction'),
             header_names=headers_str,
-            text=text[:3000]  # Limit text to avoid context issues
+            text=text
         )
 
         # Save the actual prompt to debug file
@@ -1007,18 +1506,25 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
                             word_coordinates: List[Dict] = None) -> Dict[str, Any]:
         """Extract data using enhanced template with user feedback improvements"""
 
-        # Get the base structure and enhancements
-        base_structure = enhanced_template.get('base_structure', {})
-        enhancements = enhanced_template.get('extraction_enhancements', {})
+        # Build enhanced extraction prompt and make the extraction request
+        enhanced_prompt = self.build_enhanced_extraction_prompt(text, enhanced_template, word_coordinates)
+        result = self._make_gpt_request(enhanced_prompt, 'data_extraction')
+
+        return self.finish_enhanced_extraction(result, text, enhanced_template, word_coordinates)
 
-        # Build enhanced extraction prompt
-        enhanced_prompt = self._build_enhanced_extraction_prompt(
-            text, base_structure, enhancements, word_coordinates
+    def build_enhanced_extraction_prompt(self, text: str, enhanced_template: Dict[str, Any],
+                                         word_coordinates: List[Dict] = None) -> str:
+        """Enhanced text-extraction prompt for one page, for realtime or batch dispatch"""
+        return self._build_enhanced_extraction_prompt(
+            text,
+            enhanced_template.get('base_structure', {}),
+            enhanced_template.get('extraction_enhancements', {}),
+            word_coordinates
         )
 
-        # Make the extraction request
-        result = self._make_gpt_request(enhanced_prompt, 'data_extraction')
-
+    def finish_enhanced_extraction(self, result: Dict[str, Any], text: str, enhanced_template: Dict[str, Any],
+                                   word_coordinates: List[Dict] = None) -> Dict[str, Any]:
+        """Turn an enhanced extraction response into the page result, falling back to basic extraction"""
         if result["success"]:
             extracted_data = result["data"]
 
@@ -1033,23 +1539,32 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         else:
             # Fallback to basic extraction if enhanced fails
             print(f"Enhanced extraction failed, falling back to basic: {result.get('error')}")
-            return self.extract_data(text, base_structure, word_coordinates)
+            return self.extract_data(text, enhanced_template.get('base_structure', {}), word_coordinates)
 
     def extract_data_with_vision_enhanced(self, pdf_path: str, enhanced_template: Dict[str, Any],
                                         page_num: int = 0) -> Dict[str, Any]:
         """Extract data using enhanced template with vision-based processing"""
 
-        base_structure = enhanced_template.get('base_structure', {})
-        enhancements = enhanced_template.get('extraction_enhancements', {})
-
         # Build enhanced vision prompt
-        enhanced_prompt = self._build_enhanced_vision_prompt(base_structure, enhancements)
+        enhanced_prompt = self.build_enhanced_vision_prompt(enhanced_template)
 
         # Use vision extractor with enhanced prompt
         result = self.vision_extractor.extract_with_enhanced_prompt(
             pdf_path, enhanced_prompt, page_num
         )
 
+        return self.finish_enhanced_vision_extraction(result, pdf_path, enhanced_template, page_num)
+
+    def build_enhanced_vision_prompt(self, enhanced_template: Dict[str, Any]) -> str:
+        """Enhanced vision prompt for a template (the same for every page), for realtime or batch dispatch"""
+        return self._build_enhanced_vision_prompt(
+            enhanced_template.get('base_structure', {}),
+            enhanced_template.get('extraction_enhancements', {})
+        )
+
+    def finish_enhanced_vision_extraction(self, result: Dict[str, Any], pdf_path: str,
+                                          enhanced_template: Dict[str, Any], page_num: int = 0) -> Dict[str, Any]:
+        """Turn an enhanced vision response into the page result, falling back to basic vision extraction"""
         if result.get('success'):
             extracted_data = result['data']
 
@@ -1064,7 +1579,7 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         else:
             # Fallback to basic vision extraction
             print(f"Enhanced vision extraction failed, falling back to basic: {result.get('error')}")
-            return self.extract_data_with_vision(pdf_path, base_structure, page_num)
+            return self.extract_data_with_vision(pdf_path, enhanced_template.get('base_structure', {}), page_num)
 
     def _build_enhanced_extraction_prompt(self, text: str, base_structure: Dict[str, Any],
                                         enhancements: Dict[str, Any],
@@ -1072,43 +1587,34 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         """Build enhanced extraction prompt with feedback-derived improvements"""
 
         # Start with base extraction instructions
-        base_prompt = self.prompts.COMPREHENSIVE_DATA_EXTRACTION.format(
+        base_prompt = COMPREHENSIVE_DATA_EXTRACTION.render_within(
+            self._prompt_token_budget('data_extraction'),
             text=text,
             field_structure=self._format_field_structure(base_structure)
         )
 
-        # Add enhancement instructions
+        # Add enhancement instructions, one pre-joined block per section
         enhancement_sections = []
 
-        if enhancements.get('detection_improvements'):
-            enhancement_sections.append("### ENHANCED FIELD DETECTION")
-            for improvement in enhancements['detection_improvements']:
-                enhancement_sections.append(f"- {improvement}")
-
-        if enhancements.get('extraction_refinements'):
-            enhancement_sections.append("### EXTRACTION REFINEMENTS")
-            for refinement in enhancements['extraction_refinements']:
-                enhancement_sections.append(f"- {refinement}")
-
-        if enhancements.get('spatial_adjustments') and word_coordinates:
-            enhancement_sections.append("### SPATIAL ANALYSIS IMPROVEMENTS")
-            for adjustment in enhancements['spatial_adjustments']:
-                enhancement_sections.append(f"- {adjustment}")
-
-        if enhancements.get('format_standardizations'):
-            enhancement_sections.append("### FORMAT STANDARDIZATION")
-            for standard in enhancements['format_standardizations']:
-                enhancement_sections.append(f"- {standard}")
+        for key, header in self.ENHANCEMENT_SECTION_HEADERS:
+            if key == 'spatial_adjustments' and not word_coordinates:
+                continue
+            # Feedback rounds keep adding instructions - keep each section bounded
+            items = self._dedupe_enhancements(enhancements.get(key))
+            if items:
+                body = "\n".join(f"- {item}" for item in items)
+                enhancement_sections.append(f"{header}\n{body}")
 
         # Combine base prompt with enhancements
         if enhancement_sections:
+            enhancement_block = "\n\n".join(enhancement_sections)
             enhanced_prompt = f"""
             {base_prompt}
 
             ## USER-FEEDBACK-DRIVEN ENHANCEMENTS
             Apply these learned improvements from user feedback:
 
-            {chr(10).join(enhancement_sections)}
+            {enhancement_block}
 
             ### CRITICAL INSTRUCTION
             These enhancements are based on actual user corrections. Apply them carefully to avoid the same mistakes.
@@ -1140,6 +1646,11 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
         if enhancements.get('format_standardizations'):
             enhancement_instructions.extend(enhancements['format_standardizations'])
 
+        # Feedback rounds keep adding instructions - keep the prompt bounded
+        enhancement_instructions = self._dedupe_enhancements(enhancement_instructions)
+
+        structure_json = json.dumps(base_structure, indent=2)
+
         if enhancement_instructions:
             enhanced_prompt = f"""
             {base_instructions}
@@ -1148,7 +1659,7 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
             {chr(10).join(f"- {instruction}" for instruction in enhancement_instructions)}
 
             Field Structure to Extract:
-            {json.dumps(base_structure, indent=2)}
+            {structure_json}
 
             Apply the enhanced instructions carefully to improve extraction accuracy.
             """
@@ -1157,13 +1668,43 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
             {base_instructions}
 
             Field Structure to Extract:
-            {json.dumps(base_structure, indent=2)}
+            {structure_json}
             """
 
         return enhanced_prompt
 
+    def _dedupe_enhancements(self, items: List[Any]) -> List[str]:
+        """Drop repeated/paraphrase-equivalent instructions (case and whitespace insensitive) and cap the list"""
+        unique = {}
+        for item in items or []:
+            text = str(item).strip()
+            normalized = " ".join(text.lower().split())
+            if normalized and normalized not in unique:
+                unique[normalized] = text
+        return list(unique.values())[:self.config.MAX_ENHANCEMENTS]
+
     def _format_field_structure(self, structure: Dict[str, Any]) -> str:
-        """Format field structure for prompt inclusion"""
+        """Format field structure for prompt inclusion (memoized per schema content)"""
+
+        # Key only on the parts that affect the output so edits to the schema invalidate the entry
+        cache_key = json.dumps(
+            [structure.get('form_fields'), structure.get('tables')], sort_keys=True, default=str
+        )
+        cached = self._field_structure_cache.get(cache_key)
+        if cached is not None:
+            self._field_structure_cache.move_to_end(cache_key)
+            return cached
+
+        formatted = self._build_field_structure_text(structure)
+
+        self._field_structure_cache[cache_key] = formatted
+        if len(self._field_structure_cache) > self.FIELD_STRUCTURE_CACHE_SIZE:
+            self._field_structure_cache.popitem(last=False)
+
+        return formatted
+
+    def _build_field_structure_text(self, structure: Dict[str, Any]) -> str:
+        """Render the field structure listing used in extraction prompts"""
 
         formatted_parts = []
 
@@ -1182,6 +1723,43 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
 
         return "\n".join(formatted_parts)
 
+    def _analyze_feedback_cached(self, user_feedback: str, previous_result: Dict[str, Any],
+                                 field_mapping: Dict[str, Any],
+                                 feedback_history: List[Dict] = None) -> Dict[str, Any]:
+        """Run feedback analysis, reusing a recent result for identical feedback/schema/history"""
+
+        cache_key = hashlib.blake2b(
+            user_feedback.encode('utf-8') + b"|" +
+            json.dumps(field_mapping, sort_keys=True, default=str).encode('utf-8') + b"|" +
+            json.dumps(feedback_history or [], sort_keys=True, default=str).encode('utf-8'),
+            digest_size=16
+        ).hexdigest()
+
+        now = time.time()
+        cached = self._feedback_analysis_cache.get(cache_key)
+        if cached is not None:
+            cached_at, analysis = cached
+            if now - cached_at < self.FEEDBACK_ANALYSIS_CACHE_TTL:
+                self._feedback_analysis_cache.move_to_end(cache_key)
+                print(f"DEBUG Step3 - Reusing cached feedback analysis")
+                return analysis
+            del self._feedback_analysis_cache[cache_key]
+
+        analysis = self.feedback_analyzer.analyze_user_feedback(
+            user_feedback=user_feedback,
+            original_result=previous_result,
+            document_structure=field_mapping,
+            feedback_history=feedback_history
+        )
+
+        # Don't pin a failed analysis in the cache - let the next request retry the LLM
+        if not analysis.get('fallback_used'):
+            self._feedback_analysis_cache[cache_key] = (now, analysis)
+            if len(self._feedback_analysis_cache) > self.FEEDBACK_ANALYSIS_CACHE_SIZE:
+                self._feedback_analysis_cache.popitem(last=False)
+
+        return analysis
+
     def _build_enhanced_unified_prompt(self, form_fields_str: str, tables_str: str, text: str,
                                      user_feedback: str, field_mapping: Dict[str, Any],
                                      previous_result: Dict[str, Any] = None,
@@ -1200,11 +1778,8 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
                 previous_result = {}
 
             # Analyze user feedback with LLM including feedback history
-            feedback_analysis = self.feedback_analyzer.analyze_user_feedback(
-                user_feedback=user_feedback,
-                original_result=previous_result,
-                document_structure=field_mapping,
-                feedback_history=feedback_history
+            feedback_analysis = self._analyze_feedback_cached(
+                user_feedback, previous_result, field_mapping, feedback_history
             )
 
             print(f"DEBUG Step3 - Feedback analysis completed with confidence: {feedback_analysis.get('confidence_score', 0)}")
@@ -1215,21 +1790,18 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
             enhanced_instructions = feedback_analysis.get('enhanced_instructions', [])
 
             # Format enhancement sections
-            detection_improvements = "\n".join([f"- {imp}" for imp in enhancements.get('detection_improvements', [])])
-            format_handling = "\n".join([f"- {fmt}" for fmt in enhancements.get('format_standardizations', [])])
-            validation_rules_str = "\n".join([f"- {rule}" for rule in validation_rules])
-            enhanced_instructions_str = "\n".join([f"- {inst}" for inst in enhanced_instructions])
+            detection_improvements = "\n".join([f"- {imp}" for imp in self._dedupe_enhancements(enhancements.get('detection_improvements', []))])
+            format_handling = "\n".join([f"- {fmt}" for fmt in self._dedupe_enhancements(enhancements.get('format_standardizations', []))])
+            validation_rules_str = "\n".join([f"- {rule}" for rule in self._dedupe_enhancements(validation_rules)])
+            enhanced_instructions_str = "\n".join([f"- {inst}" for inst in self._dedupe_enhancements(enhanced_instructions)])
 
             # Build enhanced prompt using the new template
-            enhanced_prompt = self.prompts.UNIFIED_SCHEMA_EXTRACTION.format(
-                form_fields_schema=form_fields_str,
-                tables_schema=tables_str,
-                text=text,
-                enhanced_instructions=enhanced_instructions_str or "No specific enhancements available",
-                validation_rules=validation_rules_str or "Standard validation applies",
-                detection_improvements=detection_improvements or "Standard detection methods apply",
-                format_handling=format_handling or "Standard format handling applies"
-            )
+            enhanced_prompt = render_unified_extraction_prompt(form_fields_str, tables_str, text, enhancements={
+                'enhanced_instructions': enhanced_instructions_str or "No specific enhancements available",
+                'validation_rules': validation_rules_str or "Standard validation applies",
+                'detection_improvements': detection_improvements or "Standard detection methods apply",
+                'format_handling': format_handling or "Standard format handling applies"
+            }, max_tokens=self._prompt_token_budget('data_extraction'))
 
             print(f"DEBUG Step3 - Enhanced prompt generated with feedback analysis")
             return enhanced_prompt
@@ -1239,10 +1811,8 @@ Remember: This is an iterative refinement process. Each feedback builds on the p
             print(f"DEBUG Step3 - Falling back to direct feedback injection")
 
             # Fallback to simple feedback injection if analysis fails
-            fallback_prompt = self.prompts.UNIFIED_SCHEMA_EXTRACTION_BACKUP.format(
-                form_fields_schema=form_fields_str,
-                tables_schema=tables_str,
-                text=text
+            fallback_prompt = render_unified_extraction_prompt(
+                form_fields_str, tables_str, text, max_tokens=self._prompt_token_budget('data_extraction')
             )
             fallback_prompt += f"\n\n**USER FEEDBACK:** {user_feedback}\nApply this feedback to improve extraction accuracy.\n"
 
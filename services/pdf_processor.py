@@ -1,86 +1,281 @@
 import fitz  # PyMuPDF
 import os
-from typing import Dict, List, Any
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import cached_property
+from operator import itemgetter
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple
+
+@dataclass
+class Word:
+    """A single word on a page; derived geometry is computed on demand"""
+    __slots__ = ("text", "x0", "y0", "x1", "y1", "block_no", "line_no", "word_no")
+    text: str
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    block_no: int
+    line_no: int
+    word_no: int
+
+    @property
+    def center_x(self) -> float:
+        return (self.x0 + self.x1) / 2
+
+    @property
+    def center_y(self) -> float:
+        return (self.y0 + self.y1) / 2
+
+    @property
+    def width(self) -> float:
+        return self.x1 - self.x0
+
+    @property
+    def height(self) -> float:
+        return self.y1 - self.y0
+
+    # Dict-style access so the spatial analysis code can keep using word["x0"]
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Legacy dict layout, for JSON-serialization boundaries only"""
+        return {
+            "text": self.text,
+            "x0": self.x0,
+            "y0": self.y0,
+            "x1": self.x1,
+            "y1": self.y1,
+            "center_x": self.center_x,
+            "center_y": self.center_y,
+            "width": self.width,
+            "height": self.height,
+            "block_no": self.block_no,
+            "line_no": self.line_no,
+            "word_no": self.word_no
+        }
+
+class WordArrays(NamedTuple):
+    """Column-oriented (struct-of-arrays) word coordinates for one page, in reading order"""
+    text: Tuple[str, ...]
+    x0: Tuple[float, ...]
+    y0: Tuple[float, ...]
+    x1: Tuple[float, ...]
+    y1: Tuple[float, ...]
+    center_x: Tuple[float, ...]
+    center_y: Tuple[float, ...]
+    block_no: Tuple[int, ...]
+    line_no: Tuple[int, ...]
+    word_no: Tuple[int, ...]
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """Expand to the legacy list-of-dicts layout used by the spatial analysis code"""
+        return [
+            {
+                "text": text,
+                "x0": x0,
+                "y0": y0,
+                "x1": x1,
+                "y1": y1,
+                "center_x": cx,
+                "center_y": cy,
+                "width": x1 - x0,
+                "height": y1 - y0,
+                "block_no": block_no,
+                "line_no": line_no,
+                "word_no": word_no
+            }
+            for text, x0, y0, x1, y1, cx, cy, block_no, line_no, word_no in zip(*self)
+        ]
+
+    def to_words(self) -> List[Word]:
+        """Expand to one slotted Word per entry"""
+        return [
+            Word(text, x0, y0, x1, y1, block_no, line_no, word_no)
+            for text, x0, y0, x1, y1, block_no, line_no, word_no in zip(
+                self.text, self.x0, self.y0, self.x1, self.y1,
+                self.block_no, self.line_no, self.word_no
+            )
+        ]
+
+def _page_is_open(page) -> bool:
+    """Whether a page still belongs to an open document"""
+    return page is not None and page.parent is not None and not page.parent.is_closed
+
+def _compute_text_blocks(page, textpage=None) -> List[Dict[str, Any]]:
+    """Flatten the span-level text blocks of a page"""
+    if not _page_is_open(page):
+        raise ValueError("text_blocks is only available from extract_text_and_structure while the PDFProcessor is open")
+    
+    blocks = page.get_text("dict", textpage=textpage)["blocks"]
+    return [
+        {
+            "text": span["text"],
+            "bbox": span["bbox"],  # [x0, y0, x1, y1]
+            "font": span["font"],
+            "size": span["size"]
+        }
+        for block in blocks if "lines" in block  # Text blocks only
+        for line in block["lines"]
+        for span in line["spans"]
+    ]
+
+@dataclass
+class PageExtraction:
+    """
+    Per-page extraction result; text_blocks is only built when first accessed.
+    Once the PDF is closed or the result is detached from its page (always the case for
+    extract_all_pages results), the mapping view only offers text_blocks if it was read before.
+    """
+    page_num: int
+    text: str
+    word_coordinates: List[Word]
+    page_width: float
+    page_height: float
+    total_pages: int
+    _page: Any = field(default=None, repr=False, compare=False)
+    _textpage: Any = field(default=None, repr=False, compare=False)
+
+    _KEYS = ("page_num", "text", "text_blocks", "word_coordinates",
+             "page_width", "page_height", "total_pages")
+    _DETACHED_KEYS = tuple(key for key in _KEYS if key != "text_blocks")
+
+    @cached_property
+    def text_blocks(self) -> List[Dict[str, Any]]:
+        """Span-level text blocks (kept for backward compatibility)"""
+        return _compute_text_blocks(self._page, self._textpage)
+
+    # Dict-style access so existing page_data['text'] / page_data.get(...) callers keep working
+    def keys(self) -> Tuple[str, ...]:
+        """Keys whose values can be read: text_blocks only once built or while its page is open"""
+        if "text_blocks" in self.__dict__ or _page_is_open(self._page):
+            return self._KEYS
+        return self._DETACHED_KEYS
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.keys():
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.keys()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in self.keys()}
 
 class PDFProcessor:
+    # Words only: normalise whitespace characters to plain spaces so word
+    # extraction rarely yields whitespace-only tokens
+    WORD_TEXTPAGE_FLAGS = fitz.TEXTFLAGS_WORDS & ~fitz.TEXT_PRESERVE_WHITESPACE
+
     def __init__(self, pdf_path: str):
         self.pdf_path = pdf_path
         self.doc = fitz.open(pdf_path)
     
-    def extract_text_and_structure(self, page_num: int = 0) -> Dict[str, Any]:
+    def extract_text_and_structure(self, page_num: int = 0) -> PageExtraction:
         """Extract text and basic structure info from a PDF page with word-level coordinates"""
         if page_num >= len(self.doc):
             raise ValueError(f"Page {page_num} does not exist")
         
         page = self.doc[page_num]
         
+        # Parse the page once and reuse the TextPage for text and text_blocks
+        textpage = page.get_textpage(flags=fitz.TEXTFLAGS_TEXT)
+        
         # Extract text
-        text = page.get_text()
+        text = page.get_text(textpage=textpage)
         
-        # Extract word-level coordinates
+        # Extract word-level coordinates (from their own whitespace-normalised TextPage)
         word_coordinates = self.extract_word_coordinates(page)
         
-        # Extract text blocks with positions (for backward compatibility)
-        blocks = page.get_text("dict")["blocks"]
-        text_blocks = []
-        
-        for block in blocks:
-            if "lines" in block:  # Text block
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        text_blocks.append({
-                            "text": span["text"],
-                            "bbox": span["bbox"],  # [x0, y0, x1, y1]
-                            "font": span["font"],
-                            "size": span["size"]
-                        })
-        
         # Get page dimensions
         page_rect = page.rect
         
-        return {
-            "page_num": page_num,
-            "text": text,
-            "text_blocks": text_blocks,
-            "word_coordinates": word_coordinates,  # New word-level data
-            "page_width": page_rect.width,
-            "page_height": page_rect.height,
-            "total_pages": len(self.doc)
-        }
+        # Text blocks (kept for backward compatibility) are built lazily from the same TextPage
+        return PageExtraction(
+            page_num=page_num,
+            text=text,
+            word_coordinates=word_coordinates,  # New word-level data
+            page_width=page_rect.width,
+            page_height=page_rect.height,
+            total_pages=len(self.doc),
+            _page=page,
+            _textpage=textpage
+        )
     
-    def extract_word_coordinates(self, page) -> List[Dict[str, Any]]:
+    def extract_all_pages(self, page_nums: Optional[List[int]] = None,
+                          max_workers: Optional[int] = None) -> List[PageExtraction]:
+        """
+        Extract text and structure for several pages in parallel, ordered by page_num.
+        Results are detached from their pages, so they never carry text_blocks.
+        """
+        if page_nums is None:
+            page_nums = list(range(len(self.doc)))
+        if not page_nums:
+            return []
+        
+        workers = max_workers or min(8, os.cpu_count() or 1)
+        workers = min(workers, len(page_nums))
+        if workers <= 1:
+            return self._detach([self.extract_text_and_structure(page_num) for page_num in sorted(page_nums)])
+        
+        # fitz.Document is not thread-safe, so each worker opens its own handle
+        # and processes a contiguous chunk of pages (MuPDF releases the GIL while parsing)
+        ordered = sorted(page_nums)
+        chunk_size = -(-len(ordered) // workers)
+        chunks = [ordered[i:i + chunk_size] for i in range(0, len(ordered), chunk_size)]
+        
+        def extract_chunk(chunk: List[int]) -> List[PageExtraction]:
+            with PDFProcessor(self.pdf_path) as processor:
+                return [processor.extract_text_and_structure(page_num) for page_num in chunk]
+        
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            chunk_results = list(executor.map(extract_chunk, chunks))
+        
+        return self._detach([page_data for chunk in chunk_results for page_data in chunk])
+    
+    @staticmethod
+    def _detach(pages: List[PageExtraction]) -> List[PageExtraction]:
+        """Drop page handles so results have the same shape whether or not their document is still open"""
+        for page_data in pages:
+            page_data._page = None
+        return pages
+    
+    def extract_word_coordinates(self, page, textpage=None) -> List[Word]:
         """Extract individual word coordinates from PDF page"""
-        words = page.get_text("words")  # PyMuPDF's word extraction
-        word_list = []
-        
-        for word_info in words:
-            # word_info format: (x0, y0, x1, y1, "word", block_no, line_no, word_no)
-            x0, y0, x1, y1, word_text, block_no, line_no, word_no = word_info
-            
-            # Skip empty words or whitespace-only
-            if not word_text.strip():
-                continue
-                
-            word_data = {
-                "text": word_text,
-                "x0": x0,
-                "y0": y0, 
-                "x1": x1,
-                "y1": y1,
-                "center_x": (x0 + x1) / 2,
-                "center_y": (y0 + y1) / 2,
-                "width": x1 - x0,
-                "height": y1 - y0,
-                "block_no": block_no,
-                "line_no": line_no,
-                "word_no": word_no
-            }
-            word_list.append(word_data)
+        return self.extract_word_arrays(page, textpage=textpage).to_words()
+    
+    def extract_word_arrays(self, page, textpage=None) -> WordArrays:
+        """Extract word coordinates from PDF page as parallel columns"""
+        if textpage is None:
+            textpage = page.get_textpage(flags=self.WORD_TEXTPAGE_FLAGS)
+        
+        # word_info format: (x0, y0, x1, y1, "word", block_no, line_no, word_no)
+        # Skip empty or whitespace-only words
+        words = [
+            w for w in page.get_text("words", textpage=textpage)  # PyMuPDF's word extraction
+            if w[4].strip()
+        ]
+        
+        # Sort the raw tuples by reading order (top to bottom, left to right)
+        # before any per-word objects are built
+        words.sort(key=itemgetter(1, 0))  # (y0, x0)
+        
+        if not words:
+            return WordArrays(*([()] * len(WordArrays._fields)))
         
-        # Sort by reading order (top to bottom, left to right)
-        word_list.sort(key=lambda w: (w["y0"], w["x0"]))
+        x0, y0, x1, y1, text, block_no, line_no, word_no = zip(*words)
+        center_x = tuple((a + b) / 2 for a, b in zip(x0, x1))
+        center_y = tuple((a + b) / 2 for a, b in zip(y0, y1))
         
-        return word_list
+        return WordArrays(text, x0, y0, x1, y1, center_x, center_y, block_no, line_no, word_no)
     
     def get_page_count(self) -> int:
         """Get total number of pages"""
@@ -88,4 +283,19 @@ class PDFProcessor:
     
     def close(self):
         """Close the PDF document"""
-        self.doc.close()
\ No newline at end of file
+        if not self.doc.is_closed:
+            self.doc.close()
+    
+    def __enter__(self) -> "PDFProcessor":
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def __del__(self):
+        # Safety net for callers that never close the processor
+        if hasattr(self, 'doc'):
+            try:
+                self.close()
+            except Exception:
+                pass
\ No newline at end of file
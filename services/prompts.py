@@ -2,458 +2,675 @@
 Externalized prompts for GPT operations
 All prompts are stored here for easy modification and version control
 """
-
-class PromptTemplates:
-    """Collection of prompt templates for different operations"""
-    
-    STRUCTURE_CLASSIFICATION = """
-    Analyze this PDF page and classify its structure. 
-
-    Document Info:
-    - Total text length: {text_length} characters
-    - Total text blocks: {total_blocks}
-    
-    Sample text content:
-    {sample_text}
-    
-    Classify this page as one of:
-    1. "form" - Contains form fields with labels and values (like applications, invoices)
-    2. "table" - Contains tabular data with rows and columns
-    3. "mixed" - Contains both form elements and tables
-    
-    Also identify the main regions and provide confidence score.
-    
-    You MUST respond with valid JSON only. No additional text or explanation.
-    
-    {{
+import json
+import re
+import textwrap
+from functools import lru_cache
+from string import Formatter
+from typing import Any, Dict, Final, Iterable, List, Optional, Tuple
+
+# Rough token estimate for budgeting (about four characters per token for English text)
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the number of tokens in text"""
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, at the last paragraph (else line) break that fits"""
+    max_chars = max(max_tokens, 0) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    # Only back off to a break if that keeps most of the allowance
+    for separator in ("\n\n", "\n"):
+        cut = text.rfind(separator, 0, max_chars + 1)
+        if cut >= max_chars // 2:
+            return text[:cut]
+    return text[:max_chars]
+
+class CompiledPrompt:
+    """
+    A prompt split into a static prefix, kept verbatim, and an input template
+    parsed once into literal segments and placeholder names
+    """
+    __slots__ = ("_static_len", "template", "_literals", "fields", "static_tokens", "response_format",
+                 "schema_prompt")
+
+    def __init__(self, static: str, template: str = "", response_format: Optional[Dict[str, Any]] = None):
+        # The static text is only held inside the first literal; static slices it back out
+        self._static_len = len(static)
+        self.template = template
+        # Strict json_schema response_format for templates with a fixed response shape
+        self.response_format = response_format
+        # Variant without the inline JSON example, for models that enforce response_format
+        self.schema_prompt: Optional["CompiledPrompt"] = None
+        # Literal text around the placeholders: len(_literals) == len(fields) + 1.
+        # Only the input template goes through Formatter.parse, so the static part
+        # (rules and JSON examples) needs no {{ }} escaping.
+        literals: List[str] = [static]
+        fields: List[str] = []
+        for literal, field_name, _spec, _conversion in Formatter().parse(template):
+            literals[-1] += literal
+            if field_name is not None:
+                fields.append(field_name)
+                literals.append("")
+        self._literals: Tuple[str, ...] = tuple(literals)
+        self.fields: Tuple[str, ...] = tuple(fields)
+        # Token count of all literal text, so budgeting only has to measure the inputs
+        self.static_tokens = sum(estimate_tokens(literal) for literal in self._literals)
+
+    def __call__(self, **kwargs: Any) -> str:
+        # Interleave the precomputed literals with the inputs by slice assignment
+        parts: List[Any] = [None] * (2 * len(self.fields) + 1)
+        parts[::2] = self._literals
+        parts[1::2] = [str(kwargs[name]) for name in self.fields]
+        return "".join(parts)
+
+    def estimate_tokens(self, **kwargs: Any) -> int:
+        """Approximate token count of the rendered prompt without rendering it"""
+        return self.static_tokens + sum(estimate_tokens(str(kwargs[name])) for name in self.fields)
+
+    def render_within(self, max_tokens: Optional[int], slot: str = "text", **kwargs: Any) -> str:
+        """Render with the slot input truncated so the whole prompt stays within max_tokens"""
+        if max_tokens is not None:
+            other_tokens = sum(estimate_tokens(str(kwargs[name])) for name in self.fields if name != slot)
+            slot_budget = max_tokens - self.static_tokens - other_tokens
+            value = str(kwargs[slot])
+            truncated = truncate_to_tokens(value, slot_budget)
+            if len(truncated) < len(value):
+                print(f"DEBUG - Truncated {slot} from {len(value)} to {len(truncated)} characters to fit {max_tokens} tokens")
+            kwargs[slot] = truncated
+        return self(**kwargs)
+
+    @property
+    def static(self) -> str:
+        """The static prefix as passed in, before any input literal"""
+        return self._literals[0][:self._static_len]
+
+    @property
+    def static_prefix(self) -> str:
+        """Rendered text before the first placeholder; identical on every call"""
+        return self._literals[0]
+
+    def format(self, **kwargs: Any) -> str:
+        """str.format-compatible alias"""
+        return self(**kwargs)
+
+
+# Example responses shown to the model, one canonical example per response shape. Kept as
+# data and serialized once at import; templates reference them with <EXAMPLE:name> markers.
+_JSON_EXAMPLE_DATA: Dict[str, Any] = {
+    "form_data": {
+        "extracted_data": {
+            "Field Name 1": "exact value from document or null",
+            "Field Name 2": "exact value from document or null"
+        },
+        "extraction_confidence": 0.9,
+        "extraction_notes": "Brief note about any challenges or observations",
+        "feedback_applied": "Brief note on how user feedback was incorporated, if any was given"
+    },
+    "structure_classification": {
         "classification": "form|table|mixed",
         "confidence": 0.85,
         "reasoning": "Brief explanation of classification",
         "regions": [
-            {{
-                "type": "form|table", 
+            {
+                "type": "form|table",
                 "description": "Description of this region",
                 "estimated_bounds": "top|middle|bottom"
-            }}
+            }
         ]
-    }}
-    """
-    
-    FORM_FIELD_IDENTIFICATION = """
-    Analyze this content and identify FORM FIELDS ONLY - individual labeled fields with values.
-    
-    Text content:
-    {text}
-    
-    FORM FIELDS are:
-    - Individual labels followed by values (Name: John Doe)  
-    - Input field labels (First Name, Last Name, Address)
-    - Single data points with descriptive labels
-    - Fields that appear once or rarely (not in repeating table rows)
-    
-    IMPORTANT: 
-    - If a field has no value after the label, set "estimated_value": null
-    - Look for patterns like "Label:" followed by blank space or "Label: ___" 
-    - Include fields even if they appear empty
-    - DO NOT include table column headers or repeated row data
-    - Focus on document metadata, employee details, form inputs
-    
-    You MUST respond with valid JSON only. No additional text or explanation.
-    
-    {{
+    },
+    "form_field_identification": {
         "field_type": "form",
         "fields": [
-            {{
+            {
                 "label": "Field Name",
                 "estimated_value": "Extracted value or null if empty",
                 "data_type": "text|number|date|currency|boolean",
                 "confidence": 0.85,
-                "is_empty": true
-            }}
+                "is_empty": True
+            }
         ]
-    }}
-    """
-    
-    TABLE_HEADER_IDENTIFICATION = """
-    Analyze this content and identify TABLE COLUMN HEADERS ONLY - headers that appear above data columns.
-    
-    Text content:
-    {text}
-    
-    TABLE HEADERS are:
-    - Column names that appear above rows of data
-    - Headers that repeat across multiple data rows  
-    - Labels for tabular data columns (Employee ID, Name, Department)
-    - Headers organized in clear columnar structure
-    
-    IMPORTANT:
-    - Focus on identifying true tabular structures with rows and columns
-    - Look for alignment patterns and repeated data structures
-    - Each table should have clear boundaries and consistent formatting
-    - Headers should be followed by actual data rows
-    
-    DO NOT include:
-    - Form field labels that appear once
-    - Individual data values
-    - Section titles or document headers
-    - Standalone label-value pairs
-    
-    Group headers by logical table if multiple tables exist. Be conservative - only identify clear tabular structures.
-    
-    You MUST respond with valid JSON only. No additional text or explanation.
-    
-    {{
+    },
+    "table_header_identification": {
         "field_type": "table",
         "tables": [
-            {{
+            {
                 "table_id": 1,
                 "description": "Employee Information Table",
                 "headers": [
-                    {{
+                    {
                         "name": "Column Name",
                         "data_type": "text|number|date|currency",
                         "position": 0,
-                        "has_data": true
-                    }}
+                        "has_data": True
+                    }
                 ],
                 "estimated_rows": 10,
                 "table_region": "top|middle|bottom"
-            }}
+            }
         ]
-    }}
-    """
-    
-    EMPLOYEE_PROFILE_EXTRACTION = """
-    You are a data extraction specialist. Extract all data from this employee profile PDF following these precise rules:
-
-    ## Core Extraction Principles
-    
-    ### Field-Value Mapping
-    - **Identify all field labels and their corresponding values exactly as they appear**
-    - **Mark empty fields as null - do not assume or infer values**
-    - **Distinguish between empty fields and zero values (0.00)**
-    - **Do not combine separate field labels - treat each as an individual field**
-    - **Field proximity does not indicate relationship - verify actual field-value pairing**
-    
-    ### Date and Numeric Formatting
-    - **Parse all dates in MM/DD/YYYY format consistently**
-    - **Preserve numeric values with original decimal formatting (19.00, 0.00, etc.)**
-    - **Handle percentage values as shown (100.00 for 100%)**
-    - **Preserve currency values without adding symbols unless present in original**
-    - **Maintain multi-part values exactly as formatted (0.00/14.11/0.00/0.00)**
-    
-    Text content to extract from:
-    {text}
-    
-    Fields identified to extract: {field_names}
-    
-    For each field, extract the actual value that appears in the document following the rules above.
-    If a field appears to be empty or has no value, set it to null.
-    
-    You MUST respond with valid JSON only:
-    {{
-        "extracted_data": {{
-            "Field Name 1": "actual value or null if empty",
-            "Field Name 2": "actual value or null if empty"
-        }},
-        "empty_fields_count": 0,
+    },
+    "batched_form_data": {
+        "pages": [
+            {
+                "page_id": 0,
+                "extracted_data": {
+                    "Field Name 1": "exact value from this page or null",
+                    "Field Name 2": "exact value from this page or null"
+                }
+            }
+        ]
+    },
+    "field_structure": {
+        "form_fields": [{"field_name": "Employee Name"}, {"field_name": "Birth Date"}],
+        "tables": [
+            {
+                "table_name": "Rate/Salary Information",
+                "headers": ["RateCode", "Description", "Rate", "Effective Dates"]
+            }
+        ],
+        "extraction_summary": {"total_form_fields": 2, "total_tables": 1, "refinement_iteration": 1},
+        "feedback_response": "Brief note on how user feedback was incorporated"
+    },
+    "comprehensive_data": {
+        "extracted_data": {"field_name": "actual_value_from_document"},
+        "table_data": [
+            {
+                "table_name": "Table Name",
+                "headers": ["Column1", "Column2", "Column3"],
+                "rows": [
+                    {"Column1": "value1", "Column2": "value2", "Column3": "value3"},
+                    {"Column1": "value4", "Column2": "value5", "Column3": "value6"}
+                ]
+            }
+        ],
+        "extraction_summary": {
+            "total_extracted_fields": 0,
+            "total_extracted_tables": 0,
+            "extraction_success": True
+        }
+    },
+    "table_data": {
+        "table_data": [
+            {"Column1": "value1", "Column2": "value2"},
+            {"Column1": None, "Column2": "value4"},
+            {"Column1": "0.00", "Column2": None}
+        ],
+        "row_count": 3,
+        "empty_cells_count": 2,
         "extraction_confidence": 0.9,
-        "extraction_notes": "Any issues or observations about the extraction"
-    }}
-    """
-    
-    FORM_DATA_EXTRACTION = """
-    You are a precise data extraction specialist. Extract actual values from this document.
+        "table_notes": "Any issues with table structure or data extraction"
+    },
+    "unified_extraction": {
+        "form_data": {"Field Name 1": "exact value or null", "Field Name 2": "exact value or null"},
+        "table_data": [
+            {
+                "table_name": "Table Name 1",
+                "headers": ["Header1", "Header2", "Header3"],
+                "rows": [
+                    {"Header1": "value1", "Header2": "value2", "Header3": None},
+                    {"Header1": "value3", "Header2": None, "Header3": "value4"}
+                ]
+            }
+        ],
+        "extraction_summary": {
+            "total_form_fields_extracted": 0,
+            "total_tables_extracted": 0,
+            "total_table_rows_extracted": 0,
+            "extraction_confidence": 0.95
+        }
+    },
+    "refine_delta": {
+        "form_data": {"Field Name 2": "corrected value"},
+        "table_data": [
+            {
+                "table_name": "Table Name 1",
+                "headers": ["Header1", "Header2"],
+                "rows": [{"Header1": "value1", "Header2": "corrected value"}]
+            }
+        ]
+    },
+    "vision_field_structure": {
+        "form_fields": [{"field_name": "Employee Name"}, {"field_name": "Birth Date"}],
+        "tables": [
+            {
+                "table_name": "Rate/Salary Information",
+                "headers": ["RateCode", "Description", "Rate", "Effective Dates"]
+            }
+        ],
+        "extraction_summary": {"total_form_fields": 2, "total_tables": 1, "refinement_iteration": 1},
+        "feedback_response": "Initial extraction based on visual layout analysis"
+    },
+    "vision_data": {
+        "extracted_data": {"field_name": "actual_value_from_document"},
+        "table_data": [
+            {
+                "table_name": "Table Name",
+                "headers": ["Column1", "Column2", "Column3"],
+                "rows": [
+                    {"Column1": "value1", "Column2": "value2", "Column3": "value3"},
+                    {"Column1": "value4", "Column2": "value5", "Column3": "value6"}
+                ]
+            }
+        ],
+        "extraction_summary": {"total_extracted_fields": 0, "total_extracted_tables": 0, "extraction_success": True}
+    },
+    "feedback_analysis": {
+        "error_analysis": {
+            "identified_errors": [
+                {
+                    "error_type": "field_misassignment|missing_field|wrong_format|spatial_error|validation_failure",
+                    "affected_field": "field_name",
+                    "description": "What went wrong",
+                    "root_cause": "Why it happened"
+                }
+            ],
+            "error_patterns": ["generalized pattern description"]
+        },
+        "enhancement_rules": {
+            "field_detection": {
+                "improved_patterns": ["new detection patterns to add"],
+                "validation_checks": ["validation rules to add"],
+                "spatial_refinements": ["spatial analysis improvements"]
+            },
+            "data_extraction": {
+                "format_standardization": ["format rules to apply"],
+                "value_validation": ["value validation rules"],
+                "error_prevention": ["prevention strategies"]
+            }
+        },
+        "generalized_principles": ["Universal principles that apply to all similar documents"],
+        "confidence": 0.85,
+        "complexity_assessment": "simple|moderate|complex"
+    },
+    "enhancement_generation": {
+        "enhancements": {
+            "detection_improvements": ["specific instructions for better field detection"],
+            "extraction_refinements": ["specific instructions for better data extraction"],
+            "spatial_adjustments": ["spatial analysis improvements"],
+            "format_standardizations": ["format handling improvements"]
+        },
+        "validation_rules": ["Rule 1: Validation check to perform", "Rule 2: Another validation check"],
+        "prompt_additions": ["Specific instruction to add to extraction prompt", "Another specific instruction"]
+    }
+}
+
+def _format_example(example: Dict[str, Any]) -> str:
+    """One top-level key per line with compact nested values - readable, but few tokens"""
+    lines = ",\n".join(f"  {json.dumps(key)}: {json.dumps(value)}" for key, value in example.items())
+    return "{\n" + lines + "\n}"
+
+_JSON_EXAMPLES: Dict[str, str] = {
+    name: _format_example(example) for name, example in _JSON_EXAMPLE_DATA.items()
+}
+
+# A marker on its own line; the example is indented to match it
+_EXAMPLE_MARKER = re.compile(r"^([ \t]*)<EXAMPLE:(\w+)>$", re.MULTILINE)
+
+def _expand_examples(text: str) -> str:
+    """Replace <EXAMPLE:name> markers with the shared JSON example for that shape"""
+    return _EXAMPLE_MARKER.sub(
+        lambda match: textwrap.indent(_JSON_EXAMPLES[match.group(2)], match.group(1)), text
+    )
+
+def _strict_object(**properties: Dict[str, Any]) -> Dict[str, Any]:
+    """Object schema as strict structured outputs require it: every key required, no extra keys"""
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False
+    }
+
+def _enum(*values: str) -> Dict[str, Any]:
+    return {"type": "string", "enum": list(values)}
+
+def _array(items: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": "array", "items": items}
+
+_STRING: Final = {"type": "string"}
+_NULLABLE_STRING: Final = {"type": ["string", "null"]}
+_NUMBER: Final = {"type": "number"}
+_INTEGER: Final = {"type": "integer"}
+_BOOLEAN: Final = {"type": "boolean"}
+
+# Response schemas for the templates whose output has a fixed shape, mirroring their
+# JSON examples. Extraction responses keyed by arbitrary field names cannot be expressed
+# as strict schemas and keep plain JSON mode.
+_RESPONSE_SCHEMAS: Dict[str, Dict[str, Any]] = {
+    "structure_classification": _strict_object(
+        classification=_enum("form", "table", "mixed"),
+        confidence=_NUMBER,
+        reasoning=_STRING,
+        regions=_array(_strict_object(
+            type=_enum("form", "table"),
+            description=_STRING,
+            estimated_bounds=_enum("top", "middle", "bottom")
+        ))
+    ),
+    "form_field_identification": _strict_object(
+        field_type=_enum("form"),
+        fields=_array(_strict_object(
+            label=_STRING,
+            estimated_value=_NULLABLE_STRING,
+            data_type=_enum("text", "number", "date", "currency", "boolean"),
+            confidence=_NUMBER,
+            is_empty=_BOOLEAN
+        ))
+    ),
+    "table_header_identification": _strict_object(
+        field_type=_enum("table"),
+        tables=_array(_strict_object(
+            table_id=_INTEGER,
+            description=_STRING,
+            headers=_array(_strict_object(
+                name=_STRING,
+                data_type=_enum("text", "number", "date", "currency"),
+                position=_INTEGER,
+                has_data=_BOOLEAN
+            )),
+            estimated_rows=_INTEGER,
+            table_region=_enum("top", "middle", "bottom")
+        ))
+    )
+}
+
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+def _compact(text: str) -> str:
+    """Drop source indentation, trailing spaces and repeated blank lines - tokens with no meaning"""
+    lines = [line.rstrip() for line in textwrap.dedent(text).split("\n")]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines))
+
+# The example block a strict response schema makes redundant
+_SCHEMA_EXAMPLE_BLOCK = re.compile(r"^[ \t]*\*\*Response JSON structure:\*\*\n[ \t]*<EXAMPLE:\w+>\n", re.MULTILINE)
+
+def _compile(static: str, template: str = "", schema: Optional[str] = None) -> CompiledPrompt:
+    """Parse the input template once at import so rendering is a single join"""
+    if schema is None:
+        return CompiledPrompt(_compact(_expand_examples(static)), _compact(template))
+
+    response_format = {
+        "type": "json_schema",
+        "json_schema": {"name": schema, "schema": _RESPONSE_SCHEMAS[schema], "strict": True}
+    }
+    compiled = CompiledPrompt(_compact(_expand_examples(static)), _compact(template), response_format)
+    compiled.schema_prompt = CompiledPrompt(
+        _compact(_SCHEMA_EXAMPLE_BLOCK.sub("", static)).rstrip("\n") + "\n", _compact(template), response_format
+    )
+    return compiled
+
+# Shared opening for every data-extraction prompt. It is byte-identical across templates,
+# so a session that uses several of them still reuses one cached prefix.
+_META_RULES = """
+    You are a precise data extraction specialist working on text extracted from PDF documents.
+
+    **GENERAL RULES (apply to every task below):**
+    - Extract ONLY what is written in the document - never assume, infer or invent values
+    - Use null for any field or cell that exists but has no value, or that cannot be found
+    - Distinguish empty values (null) from zero values such as 0.00
+    - Preserve the original formatting of values exactly: numbers and decimals, currency, capitalization and compound values (e.g. 0.00/14.11/0.00/0.00)
+    - Follow the JSON structure shown in the task exactly, using the field and header names given
+"""
 
-    **EXTRACTION RULES:**
-    1. Extract ONLY what is written in the document - no assumptions
-    2. If a field label exists but has no value, use null
-    3. Preserve exact formatting (dates, numbers, text cases)
-    4. Look for patterns like "Label: Value" or "Label Value"
-    5. Handle multi-word field names carefully
+# Table rules shared by every prompt that extracts table data, kept in one place so
+# the table templates also share this segment of their cached prefix
+_TABLE_RULES = """
+    **TABLE RULES (apply to every table below):**
+    - Extract ALL rows of data for each table, including rows where some cells are empty
+    - Use the column headers exactly as written and include headers that have no data
+    - Map each value to its column by actual layout position - never by assumed relationships
+    - Use null for each consecutive empty column; never shift a later value into an empty column
+"""
+
+_TASK_HEADING = """
+    ## TASK
+"""
+
+_META_PREFIX = _META_RULES + _TASK_HEADING
+_TABLE_META_PREFIX = _META_RULES + _TABLE_RULES + _TASK_HEADING
+
+# Shared form-field extraction prompt; optional sections are appended after the common
+# prefix so every variant starts with the same bytes. Only the *_INPUT fragments are
+# format templates.
+_FORM_EXTRACTION_BASE_PREFIX = _META_PREFIX + """
+    Extract the actual values for the form fields listed below from the document text.
+
+    - For each field name, find the corresponding value in the text
+    - Look for patterns like "Label: Value" or "Label Value"
+    - Extract the value that comes after the field label
+    - Handle multi-word field names carefully
+
+    **Response JSON structure:**
+    <EXAMPLE:form_data>
+"""
 
+_EMPLOYEE_PROFILE_SECTION = """
+    EMPLOYEE_PROFILE_RULES:
+      - one_label_one_field: true  # never merge adjacent labels
+      - pair_by_layout_not_proximity: true
+      - date_format: MM/DD/YYYY
+      - percentages: as_shown  # 100.00 for 100%
+      - currency_symbols: only_if_present
+"""
+
+_FORM_EXTRACTION_INPUT = """
     **Fields to extract:** {field_names}
 
     **Document text:**
     {text}
+"""
 
-    **Instructions:**
-    - For each field name, find the corresponding value in the text
-    - Extract the value that comes after the field label
-    - If you cannot find a field or its value, use null
-    - Maintain original formatting and capitalization
+# Feedback instructions follow the document text, so a refinement request shares its whole
+# prefix - including fields and text - with the first extraction of the same page
+_FEEDBACK_INPUT = """
+    **User feedback and corrections:** {user_feedback}
 
-    Respond with valid JSON only:
-    {{
-        "extracted_data": {{
-            "Field Name 1": "exact value from document or null",
-            "Field Name 2": "exact value from document or null"
-        }},
-        "extraction_confidence": 0.9,
-        "extraction_notes": "Brief note about any challenges or observations"
-    }}
-    """
+    IMPORTANT: Apply the user's feedback above carefully. This is a refinement based on their corrections to improve accuracy.
+"""
+
+def _compile_form_extraction(employee_profile: bool, with_feedback: bool) -> CompiledPrompt:
+    """Assemble one variant of the form-field extraction prompt"""
+    static = _FORM_EXTRACTION_BASE_PREFIX + (_EMPLOYEE_PROFILE_SECTION if employee_profile else "")
+    return _compile(static, _FORM_EXTRACTION_INPUT + (_FEEDBACK_INPUT if with_feedback else ""))
+
+# (employee_profile, with_feedback) -> compiled variant
+_FORM_EXTRACTION_VARIANTS = {
+    (employee_profile, with_feedback): _compile_form_extraction(employee_profile, with_feedback)
+    for employee_profile in (False, True)
+    for with_feedback in (False, True)
+}
+
+@lru_cache(maxsize=1024)
+def _serialize_fields(names: Tuple[str, ...]) -> str:
+    return json.dumps(list(names), ensure_ascii=False)
+
+def serialize_field_names(names: Iterable[str]) -> str:
+    """JSON array of field/header names for the prompt inputs, cached per name set"""
+    return _serialize_fields(tuple(names))
+
+def render_extraction_prompt(text: str, field_names: List[str], *, user_feedback: Optional[str] = None,
+                             employee_profile: bool = False, max_tokens: Optional[int] = None) -> str:
+    """Render the form-field extraction prompt, adding the optional sections that apply"""
+    with_feedback = bool(user_feedback and user_feedback.strip())
+    template = _FORM_EXTRACTION_VARIANTS[(employee_profile, with_feedback)]
+    kwargs = {"text": text, "field_names": serialize_field_names(field_names)}
+    if with_feedback:
+        kwargs["user_feedback"] = user_feedback
+    return template.render_within(max_tokens, **kwargs)
+
+# Every template keeps its static instructions and JSON example first and its
+# {placeholders} in a trailing input section, so the leading bytes are identical
+# across calls and can be served from the provider's prompt cache.
+
+STRUCTURE_CLASSIFICATION: Final[CompiledPrompt] = _compile("""
+    Analyze this PDF page and classify its structure. 
+
+    Classify this page as one of:
+    1. "form" - Contains form fields with labels and values (like applications, invoices)
+    2. "table" - Contains tabular data with rows and columns
+    3. "mixed" - Contains both form elements and tables
+    
+    Also identify the main regions and provide confidence score.
     
-    FORM_DATA_EXTRACTION_WITH_FEEDBACK = """
-    You are a data extraction specialist. Extract the actual values for these form fields from the text.
+    **Response JSON structure:**
+    <EXAMPLE:structure_classification>
+    """, """
+    Document Info:
+    - Total text length: {text_length} characters
+    - Total text blocks: {total_blocks}
     
-    *** CRITICAL INSTRUCTIONS ***
-    1. Extract ACTUAL values only - what is written in the document
-    2. If a field exists but has no value, use null
-    3. Do not make assumptions or infer values
-    4. Be precise with data formatting (dates, numbers, etc.)
+    Sample text content:
+    {sample_text}
+    """, schema="structure_classification")
+
+FORM_FIELD_IDENTIFICATION: Final[CompiledPrompt] = _compile("""
+    Identify FORM FIELDS ONLY - individual labeled fields with values - in the text below.
     
-    Fields to extract: {field_names}
+    FORM_FIELD: a label that appears once or rarely, followed by a value (Name: John Doe) or blank ("Label:", "Label: ___")
+    RULES:
+      - empty_value: null  # estimated_value when the label has no value
+      - include_empty_fields: true
+      - exclude: [table_column_headers, repeated_row_data]
+      - focus: [document_metadata, employee_details, form_inputs]
     
+    **Response JSON structure:**
+    <EXAMPLE:form_field_identification>
+    """, """
     Text content:
     {text}
-    
-    User feedback and corrections: {user_feedback}
-    
-    IMPORTANT: Apply the user's feedback carefully. This is a refinement based on their corrections to improve accuracy.
-    
-    For each field, extract the actual value that appears in the document following the user's guidance.
-    
-    Respond with JSON only:
-    {{
-        "extracted_data": {{
-            "Field Name 1": "actual value or null if empty",
-            "Field Name 2": "actual value or null if empty"
-        }},
-        "extraction_confidence": 0.9,
-        "feedback_applied": "Brief note on how user feedback was incorporated"
-    }}
-    """
-    
-    COMPREHENSIVE_FIELD_EXTRACTION = """
-    You are a document structure specialist. Follow these very specific rules to identify and extract FORM FIELDS and TABLE HEADERS from the provided text.
-    *** CRITICAL RULES - READ FIRST ***
-    1. DO NOT include table headers in form_fields - they go ONLY in the tables section!
-    2. DO NOT include actual data values like "John Doe" or "12/26/2001" in field names!
-    3. Extract ONLY field labels like "Employee Name", "Birth Date", NOT their values!
-    4. Extract ONLY table column headers like "Rate", "Description", NOT table data!
-    5. Think Harder while extracting form fields. DO not miss any field though they do not have value.
-
-    You are identifying document STRUCTURE ONLY - field labels and table headers.
-
-    Text to analyze:
+    """, schema="form_field_identification")
+
+TABLE_HEADER_IDENTIFICATION: Final[CompiledPrompt] = _compile("""
+    Identify TABLE COLUMN HEADERS ONLY - headers that appear above data columns - in the text below.
+    
+    TABLE_HEADER: a column name above aligned rows of data (Employee ID, Name, Department)
+    RULES:
+      - require_data_rows_below: true
+      - use_alignment_and_repetition: true
+      - group_by_table: true
+      - conservative: true  # only clear tabular structures
+      - exclude: [form_field_labels, data_values, section_titles, document_headers, label_value_pairs]
+    
+    **Response JSON structure:**
+    <EXAMPLE:table_header_identification>
+    """, """
+    Text content:
     {text}
+    """, schema="table_header_identification")
 
-    User feedback and instructions: {user_feedback}
+def format_page_blocks(pages: Iterable[Tuple[Any, str]]) -> str:
+    """Pack (page_id, text) pairs into one input, each page introduced by a <<<PAGE id=N>>> line"""
+    return "\n\n".join(f"<<<PAGE id={page_id}>>>\n{text}" for page_id, text in pages)
 
-    ## EXTRACTION GUIDELINES
-
-    **FORM FIELDS (individual labeled data points):**
-    - Look for patterns like "Label:" followed by values
-    - Extract the LABEL part only (e.g., "Employee Name", "SSN", "DOB")
-    - NEVER extract the actual values (e.g., "Caroline Jones", "088-39-6286")
-    - These are typically scattered throughout the document as individual items
-
-    **TABLE HEADERS (column names in tabular data):**
-    - Look for column headers that appear above rows of data
-    - Extract headers like "Rate", "Description", "Effective Dates"
-    - These appear in organized tables with multiple rows of data below them
-    - DO NOT include these in form_fields - they go in tables section only!
-
-    **WHAT TO IGNORE:**
-    - Actual data values (names, numbers, dates)
-    - Section titles like "Employee Information" 
-    - Page headers/footers
-    - Table row data
-
-    ## User Feedback Integration
-    If user feedback is provided:
-    - Apply their corrections exactly as specified
-    - Add missing fields they mention
-    - Remove incorrectly identified items they highlight
-    - Follow their guidance on field vs table header classification
+# Several pages of one document in a single request; {pages} is built by format_page_blocks.
+# Plain delimiters cost fewer tokens than a JSON array, which escapes every newline and quote.
+BATCHED_FORM_DATA_EXTRACTION: Final[CompiledPrompt] = _compile(_META_PREFIX + """
+    Extract the actual values for the form fields listed below from EACH page. Every page starts with a <<<PAGE id=N>>> line and runs until the next one.
 
-    **REQUIRED JSON FORMAT:**
-    {{
-        "form_fields": [
-            {{
-                "field_name": "Employee Name"
-            }},
-            {{
-                "field_name": "Birth Date"  
-            }}
-        ],
-        "tables": [
-            {{
-                "table_name": "Rate/Salary Information",
-                "headers": ["RateCode", "Description", "Rate", "Effective Dates"]
-            }}
-        ],
-        "extraction_summary": {{
-            "total_form_fields": 2,
-            "total_tables": 1,
-            "refinement_iteration": 1
-        }},
-        "feedback_response": "Brief note on how user feedback was incorporated"
-    }}
+    - Treat every page independently - never copy a value from one page to another
+    - If a field is not on a page, use null for that page
+    - Return one entry per input page, using the id from its <<<PAGE id=N>>> line as page_id
 
-    *** FINAL REMINDER ***
-    - form_fields = individual field LABELS only (not table headers!)
-    - tables = table names with their column headers
-    - NO actual data values in either section!
-    """
-    
-    COMPREHENSIVE_DATA_EXTRACTION = """
-    You are a data extraction specialist. Your job is to extract actual data values from the document text using the VALIDATED field and table structure identified in Step 2.
+    **Response JSON structure:**
+    <EXAMPLE:batched_form_data>
+    """, """
+    **Fields to extract:** {field_names}
 
-    Text to extract data from:
+    **Pages:**
+    {pages}
+    """)
+
+COMPREHENSIVE_FIELD_EXTRACTION: Final[CompiledPrompt] = _compile("""
+    You are a document structure specialist. Identify document STRUCTURE ONLY - form field labels and table column headers - in the text below.
+
+    RULES:
+      - form_fields: labels only  # "Employee Name", "SSN", "DOB" from "Label: value" patterns
+      - tables: column headers above rows of data only  # "Rate", "Description", "Effective Dates"
+      - table_headers_in_form_fields: never
+      - data_values_as_names: never  # not "Caroline Jones", "088-39-6286", "12/26/2001"
+      - include_fields_without_values: true  # do not miss any labeled field
+      - ignore: [data_values, section_titles, page_headers_footers, table_row_data]
+    FEEDBACK (when provided):
+      - apply_corrections_exactly: true
+      - add_mentioned_missing_fields: true
+      - remove_items_flagged_incorrect: true
+      - follow_field_vs_header_guidance: true
+
+    **REQUIRED JSON FORMAT:**
+    <EXAMPLE:field_structure>
+    """, """
+    Text to analyze:
     {text}
 
-    {field_structure}
+    User feedback and instructions: {user_feedback}
+    """)
 
-    ## Extraction Instructions:
+COMPREHENSIVE_DATA_EXTRACTION: Final[CompiledPrompt] = _compile(_TABLE_META_PREFIX + """
+    Extract actual data values from the document text using the VALIDATED field and table structure identified in Step 2.
 
     **For Form Fields:**
-    - Extract the exact actual values for each field listed above
-    - If a field exists but is empty, use null
-    - If a field is not found in the document, use null
-    - Preserve the exact formatting of values as they appear
+    - Extract the exact actual value for each field listed in the structure below
 
     **For Tables:**
-    - Extract ALL rows of data for each table
-    - Follow the exact column structure specified above
-    - Preserve formatting of values (dates, numbers, currency, etc.)
-    - If a cell is empty, use null
+    - Follow the exact column structure specified below
     - Include the column headers in the output
 
-    **Quality Standards:**
-    - Be precise - extract only what is actually in the document
-    - Maintain original formatting and spacing
-    - Do not make assumptions or add data that isn't there
-    - Double-check field names match exactly what was validated in Step 2
+    Double-check field names match exactly what was validated in Step 2.
 
-    Respond with valid JSON only:
-    {{
-        "extracted_data": {{
-            "field_name": "actual_value_from_document"
-        }},
-        "table_data": [
-            {{
-                "table_name": "Table Name",
-                "headers": ["Column1", "Column2", "Column3"],
-                "rows": [
-                    {{
-                        "Column1": "value1",
-                        "Column2": "value2", 
-                        "Column3": "value3"
-                    }},
-                    {{
-                        "Column1": "value4",
-                        "Column2": "value5",
-                        "Column3": "value6"
-                    }}
-                ]
-            }}
-        ],
-        "extraction_summary": {{
-            "total_extracted_fields": 0,
-            "total_extracted_tables": 0,
-            "extraction_success": true
-        }}
-    }}
-    """
-    
-    EMPLOYEE_PROFILE_TABLE_EXTRACTION = """
-    You are a data extraction specialist for tabular employee data. Follow these precise rules:
+    **Response JSON structure:**
+    <EXAMPLE:comprehensive_data>
+    """, """
+    {field_structure}
 
-    ## Table Extraction Principles
-    
-    ### Column Header Identification
-    - **Read column headers exactly as written in the document**
-    - **Map each data value to its precise column position**
-    - **Multiple consecutive columns may be empty - mark as null**
-    - **Do not assume logical column relationships - follow the actual layout**
-    - **Include all visible column headers even if they contain no data**
+    Text to extract data from:
+    {text}
+    """)
+
+EMPLOYEE_PROFILE_TABLE_EXTRACTION: Final[CompiledPrompt] = _compile(_TABLE_META_PREFIX + """
+    Extract ALL rows of tabular employee data for the columns listed below.
     
-    ### Data Value Extraction
-    - **Preserve numeric values with original decimal formatting (19.00, 0.00, etc.)**
-    - **Parse all dates in MM/DD/YYYY format consistently**
-    - **Handle multi-part values exactly as formatted (0.00/14.11/0.00/0.00)**
-    - **Preserve effective date ranges as "start date to end date"**
-    - **Mark truly empty cells as null - distinguish from zero values**
-    - **Extract tax status codes exactly as shown (S-0, S-1, etc.)**
+    RULES:
+      - date_format: MM/DD/YYYY
+      - effective_date_ranges: "start date to end date"
+      - tax_status_codes: as_shown  # S-0, S-1
     
+    **Response JSON structure:**
+    <EXAMPLE:table_data>
+    """, """
     Column headers to extract: {header_names}
     
     Text content:
     {text}
-    
-    Extract ALL rows of data for these columns following the rules above.
-    
-    You MUST respond with valid JSON only:
-    {{
-        "table_data": [
-            {{"Column1": "value1", "Column2": "value2"}},
-            {{"Column1": null, "Column2": "value4"}},
-            {{"Column1": "0.00", "Column2": null}}
-        ],
-        "row_count": 3,
-        "empty_cells_count": 2,
-        "extraction_confidence": 0.9,
-        "table_notes": "Any issues with table structure or data extraction"
-    }}
-    """
-    
-    # Unified Schema-Based Extraction (Original - Backup)
-    UNIFIED_SCHEMA_EXTRACTION_BACKUP = """
-    You are a comprehensive data extraction specialist. Extract ALL data from this document using the provided complete schema.
+    """)
 
-    **SCHEMA PROVIDED:**
-    Form Fields: {form_fields_schema}
-    Tables: {tables_schema}
+# Unified schema extraction: the plain and feedback-enhanced prompts share the whole static
+# prefix and differ only by the enhancement section appended after the document text
+_UNIFIED_EXTRACTION_STATIC = _TABLE_META_PREFIX + """
+    Extract ALL data from this document using the provided complete schema.
 
-    **EXTRACTION RULES:**
-    1. **Form Fields**: Extract exact values for each field name. Use null if field exists but has no value.
+    1. **Form Fields**: Extract the exact value for each field name.
     2. **Tables**: For each table, extract ALL rows with data for the specified headers.
-    3. **Precision**: Preserve original formatting, dates, numbers, and compound values exactly.
-    4. **Completeness**: Extract everything in one pass - do not separate forms and tables.
-
-    **Document Text:**
-    {text}
+    3. **Completeness**: Extract everything in one pass - do not separate forms and tables.
 
-    **Required JSON Response:**
-    {{
-        "form_data": {{
-            "Field Name 1": "exact value or null",
-            "Field Name 2": "exact value or null"
-        }},
-        "table_data": [
-            {{
-                "table_name": "Table Name 1",
-                "headers": ["Header1", "Header2", "Header3"],
-                "rows": [
-                    {{"Header1": "value1", "Header2": "value2", "Header3": null}},
-                    {{"Header1": "value3", "Header2": null, "Header3": "value4"}}
-                ]
-            }}
-        ],
-        "extraction_summary": {{
-            "total_form_fields_extracted": 0,
-            "total_tables_extracted": 0,
-            "total_table_rows_extracted": 0,
-            "extraction_confidence": 0.95
-        }}
-    }}
+    **Response JSON structure:**
+    <EXAMPLE:unified_extraction>
     """
 
-    # Enhanced Schema-Based Extraction with LLM Feedback Analysis
-    UNIFIED_SCHEMA_EXTRACTION = """
-    You are a comprehensive data extraction specialist with enhanced intelligence from user feedback analysis.
-
+_UNIFIED_EXTRACTION_INPUT = """
     **SCHEMA PROVIDED:**
     Form Fields: {form_fields_schema}
     Tables: {tables_schema}
 
-    **CORE EXTRACTION RULES:**
-    1. **Form Fields**: Extract exact values for each field name. Use null if field exists but has no value.
-    2. **Tables**: For each table, extract ALL rows with data for the specified headers.
-    3. **Precision**: Preserve original formatting, dates, numbers, and compound values exactly.
-    4. **Completeness**: Extract everything in one pass - do not separate forms and tables.
+    **Document Text:**
+    {text}
+"""
+
+_UNIFIED_ENHANCEMENT_INPUT = """
+    **META-INSTRUCTION:**
+    The sections below are derived from actual user feedback and corrections. Apply them carefully to achieve maximum extraction accuracy while maintaining the rules above.
 
     **ENHANCED EXTRACTION INTELLIGENCE:**
     {enhanced_instructions}
@@ -466,62 +683,224 @@ class PromptTemplates:
 
     **FORMAT HANDLING:**
     {format_handling}
+"""
 
+# Unified Schema-Based Extraction (Original - Backup)
+UNIFIED_SCHEMA_EXTRACTION_BACKUP: Final[CompiledPrompt] = _compile(
+    _UNIFIED_EXTRACTION_STATIC, _UNIFIED_EXTRACTION_INPUT
+)
+
+# Enhanced Schema-Based Extraction with LLM Feedback Analysis
+UNIFIED_SCHEMA_EXTRACTION: Final[CompiledPrompt] = _compile(
+    _UNIFIED_EXTRACTION_STATIC, _UNIFIED_EXTRACTION_INPUT + _UNIFIED_ENHANCEMENT_INPUT
+)
+
+def render_unified_extraction_prompt(form_fields_schema: str, tables_schema: str, text: str,
+                                     enhancements: Optional[Dict[str, str]] = None,
+                                     max_tokens: Optional[int] = None) -> str:
+    """
+    Render the unified schema extraction prompt. enhancements, when given, maps
+    enhanced_instructions / validation_rules / detection_improvements / format_handling
+    to their rendered text and switches on the enhancement section.
+    """
+    template = UNIFIED_SCHEMA_EXTRACTION if enhancements else UNIFIED_SCHEMA_EXTRACTION_BACKUP
+    return template.render_within(
+        max_tokens, form_fields_schema=form_fields_schema, tables_schema=tables_schema, text=text,
+        **(enhancements or {})
+    )
+
+# Feedback refinement that returns only what changed; the document text comes before the
+# previous extraction and feedback so repeated refinements of one document share a long prefix
+FORM_DATA_REFINE_DELTA: Final[CompiledPrompt] = _compile(_META_PREFIX + """
+    Apply the user's corrections to a previous extraction of this document.
+
+    - Return ONLY the form fields whose value changes; omit unchanged fields
+    - Return a table only if any of its rows change, and then with ALL of its rows
+    - Use the exact field and table names of the previous extraction
+    - Return an empty "form_data" object and "table_data" list when nothing changes
+
+    **Response JSON structure:**
+    <EXAMPLE:refine_delta>
+    """, """
     **Document Text:**
     {text}
 
-    **META-INSTRUCTION:**
-    These enhancements are derived from actual user feedback and corrections. Apply them carefully to achieve maximum extraction accuracy while maintaining the core extraction rules above.
-
-    **Required JSON Response:**
-    {{
-        "form_data": {{
-            "Field Name 1": "exact value or null",
-            "Field Name 2": "exact value or null"
-        }},
-        "table_data": [
-            {{
-                "table_name": "Table Name 1",
-                "headers": ["Header1", "Header2", "Header3"],
-                "rows": [
-                    {{"Header1": "value1", "Header2": "value2", "Header3": null}},
-                    {{"Header1": "value3", "Header2": null, "Header3": "value4"}}
-                ]
-            }}
-        ],
-        "extraction_summary": {{
-            "total_form_fields_extracted": 0,
-            "total_tables_extracted": 0,
-            "total_table_rows_extracted": 0,
-            "extraction_confidence": 0.95,
-            "enhancements_applied": true
-        }}
-    }}
-    """
+    **Previous Extraction:**
+    {previous_extraction}
 
-    # Legacy TABLE_DATA_EXTRACTION kept for backward compatibility
-    TABLE_DATA_EXTRACTION = """
-    Extract tabular data with these column headers:
+    **User Corrections:**
+    {user_feedback}
+    """)
+
+# Legacy TABLE_DATA_EXTRACTION kept for backward compatibility
+TABLE_DATA_EXTRACTION: Final[CompiledPrompt] = _compile(_TABLE_META_PREFIX + """
+    Extract tabular data for the column headers listed below.
+
+    - Preserve data types (numbers as numbers, dates as strings)
+    - Look for aligned data under each header
 
+    **Response JSON structure:**
+    <EXAMPLE:table_data>
+    """, """
     Headers: {header_names}
 
     Text content:
     {text}
+    """)
 
-    IMPORTANT:
-    - Extract ALL rows of data for these columns
-    - If a cell is empty or has no value, use null
-    - Preserve data types (numbers as numbers, dates as strings)
-    - Look for aligned data under each header
-    - Include rows even if some cells are empty
+# Feedback analysis prompts: instructions and response format first, the per-request
+# extraction result, structure and feedback after them
+FEEDBACK_ANALYSIS: Final[CompiledPrompt] = _compile("""
+    You are an expert in document extraction feedback analysis. Your job is to understand user corrections and derive intelligent extraction rules.
 
-    Respond with JSON:
-    {{
-        "table_data": [
-            {{"Column1": "value1", "Column2": "value2"}},
-            {{"Column1": null, "Column2": "value4"}}
-        ],
-        "row_count": 2,
-        "empty_cells_count": 1
-    }}
-    """
\ No newline at end of file
+    ## ANALYSIS TASK
+
+    Analyze BOTH the current feedback AND the previous feedback history in the CONTEXT section to understand:
+    1. What specific extraction errors occurred in this iteration?
+    2. What patterns emerge from the previous feedback history?
+    3. What recurring issues need to be addressed?
+    4. What general principles can prevent similar errors across all extractions?
+    5. How should the extraction logic be enhanced to incorporate ALL learned improvements?
+
+    CRITICAL: Consider feedback history to build cumulative learning. Don't just fix this issue - apply all previous learnings too.
+    Focus on creating rules that will work for ALL pages and ALL previously encountered scenarios.
+
+    ## REQUIRED JSON RESPONSE
+
+    <EXAMPLE:feedback_analysis>
+    """, """
+    ## CONTEXT
+
+    **Original Extraction Result:**
+    {original_result}
+
+    **Document Structure (Fields and Tables):**
+    {document_structure}
+
+    **Current User Feedback:**
+    "{user_feedback}"
+
+    **Previous Feedback History:**
+    {feedback_history}
+    """)
+
+ENHANCEMENT_GENERATION: Final[CompiledPrompt] = _compile("""
+    Based on the feedback analysis below, generate specific extraction enhancements.
+
+    Generate practical extraction instructions that can be added to prompts.
+
+    Respond with JSON in this format:
+    <EXAMPLE:enhancement_generation>
+    """, """
+    **Analysis Result:**
+    {analysis_result}
+
+    **Document Structure:**
+    {document_structure}
+    """)
+
+# Vision prompts are sent as the text part next to the page image. Vision requests do not
+# use JSON mode, so these keep their explicit JSON-only instruction.
+VISION_STRUCTURE_CLASSIFICATION: Final[CompiledPrompt] = _compile("""
+    Analyze this document image and classify its structure. Look at the visual layout and organization.
+
+    Classify this page as one of:
+    1. "form" - Contains form fields with labels and values (like applications, invoices)
+    2. "table" - Contains tabular data with rows and columns
+    3. "mixed" - Contains both form elements and tables
+
+    Also identify the main regions and provide confidence score.
+
+    You MUST respond with valid JSON only. No additional text or explanation.
+
+    <EXAMPLE:structure_classification>
+    """)
+
+VISION_FIELD_IDENTIFICATION: Final[CompiledPrompt] = _compile("""
+    CRITICAL INSTRUCTION: You are analyzing this document image to identify STRUCTURE ONLY.
+
+    **VISUAL ANALYSIS GUIDELINES:**
+    1. Look for labels followed by colons (:) or values - these are FORM FIELDS
+    2. Look for organized columnar data with headers above rows - these are TABLES
+    3. Focus on visual layout, alignment, and spacing to distinguish structure
+
+    **FORM FIELDS (Individual data points):**
+    - Labels like "Employee Name:", "SSN:", "DOB:" followed by individual values
+    - Usually arranged vertically or in a grid pattern
+    - Each field appears once with its specific value
+
+    **TABLE HEADERS (Column headers above tabular data):**
+    - Headers that appear above multiple rows of aligned data
+    - Look for clear column boundaries and repeated data patterns below headers
+    - Headers are typically in a different style (bold, centered, etc.)
+
+    **IMPORTANT DISTINCTIONS:**
+    - Section titles like "Rate Information" are NOT field names
+    - Page headers/footers are NOT form fields
+    - Individual values in table cells are NOT headers
+
+    **EXTRACTION RULES:**
+    - Only extract the LABEL/HEADER text, never the values
+    - For form fields: extract just the field label (e.g., "Employee Name", not "John Doe")
+    - For tables: extract just column headers (e.g., "Rate", not "19.00")
+    - Look carefully at visual alignment to group headers correctly
+
+    Respond with valid JSON in this EXACT format:
+    <EXAMPLE:vision_field_structure>
+    """, """{feedback_instruction}""")
+
+VISION_DATA_EXTRACTION: Final[CompiledPrompt] = _compile("""
+    You are a data extraction specialist. Extract actual data values from this document image using the VALIDATED field and table structure given at the end.
+
+    ## Extraction Instructions:
+
+    **For Form Fields:**
+    - Extract the exact actual values for each field listed in the structure at the end
+    - If a field exists but is empty, use null
+    - If a field is not found in the document, use null
+    - Preserve the exact formatting of values as they appear
+
+    **For Tables:**
+    - Extract ALL rows of data for each table
+    - Follow the exact column structure given for each table
+    - Preserve formatting of values (dates, numbers, currency, etc.)
+    - If a cell is empty, use null
+    - Include the column headers in the output
+
+    **Quality Standards:**
+    - Be precise - extract only what is actually visible in the document
+    - Maintain original formatting and spacing
+    - Do not make assumptions or add data that isn't there
+    - Look carefully at the visual layout to ensure accurate extraction
+
+    Respond with valid JSON only:
+    <EXAMPLE:vision_data>
+    """, """
+    {extraction_context}{feedback_section}
+    """)
+
+class PromptTemplates:
+    """Namespace exposing the module-level prompt templates to existing callers"""
+    
+    STRUCTURE_CLASSIFICATION = STRUCTURE_CLASSIFICATION
+    FORM_FIELD_IDENTIFICATION = FORM_FIELD_IDENTIFICATION
+    TABLE_HEADER_IDENTIFICATION = TABLE_HEADER_IDENTIFICATION
+    BATCHED_FORM_DATA_EXTRACTION = BATCHED_FORM_DATA_EXTRACTION
+    COMPREHENSIVE_FIELD_EXTRACTION = COMPREHENSIVE_FIELD_EXTRACTION
+    COMPREHENSIVE_DATA_EXTRACTION = COMPREHENSIVE_DATA_EXTRACTION
+    EMPLOYEE_PROFILE_TABLE_EXTRACTION = EMPLOYEE_PROFILE_TABLE_EXTRACTION
+    UNIFIED_SCHEMA_EXTRACTION_BACKUP = UNIFIED_SCHEMA_EXTRACTION_BACKUP
+    UNIFIED_SCHEMA_EXTRACTION = UNIFIED_SCHEMA_EXTRACTION
+    TABLE_DATA_EXTRACTION = TABLE_DATA_EXTRACTION
+    FORM_DATA_REFINE_DELTA = FORM_DATA_REFINE_DELTA
+    FEEDBACK_ANALYSIS = FEEDBACK_ANALYSIS
+    ENHANCEMENT_GENERATION = ENHANCEMENT_GENERATION
+    VISION_STRUCTURE_CLASSIFICATION = VISION_STRUCTURE_CLASSIFICATION
+    VISION_FIELD_IDENTIFICATION = VISION_FIELD_IDENTIFICATION
+    VISION_DATA_EXTRACTION = VISION_DATA_EXTRACTION
+    
+    render_extraction_prompt = staticmethod(render_extraction_prompt)
+    render_unified_extraction_prompt = staticmethod(render_unified_extraction_prompt)
+    serialize_field_names = staticmethod(serialize_field_names)
+    truncate_to_tokens = staticmethod(truncate_to_tokens)
+    format_page_blocks = staticmethod(format_page_blocks)
@@ -1,35 +1,90 @@
 """
 Result merger for combining multi-page extraction results
 """
+import hashlib
 import json
-from typing import Dict, Any, List
+import sys
+from dataclasses import dataclass
 from datetime import datetime
+from itertools import chain
+from operator import itemgetter
+from typing import Any, BinaryIO, Dict, List, Optional, Set, Tuple
+
+# Merge-time records; merge_multipage_results returns them as plain dicts via to_dict()
+@dataclass
+class FieldInfo:
+    """Merged value of one form field and the page it came from"""
+    __slots__ = ("value", "value_length", "source_page", "conflict_detected")
+    value: Any
+    value_length: int
+    source_page: int
+    conflict_detected: bool
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'value': self.value,
+            'source_page': self.source_page,
+            'conflict_detected': self.conflict_detected
+        }
+
+@dataclass
+class PageRecord:
+    """Merge outcome for one page; error is only set when the page failed to merge"""
+    __slots__ = ("page_number", "extraction_success", "fields_on_page", "tables_on_page",
+                 "page_metadata", "error")
+    page_number: int
+    extraction_success: bool
+    fields_on_page: int
+    tables_on_page: int
+    page_metadata: Dict[str, Any]
+    error: Optional[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not self.extraction_success:
+            return {'page_number': self.page_number, 'extraction_success': False, 'error': self.error}
+        return {
+            'page_number': self.page_number,
+            'extraction_success': True,
+            'fields_on_page': self.fields_on_page,
+            'tables_on_page': self.tables_on_page,
+            'page_metadata': self.page_metadata
+        }
 
 class ResultMerger:
-    def __init__(self):
-        pass
+    def __init__(self, dedup_table_rows: bool = True):
+        # Drop table rows repeated from an earlier page (carried-over header or last rows)
+        self.dedup_table_rows = dedup_table_rows
 
     def merge_multipage_results(self, page_results: List[Dict[str, Any]],
-                              template_metadata: Dict[str, Any]) -> Dict[str, Any]:
+                              template_metadata: Dict[str, Any],
+                              timestamp: Optional[datetime] = None) -> Dict[str, Any]:
         """
         Merge results from all pages into a single structured document
+        timestamp lets a batch driver stamp several documents with one processing time
         """
 
-        # Sort results by page number to ensure correct order
-        sorted_results = sorted(page_results,
-                              key=lambda x: x.get('page_metadata', {}).get('page_number', 0))
+        # Order results by page number; pages usually arrive in order already, so the
+        # numbers are read once and the sort only runs when needed
+        sorted_results = [
+            ((page_result.get('page_metadata') or {}).get('page_number', 0), page_result)
+            for page_result in page_results
+        ]
+        if len(sorted_results) > 1 and any(
+                sorted_results[i][0] > sorted_results[i + 1][0] for i in range(len(sorted_results) - 1)):
+            sorted_results.sort(key=itemgetter(0))
 
         # Initialize merged result structure
         merged_result = {
             'document_metadata': {
                 'total_pages': len(page_results),
-                'processing_timestamp': datetime.now().isoformat(),
+                'processing_timestamp': (timestamp or datetime.now()).isoformat(),
                 'template_used': template_metadata,
                 'extraction_method': 'multi_page_enhanced'
             },
             'merged_data': {},
             'page_specific_data': [],
             'table_data': [],
+            'table_anomalies': [],  # Filled while tables are finalized
             'extraction_summary': {
                 'successful_pages': 0,
                 'failed_pages': 0,
@@ -39,176 +94,296 @@ class ResultMerger:
         }
 
         # Process each page result
+        extraction_summary = merged_result['extraction_summary']
         form_fields = {}
-        table_collections = {}
+        table_groups = {}  # table_name -> [(page_num, table), ...]
+        page_specific_data = [None] * len(sorted_results)  # One record per page, in page order
 
-        for page_result in sorted_results:
-            page_num = page_result.get('page_metadata', {}).get('page_number', 0)
+        for index, (page_num, page_result) in enumerate(sorted_results):
+            page_metadata = page_result.get('page_metadata') or {}
+            extracted_data = page_result.get('extracted_data') or {}
+            table_data = page_result.get('table_data') or []
 
-            try:
-                # Process form fields (single values per document)
-                if 'extracted_data' in page_result:
-                    form_fields.update(
-                        self._process_page_form_fields(page_result['extracted_data'], page_num)
-                    )
+            # Malformed pages are rejected before any of their data is merged
+            error = self._validate_page_data(extracted_data, table_data)
+            if error:
+                print(f"ERROR merging page {page_num}: {error}")
+                page_specific_data[index] = PageRecord(page_num, False, 0, 0, page_metadata, error)
+                extraction_summary['failed_pages'] += 1
+                continue
 
-                # Process table data (accumulate rows across pages)
-                if 'table_data' in page_result:
-                    self._process_page_table_data(
-                        page_result['table_data'], table_collections, page_num
-                    )
+            fields_on_page = len(extracted_data)
 
-                # Store page-specific information
-                merged_result['page_specific_data'].append({
-                    'page_number': page_num,
-                    'extraction_success': True,
-                    'fields_on_page': len(page_result.get('extracted_data', {})),
-                    'tables_on_page': len(page_result.get('table_data', [])),
-                    'page_metadata': page_result.get('page_metadata', {})
-                })
+            # Process form fields (single values per document)
+            if extracted_data:
+                self._process_page_form_fields(extracted_data, page_num, form_fields)
 
-                merged_result['extraction_summary']['successful_pages'] += 1
-                merged_result['extraction_summary']['total_fields_extracted'] += len(
-                    page_result.get('extracted_data', {})
-                )
-
-            except Exception as e:
-                print(f"ERROR merging page {page_num}: {str(e)}")
-                merged_result['page_specific_data'].append({
-                    'page_number': page_num,
-                    'extraction_success': False,
-                    'error': str(e)
-                })
-                merged_result['extraction_summary']['failed_pages'] += 1
+            # Process table data (accumulate rows across pages)
+            if table_data:
+                self._process_page_table_data(table_data, table_groups, page_num)
 
-        # Finalize merged data
-        merged_result['merged_data'] = form_fields
-        merged_result['table_data'] = self._finalize_table_collections(table_collections)
-        merged_result['extraction_summary']['total_table_rows'] = sum(
-            len(table.get('rows', [])) for table in merged_result['table_data']
-        )
+            # Store page-specific information
+            page_specific_data[index] = PageRecord(
+                page_num, True, fields_on_page, len(table_data), page_metadata, None
+            )
+
+            extraction_summary['successful_pages'] += 1
+            extraction_summary['total_fields_extracted'] += fields_on_page
+
+        # Finalize merged data (plain dicts, so the result serializes with json/jsonify as before)
+        merged_result['merged_data'] = {
+            field_name: field_info.to_dict() for field_name, field_info in form_fields.items()
+        }
+        merged_result['page_specific_data'] = [record.to_dict() for record in page_specific_data]
+        merged_result['table_data'], extraction_summary['total_table_rows'] = \
+            self._finalize_table_collections(table_groups, merged_result['table_anomalies'])
 
         return merged_result
 
-    def _process_page_form_fields(self, extracted_data: Dict[str, Any], page_num: int) -> Dict[str, Any]:
+    @staticmethod
+    def _validate_page_data(extracted_data: Any, table_data: Any) -> Optional[str]:
+        """Reason a page's extraction cannot be merged, or None when it is well-formed"""
+        if not isinstance(extracted_data, dict):
+            return f"extracted_data must be an object, got {type(extracted_data).__name__}"
+        if not isinstance(table_data, list):
+            return f"table_data must be a list, got {type(table_data).__name__}"
+        for table in table_data:
+            if not isinstance(table, dict):
+                return f"table entries must be objects, got {type(table).__name__}"
+            # A null table_name, headers or rows is treated as missing (LLMs often emit null)
+            table_name = table.get('table_name')
+            if table_name is not None and not isinstance(table_name, (str, int, float)):
+                return f"table_name must be a string, got {type(table_name).__name__}"
+            for key in ('headers', 'rows'):
+                value = table.get(key)
+                if value is not None and not isinstance(value, list):
+                    return f"{key} of table {table_name!r} must be a list"
+        return None
+
+    def _process_page_form_fields(self, extracted_data: Dict[str, Any], page_num: int,
+                                  form_fields: Dict[str, FieldInfo]):
         """
-        Process form fields from a single page
-        Form fields typically appear once per document, so we take the first non-null value
+        Merge form fields from a single page into the document's fields
+        Form fields typically appear once per document, so we keep the first non-null value
+        unless a later page has a more complete one
         """
-        processed_fields = {}
-
+        get_field = form_fields.get  # Bound once; form_fields is only mutated, never replaced
         for field_name, field_value in extracted_data.items():
-            if field_value is not None and str(field_value).strip():
-                # If field already exists, check if new value is more complete
-                if field_name in processed_fields:
-                    existing_value = processed_fields[field_name].get('value')
-                    if len(str(field_value)) > len(str(existing_value)):
-                        processed_fields[field_name] = {
-                            'value': field_value,
-                            'source_page': page_num,
-                            'conflict_detected': True
-                        }
-                    else:
-                        processed_fields[field_name]['conflict_detected'] = True
-                else:
-                    processed_fields[field_name] = {
-                        'value': field_value,
-                        'source_page': page_num,
-                        'conflict_detected': False
-                    }
+            if field_value is None:
+                continue
+            str_value = field_value if isinstance(field_value, str) else str(field_value)
+            if not str_value.strip():
+                continue
 
-        return processed_fields
+            existing = get_field(field_name)
+            if existing is None:
+                # Field names repeat on every page and document; keep one shared string per name
+                form_fields[sys.intern(field_name)] = FieldInfo(field_value, len(str_value), page_num, False)
+            # Field already seen on an earlier page: keep the more complete value
+            elif len(str_value) > existing.value_length:
+                form_fields[field_name] = FieldInfo(field_value, len(str_value), page_num, True)
+            else:
+                existing.conflict_detected = True
 
     def _process_page_table_data(self, table_data: List[Dict[str, Any]],
-                               table_collections: Dict[str, Dict], page_num: int):
+                               table_groups: Dict[str, List[Tuple[int, Dict[str, Any]]]], page_num: int):
         """
-        Process table data from a single page
-        Tables accumulate rows across multiple pages
+        Group the tables of a single page by name
+        Tables accumulate rows across multiple pages; rows are concatenated once per table when finalized
         """
         for table in table_data:
-            table_name = table.get('table_name', f'Table_{len(table_collections) + 1}')
-
-            if table_name not in table_collections:
-                table_collections[table_name] = {
-                    'table_name': table_name,
-                    'headers': table.get('headers', []),
-                    'rows': [],
-                    'source_pages': [],
-                    'row_count_by_page': {}
-                }
+            table_name = table.get('table_name')
+            if table_name is None:
+                table_name = f'Table_{len(table_groups) + 1}'
+            if table_name not in table_groups:
+                table_groups[sys.intern(table_name) if isinstance(table_name, str) else table_name] = []
+            table_groups[table_name].append((page_num, table))
 
-            # Add rows from this page
-            page_rows = table.get('rows', [])
-            table_collections[table_name]['rows'].extend(page_rows)
-            table_collections[table_name]['source_pages'].append(page_num)
-            table_collections[table_name]['row_count_by_page'][page_num] = len(page_rows)
-
-    def _finalize_table_collections(self, table_collections: Dict[str, Dict]) -> List[Dict[str, Any]]:
+    def _finalize_table_collections(self, table_groups: Dict[str, List[Tuple[int, Dict[str, Any]]]],
+                                    table_anomalies: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
         """
-        Finalize table collections with metadata
+        Build each table from its per-page parts, with metadata
+        Returns the finalized tables and their total row count; row structure anomalies found
+        while the rows are assembled are appended to table_anomalies
         """
         finalized_tables = []
+        total_rows = 0
 
-        for table_name, table_data in table_collections.items():
+        for table_name, entries in table_groups.items():
+            page_rows = [(page_num, table.get('rows') or []) for page_num, table in entries]
+            source_pages = [page_num for page_num, _ in page_rows]
+            if len(page_rows) == 1:
+                # Table found on one page only (always the case for single-page documents):
+                # nothing to concatenate, deduplicate or cross-check, so its row list is reused as is
+                rows = page_rows[0][1]
+                rows_by_page = {page_rows[0][0]: len(rows)}
+            else:
+                if self.dedup_table_rows:
+                    rows, rows_by_page, row_lengths = self._merge_page_rows_dedup(page_rows)
+                else:
+                    rows = list(chain.from_iterable(table_rows for _, table_rows in page_rows))
+                    rows_by_page = {page_num: len(table_rows) for page_num, table_rows in page_rows}
+                    row_lengths = {len(row) for row in rows if isinstance(row, dict)}
+                anomaly = self._row_structure_anomaly(table_name, row_lengths)
+                if anomaly:
+                    table_anomalies.append(anomaly)
             finalized_table = {
                 'table_name': table_name,
-                'headers': table_data['headers'],
-                'rows': table_data['rows'],
+                'headers': [
+                    sys.intern(header) if isinstance(header, str) else header
+                    for header in entries[0][1].get('headers') or []
+                ],
+                'rows': rows,
                 'metadata': {
-                    'total_rows': len(table_data['rows']),
-                    'source_pages': sorted(table_data['source_pages']),
-                    'rows_by_page': table_data['row_count_by_page'],
-                    'spans_multiple_pages': len(table_data['source_pages']) > 1
+                    'total_rows': len(rows),
+                    'source_pages': sorted(source_pages),
+                    'rows_by_page': rows_by_page,
+                    'spans_multiple_pages': len(source_pages) > 1
                 }
             }
             finalized_tables.append(finalized_table)
+            total_rows += len(rows)
+
+        return finalized_tables, total_rows
+
+    @staticmethod
+    def _row_fingerprint(row: Any) -> bytes:
+        """Fixed-size digest of a row's canonical JSON, so equal rows compare equal regardless of key order"""
+        canonical = json.dumps(row, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).digest()
+
+    def _merge_page_rows_dedup(self, page_rows: List[Tuple[int, List[Any]]]
+                               ) -> Tuple[List[Any], Dict[int, int], Set[int]]:
+        """
+        Concatenate per-page rows, skipping rows already seen on an earlier page
+        Repeats within one page are kept, since a table may legitimately contain identical rows.
+        Also returns the distinct lengths of the kept dict rows.
+        """
+        seen = set()
+        rows = []
+        rows_by_page = {}
+        row_lengths = set()
+        # Per-row loop: resolve the method lookups once
+        row_fingerprint = self._row_fingerprint
+        append_row = rows.append
+        add_length = row_lengths.add
+        for page_num, table_rows in page_rows:
+            page_fingerprints = []
+            kept = 0
+            for row in table_rows:
+                fingerprint = row_fingerprint(row)
+                if fingerprint in seen:
+                    continue
+                page_fingerprints.append(fingerprint)
+                append_row(row)
+                kept += 1
+                if isinstance(row, dict):
+                    add_length(len(row))
+            seen.update(page_fingerprints)
+            rows_by_page[page_num] = rows_by_page.get(page_num, 0) + kept
+        return rows, rows_by_page, row_lengths
+
+    @staticmethod
+    def _row_structure_anomaly(table_name: str, row_lengths: Set[int]) -> Optional[Dict[str, Any]]:
+        """Anomaly record for a multi-page table whose rows have differing numbers of columns"""
+        if len(row_lengths) <= 1:
+            return None
+        return {
+            'table': table_name,
+            'issue': 'Inconsistent row structure across pages',
+            'details': f"Row lengths vary: {row_lengths}"
+        }
 
-        return finalized_tables
+    @staticmethod
+    def _clean_field_value(field_info: Any) -> Any:
+        """Plain value of a merged field"""
+        if isinstance(field_info, dict) and 'value' in field_info:
+            return field_info['value']
+        return field_info
+
+    @staticmethod
+    def _clean_table(table: Dict[str, Any]) -> Dict[str, Any]:
+        """Download layout of a finalized table"""
+        return {
+            'table_name': table['table_name'],
+            'headers': table['headers'],
+            'data': table['rows'],
+            'total_rows': len(table['rows'])
+        }
+
+    @staticmethod
+    def _final_sections(merged_result: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """document_info and processing_summary sections of the final output"""
+        document_metadata = merged_result['document_metadata']
+        extraction_summary = merged_result['extraction_summary']
+        document_info = {
+            'total_pages_processed': document_metadata['total_pages'],
+            'extraction_date': document_metadata['processing_timestamp'],
+            'extraction_method': 'AI-assisted with human validation'
+        }
+        processing_summary = {
+            'total_fields': len(merged_result['merged_data']),
+            'total_tables': len(merged_result['table_data']),
+            'total_table_rows': extraction_summary['total_table_rows'],
+            'successful_pages': extraction_summary['successful_pages'],
+            'failed_pages': extraction_summary['failed_pages']
+        }
+        return document_info, processing_summary
 
     def create_final_json_output(self, merged_result: Dict[str, Any]) -> Dict[str, Any]:
         """
         Create clean final JSON output for user download
         """
-
-        # Extract clean field values
-        clean_fields = {}
-        for field_name, field_info in merged_result['merged_data'].items():
-            if isinstance(field_info, dict) and 'value' in field_info:
-                clean_fields[field_name] = field_info['value']
-            else:
-                clean_fields[field_name] = field_info
-
-        # Create clean table data
-        clean_tables = []
-        for table in merged_result['table_data']:
-            clean_table = {
-                'table_name': table['table_name'],
-                'headers': table['headers'],
-                'data': table['rows'],
-                'total_rows': len(table['rows'])
-            }
-            clean_tables.append(clean_table)
+        document_info, processing_summary = self._final_sections(merged_result)
 
         # Final clean output
         final_output = {
-            'document_info': {
-                'total_pages_processed': merged_result['document_metadata']['total_pages'],
-                'extraction_date': merged_result['document_metadata']['processing_timestamp'],
-                'extraction_method': 'AI-assisted with human validation'
+            'document_info': document_info,
+            'extracted_fields': {
+                field_name: self._clean_field_value(field_info)
+                for field_name, field_info in merged_result['merged_data'].items()
             },
-            'extracted_fields': clean_fields,
-            'extracted_tables': clean_tables,
-            'processing_summary': {
-                'total_fields': len(clean_fields),
-                'total_tables': len(clean_tables),
-                'total_table_rows': sum(table['total_rows'] for table in clean_tables),
-                'successful_pages': merged_result['extraction_summary']['successful_pages'],
-                'failed_pages': merged_result['extraction_summary']['failed_pages']
-            }
+            'extracted_tables': [self._clean_table(table) for table in merged_result['table_data']],
+            'processing_summary': processing_summary
         }
 
         return final_output
 
+    def write_final_json(self, merged_result: Dict[str, Any], fp: BinaryIO) -> None:
+        """
+        Stream the final JSON output to a binary file object, field by field and table by table
+        Same document as to_json_bytes(create_final_json_output(...)) without building it in memory first
+        """
+        document_info, processing_summary = self._final_sections(merged_result)
+
+        fp.write(b'{"document_info":')
+        fp.write(self.to_json_bytes(document_info))
+
+        fp.write(b',"extracted_fields":{')
+        for index, (field_name, field_info) in enumerate(merged_result['merged_data'].items()):
+            if index:
+                fp.write(b',')
+            fp.write(self.to_json_bytes(field_name))
+            fp.write(b':')
+            fp.write(self.to_json_bytes(self._clean_field_value(field_info)))
+
+        fp.write(b'},"extracted_tables":[')
+        for index, table in enumerate(merged_result['table_data']):
+            if index:
+                fp.write(b',')
+            fp.write(self.to_json_bytes(self._clean_table(table)))
+
+        fp.write(b'],"processing_summary":')
+        fp.write(self.to_json_bytes(processing_summary))
+        fp.write(b'}')
+
+    def to_json_bytes(self, output: Any) -> bytes:
+        """
+        Serialize a merged result or final output for download/storage
+        Compact separators and no indentation keep large multi-page outputs fast to encode
+        """
+        return json.dumps(output, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
     def detect_conflicts_and_anomalies(self, merged_result: Dict[str, Any]) -> Dict[str, Any]:
         """
         Detect potential conflicts or anomalies in merged data
@@ -229,16 +404,17 @@ class ResultMerger:
                     'resolution': 'Using longest/most complete value'
                 })
 
-        # Check for table anomalies
-        for table in merged_result['table_data']:
-            if table['metadata']['spans_multiple_pages']:
-                # Check for header consistency across pages
-                row_lengths = [len(row) for row in table['rows'] if isinstance(row, dict)]
-                if len(set(row_lengths)) > 1:
-                    conflicts['table_anomalies'].append({
-                        'table': table['table_name'],
-                        'issue': 'Inconsistent row structure across pages',
-                        'details': f"Row lengths vary: {set(row_lengths)}"
-                    })
+        # Table anomalies are found while merging; results merged elsewhere are checked here
+        if 'table_anomalies' in merged_result:
+            conflicts['table_anomalies'].extend(merged_result['table_anomalies'])
+        else:
+            for table in merged_result['table_data']:
+                if table['metadata']['spans_multiple_pages']:
+                    # Check for header consistency across pages
+                    anomaly = self._row_structure_anomaly(
+                        table['table_name'], {len(row) for row in table['rows'] if isinstance(row, dict)}
+                    )
+                    if anomaly:
+                        conflicts['table_anomalies'].append(anomaly)
 
         return conflicts
\ No newline at end of file
@@ -1,12 +1,26 @@
 import re
 import math
+from bisect import bisect_left
+from operator import itemgetter
 from typing import List, Dict, Any, Tuple, Optional
 
+# Text starting with a date (MM/DD/YYYY), phone number (123-456-7890) or SSN (123-45-6789)
+_FORMATTED_VALUE = re.compile(r"\d{1,2}/\d{1,2}/\d{4}|\d{3}-\d{3}-\d{4}|\d{3}-\d{2}-\d{4}")
+
 class SpatialPreprocessor:
     """
     Preprocesses word coordinates to identify field structures and format text 
     for improved LLM understanding of document layout
     """
+    # Label words checked by is_field_pattern besides field_keywords
+    COMMON_FIELDS = ('status', 'emp', 'employee', 'position', 'title', 'gender', 'marital',
+                     'hire', 'term', 'supervisor', 'department', 'division', 'location')
+    # Suffixes of the lowercased cluster text that mark a field label
+    FIELD_ENDINGS = (':', '#', 'no', 'id', 'code', 'name', 'date', 'type', 'status', 'group')
+    # Last words that mark a field label
+    FIELD_LAST_WORDS = frozenset(('id', 'no', 'type', 'code', 'date', 'status', 'group', 'name', 'title'))
+    # Maximum number of cluster texts remembered by is_field_pattern before the cache is reset
+    FIELD_PATTERN_CACHE_SIZE = 4096
     
     def __init__(self, proximity_threshold_multiplier: float = 2.0):
         """
@@ -23,14 +37,27 @@ class SpatialPreprocessor:
             'address', 'phone', 'email', 'ssn', 'tax', 'salary', 'rate', 'amount',
             'total', 'sum', 'balance', 'payment', 'account', 'reference', 'ref'
         ]
+        # Keyword substring checks as compiled alternations: one regex scan instead of one
+        # `in` scan per keyword
+        self._field_keyword_pattern = self._keyword_pattern(self.field_keywords)
+        self._label_keyword_pattern = self._keyword_pattern(self.field_keywords + list(self.COMMON_FIELDS))
+        # is_field_pattern results by cluster word texts; repeated pages reuse the same labels
+        self._field_pattern_cache: Dict[Tuple[str, ...], bool] = {}
+    
+    @staticmethod
+    def _keyword_pattern(keywords: List[str]) -> "re.Pattern[str]":
+        """Pattern that finds any of the keywords as a substring"""
+        return re.compile("|".join(re.escape(keyword) for keyword in dict.fromkeys(keywords)))
     
-    def preprocess_document(self, word_coordinates: List[Dict[str, Any]]) -> str:
+    def preprocess_document(self, word_coordinates: List[Dict[str, Any]],
+                            lines: Optional[List[List[Dict[str, Any]]]] = None) -> str:
         """
         Main preprocessing function that converts word coordinates into 
         spatially-formatted text for LLM consumption
         
         Args:
             word_coordinates: List of word dictionaries with coordinate information
+            lines: Optional output of group_words_into_lines(word_coordinates) to reuse
             
         Returns:
             Formatted text string with proper spacing and field identification
@@ -39,13 +66,27 @@ class SpatialPreprocessor:
             return ""
         
         # Group words into lines
-        lines = self.group_words_into_lines(word_coordinates)
+        if lines is None:
+            lines = self.group_words_into_lines(self._plain_word_dicts(word_coordinates))
         
         # Process lines with multi-line field-value pair detection
         formatted_lines = self.process_multiline_fields(lines)
         
         return "\n".join(formatted_lines)
     
+    @staticmethod
+    def _plain_word_dicts(word_coordinates: List[Any]) -> List[Dict[str, Any]]:
+        """
+        Copy pdf_processor Word objects into plain dicts with just the keys used here, so the
+        hot loops index a dict instead of calling Word.__getitem__ for every coordinate
+        """
+        if isinstance(word_coordinates[0], dict):
+            return word_coordinates
+        return [
+            {"text": w.text, "x0": w.x0, "y0": w.y0, "x1": w.x1, "y1": w.y1, "center_x": w.center_x}
+            for w in word_coordinates
+        ]
+    
     def process_multiline_fields(self, lines: List[List[Dict[str, Any]]]) -> List[str]:
         """
         Process lines with awareness of multi-line field-value patterns
@@ -89,8 +130,14 @@ class SpatialPreprocessor:
         if not line_words:
             return False
             
-        # Look for field-like words in the line
+        # Look for field-like words in the line. Empty text, pure digits, currency/percent
+        # amounts and single letters are always classified as values, so skip them before
+        # running the full pattern check.
         for word in line_words:
+            text = word["text"]
+            if (not text or text.isdigit() or text[0] == '$' or text[-1] == '%'
+                    or (len(text) == 1 and text.isalpha())):
+                continue
             if self.is_field_pattern([word]):
                 return True
         return False
@@ -110,21 +157,22 @@ class SpatialPreprocessor:
             return False
         
         # Check if value line words are positioned under field line words
-        field_x_positions = [w['center_x'] for w in field_line]
-        value_x_positions = [w['center_x'] for w in value_line]
+        value_x_positions = sorted(w['center_x'] for w in value_line)
+        last_value = len(value_x_positions) - 1
         
         # Check for vertical alignment (values under fields)
-        alignments = 0
         tolerance = 30  # pixels
         
-        for field_x in field_x_positions:
-            for value_x in value_x_positions:
-                if abs(field_x - value_x) <= tolerance:
-                    alignments += 1
-                    break
-        
-        # If at least one field has a value below it, consider it a value line
-        return alignments > 0
+        # If at least one field has a value below it, consider it a value line. The value
+        # nearest to a field is one of the two around its insertion point in the sorted values.
+        for word in field_line:
+            field_x = word['center_x']
+            index = bisect_left(value_x_positions, field_x)
+            if index <= last_value and value_x_positions[index] - field_x <= tolerance:
+                return True
+            if index > 0 and field_x - value_x_positions[index - 1] <= tolerance:
+                return True
+        return False
     
     def process_field_line_with_values(self, field_line: List[Dict[str, Any]], value_line: List[Dict[str, Any]] = None) -> str:
         """
@@ -150,25 +198,38 @@ class SpatialPreprocessor:
         
         # Match field clusters to value clusters by position
         field_value_pairs = []
+        # Whether each value cluster is itself a field label, classified on first use
+        value_is_field = [None] * len(value_clusters)
+        # Value cluster centers are needed for every field cluster, so compute them once per line
+        value_centers = self._cluster_centers(value_clusters)
         
         for field_cluster in field_clusters:
             if self.is_field_pattern(field_cluster):
                 field_name = " ".join([w["text"] for w in field_cluster])
-                field_center_x = sum(w['center_x'] for w in field_cluster) / len(field_cluster)
+                field_center_x = sum(map(itemgetter("center_x"), field_cluster)) / len(field_cluster)
                 
-                # Find matching value cluster by X position
-                best_value = None
-                min_distance = float('inf')
+                # Find matching value cluster by X position: the nearest cluster within
+                # tolerance that is not another field (the first one on equal distance)
                 tolerance = 50  # pixels
+                candidates = sorted(
+                    (distance, value_index)
+                    for value_index, distance in enumerate(abs(field_center_x - value_center_x)
+                                                           for value_center_x in value_centers)
+                    if distance <= tolerance
+                )
                 
-                for value_cluster in value_clusters:
-                    value_center_x = sum(w['center_x'] for w in value_cluster) / len(value_cluster)
-                    distance = abs(field_center_x - value_center_x)
-                    
-                    if distance <= tolerance and distance < min_distance:
-                        if not self.is_field_pattern(value_cluster):  # Make sure it's not another field
-                            best_value = " ".join([w["text"] for w in value_cluster])
-                            min_distance = distance
+                best_index = None
+                for _, value_index in candidates:
+                    if value_is_field[value_index] is None:
+                        value_is_field[value_index] = self.is_field_pattern(value_clusters[value_index])
+                    if not value_is_field[value_index]:  # Make sure it's not another field
+                        best_index = value_index
+                        break
+                
+                # Only the winning cluster's text is joined
+                best_value = None
+                if best_index is not None:
+                    best_value = " ".join([w["text"] for w in value_clusters[best_index]])
                 
                 if best_value:
                     field_value_pairs.append(f"{field_name}:\t{best_value}")
@@ -196,29 +257,24 @@ class SpatialPreprocessor:
             return []
         
         # Sort words by Y coordinate first, then X coordinate
-        sorted_words = sorted(words, key=lambda w: (w["y0"], w["x0"]))
+        sorted_words = sorted(words, key=itemgetter("y0", "x0"))
         
+        # Find the line breaks on the Y coordinates alone, then slice the sorted words once per line
         lines = []
-        current_line = [sorted_words[0]]
+        line_start = 0
         current_y = sorted_words[0]["y0"]
         
-        for word in sorted_words[1:]:
-            # Check if word is on the same line (within Y tolerance)
-            if abs(word["y0"] - current_y) <= y_tolerance:
-                current_line.append(word)
-            else:
-                # Sort current line by X coordinate and add to lines
-                current_line.sort(key=lambda w: w["x0"])
-                lines.append(current_line)
+        for position, y0 in enumerate([w["y0"] for w in sorted_words]):
+            # Check if word is on the same line (within Y tolerance of the line's first word)
+            if abs(y0 - current_y) > y_tolerance:
+                lines.append(sorted(sorted_words[line_start:position], key=itemgetter("x0")))
                 
                 # Start new line
-                current_line = [word]
-                current_y = word["y0"]
+                line_start = position
+                current_y = y0
         
         # Add the last line
-        if current_line:
-            current_line.sort(key=lambda w: w["x0"])
-            lines.append(current_line)
+        lines.append(sorted(sorted_words[line_start:], key=itemgetter("x0")))
         
         return lines
     
@@ -238,17 +294,18 @@ class SpatialPreprocessor:
         # Calculate word spacing to identify clusters
         word_clusters = self.cluster_words_by_proximity(line_words)
         
-        # Identify field patterns in clusters
+        # Identify field patterns in clusters; each cluster is classified once, and the result
+        # is reused when it is the value candidate of the cluster before it
+        is_field = [self.is_field_pattern(cluster) for cluster in word_clusters]
+        
         formatted_parts = []
-        for cluster in word_clusters:
-            cluster_text = " ".join([w["text"] for w in cluster])
-            
+        for cluster_index, cluster in enumerate(word_clusters):
             # Check if this cluster represents a field pattern
-            if self.is_field_pattern(cluster):
-                formatted_field = self.format_as_field_cluster(cluster, word_clusters)
+            if is_field[cluster_index]:
+                formatted_field = self.format_as_field_cluster(cluster, word_clusters, cluster_index, is_field)
                 formatted_parts.append(formatted_field)
             else:
-                formatted_parts.append(cluster_text)
+                formatted_parts.append(" ".join([w["text"] for w in cluster]))
         
         return "    ".join(formatted_parts)  # Use consistent spacing between clusters
     
@@ -265,16 +322,8 @@ class SpatialPreprocessor:
         if len(line_words) <= 1:
             return [line_words]
         
-        # Calculate average spacing between consecutive words
-        spacings = []
-        for i in range(len(line_words) - 1):
-            current_word = line_words[i]
-            next_word = line_words[i + 1]
-            spacing = next_word["x0"] - current_word["x1"]
-            spacings.append(spacing)
-        
-        if not spacings:
-            return [line_words]
+        # Spacing between consecutive words, computed once for both the average and the split
+        spacings = [word["x0"] - previous["x1"] for previous, word in zip(line_words, line_words[1:])]
         
         avg_spacing = sum(spacings) / len(spacings)
         cluster_threshold = avg_spacing * self.proximity_threshold_multiplier
@@ -283,18 +332,21 @@ class SpatialPreprocessor:
         clusters = []
         current_cluster = [line_words[0]]
         
-        for i in range(1, len(line_words)):
-            spacing = line_words[i]["x0"] - line_words[i-1]["x1"]
-            
+        for word, spacing in zip(line_words[1:], spacings):
             if spacing <= cluster_threshold:
-                current_cluster.append(line_words[i])
+                current_cluster.append(word)
             else:
                 clusters.append(current_cluster)
-                current_cluster = [line_words[i]]
+                current_cluster = [word]
         
         clusters.append(current_cluster)
         return clusters
     
+    @staticmethod
+    def _cluster_centers(clusters: List[List[Dict[str, Any]]]) -> List[float]:
+        """Mean center_x of each non-empty cluster from cluster_words_by_proximity"""
+        return [sum(map(itemgetter("center_x"), cluster)) / len(cluster) for cluster in clusters]
+    
     def is_field_pattern(self, word_cluster: List[Dict[str, Any]]) -> bool:
         """
         Determine if a word cluster represents a field label pattern
@@ -308,42 +360,44 @@ class SpatialPreprocessor:
         if not word_cluster:
             return False
         
-        cluster_text = " ".join([w["text"].lower() for w in word_cluster])
-        original_text = " ".join([w["text"] for w in word_cluster])
+        # The result depends only on the word texts, which repeat across pages of the same form
+        words = tuple([w["text"] for w in word_cluster])
+        is_field = self._field_pattern_cache.get(words)
+        if is_field is None:
+            if len(self._field_pattern_cache) >= self.FIELD_PATTERN_CACHE_SIZE:
+                self._field_pattern_cache.clear()
+            is_field = self._field_pattern_cache[words] = self._classify_field_words(words)
+        return is_field
+    
+    def _classify_field_words(self, words: Tuple[str, ...]) -> bool:
+        """Uncached is_field_pattern check on a cluster's word texts"""
+        # Every text form below is derived from the word texts
+        original_text = " ".join(words)
+        cluster_text = original_text.lower()
         
         # Skip obvious value patterns (numbers, dates, single letters)
         if self.is_obvious_value_pattern(original_text):
             return False
         
-        # Pattern 1: Contains field keywords
-        if any(keyword in cluster_text for keyword in self.field_keywords):
+        # Pattern 1: Contains field keywords or common field names (case-insensitive)
+        if self._label_keyword_pattern.search(cluster_text):
             return True
         
         # Pattern 2: Ends with common field indicators
-        field_endings = [':', '#', 'no', 'id', 'code', 'name', 'date', 'type', 'status', 'group']
-        if any(cluster_text.endswith(ending) for ending in field_endings):
+        if cluster_text.endswith(self.FIELD_ENDINGS):
             return True
         
         # Pattern 3: Title case pattern (multiple capitalized words) - but not all caps
-        words = [w["text"] for w in word_cluster]
         if len(words) >= 2:
             title_case_count = sum(1 for word in words if word and word[0].isupper() and not word.isupper())
             if title_case_count >= len(words) * 0.7:  # At least 70% are title case
                 return True
         
-        # Pattern 4: Common field names (case-insensitive)
-        common_fields = ['status', 'emp', 'employee', 'position', 'title', 'gender', 'marital', 
-                        'hire', 'term', 'supervisor', 'department', 'division', 'location']
-        if any(field in cluster_text for field in common_fields):
+        # Pattern 4: Ends with specific field words
+        field_words = cluster_text.rsplit(None, 1)
+        if field_words and field_words[-1] in self.FIELD_LAST_WORDS:
             return True
         
-        # Pattern 5: Ends with specific field words
-        field_words = original_text.split()
-        if field_words:
-            last_word = field_words[-1].lower()
-            if last_word in ['id', 'no', 'type', 'code', 'date', 'status', 'group', 'name', 'title']:
-                return True
-        
         return False
     
     def is_obvious_value_pattern(self, text: str) -> bool:
@@ -370,53 +424,45 @@ class SpatialPreprocessor:
         if text.startswith('$') or text.endswith('%'):
             return True
         
-        # Dates (MM/DD/YYYY pattern)
-        import re
-        if re.match(r'\d{1,2}/\d{1,2}/\d{4}', text):
-            return True
-        
-        # Phone numbers
-        if re.match(r'\d{3}-\d{3}-\d{4}', text):
-            return True
-        
-        # SSN pattern
-        if re.match(r'\d{3}-\d{2}-\d{4}', text):
+        # Dates, phone numbers and SSNs
+        if _FORMATTED_VALUE.match(text):
             return True
         
         # All uppercase short codes (but not field names)
-        if text.isupper() and len(text) <= 6 and not any(keyword in text.lower() for keyword in self.field_keywords):
+        if text.isupper() and len(text) <= 6 and not self._field_keyword_pattern.search(text.lower()):
             return True
         
         return False
     
-    def format_as_field_cluster(self, field_cluster: List[Dict[str, Any]], all_clusters: List[List[Dict[str, Any]]]) -> str:
+    def format_as_field_cluster(self, field_cluster: List[Dict[str, Any]], all_clusters: List[List[Dict[str, Any]]],
+                                field_index: int, is_field: Optional[List[bool]] = None) -> str:
         """
         Format a field cluster with proper spacing for LLM understanding
         
         Args:
             field_cluster: The cluster identified as a field
             all_clusters: All clusters on the line for context
+            field_index: Position of field_cluster in all_clusters
+            is_field: Optional precomputed is_field_pattern result for each cluster in all_clusters
             
         Returns:
             Formatted field string
         """
         field_name = " ".join([w["text"] for w in field_cluster])
         
-        # Find the next cluster (potential field value)
-        try:
-            field_index = all_clusters.index(field_cluster)
-            if field_index < len(all_clusters) - 1:
-                value_cluster = all_clusters[field_index + 1]
-                field_value = " ".join([w["text"] for w in value_cluster])
-                
-                # Check if value cluster also looks like a field (indicates current field is empty)
-                if self.is_field_pattern(value_cluster):
-                    return f"{field_name}:\t[EMPTY]"
-                else:
-                    return f"{field_name}:\t{field_value}"
-            else:
+        # The next cluster is the potential field value
+        if field_index < len(all_clusters) - 1:
+            value_cluster = all_clusters[field_index + 1]
+            field_value = " ".join([w["text"] for w in value_cluster])
+            
+            # Check if value cluster also looks like a field (indicates current field is empty)
+            value_is_field = (is_field[field_index + 1] if is_field is not None
+                              else self.is_field_pattern(value_cluster))
+            if value_is_field:
                 return f"{field_name}:\t[EMPTY]"
-        except ValueError:
+            else:
+                return f"{field_name}:\t{field_value}"
+        else:
             return f"{field_name}:\t[EMPTY]"
     
     def calculate_word_spacing_stats(self, word_coordinates: List[Dict[str, Any]]) -> Dict[str, float]:
@@ -432,47 +478,49 @@ class SpatialPreprocessor:
         if len(word_coordinates) < 2:
             return {"avg_spacing": 0, "median_spacing": 0, "spacing_std": 0}
         
-        spacings = []
-        sorted_words = sorted(word_coordinates, key=lambda w: (w["y0"], w["x0"]))
+        sorted_words = sorted(word_coordinates, key=itemgetter("y0", "x0"))
         
-        for i in range(len(sorted_words) - 1):
-            current = sorted_words[i]
-            next_word = sorted_words[i + 1]
-            
-            # Only calculate spacing for words on the same line
-            if abs(current["y0"] - next_word["y0"]) <= 5:
-                spacing = next_word["x0"] - current["x1"]
-                if spacing >= 0:  # Ignore overlapping words
-                    spacings.append(spacing)
+        # Spacing between consecutive words on the same line, ignoring overlapping words
+        spacings = [
+            spacing
+            for current, next_word in zip(sorted_words, sorted_words[1:])
+            if abs(current["y0"] - next_word["y0"]) <= 5
+            and (spacing := next_word["x0"] - current["x1"]) >= 0
+        ]
         
         if not spacings:
             return {"avg_spacing": 0, "median_spacing": 0, "spacing_std": 0}
         
         avg_spacing = sum(spacings) / len(spacings)
-        sorted_spacings = sorted(spacings)
-        median_spacing = sorted_spacings[len(sorted_spacings) // 2]
         
         # Calculate standard deviation
-        variance = sum((s - avg_spacing) ** 2 for s in spacings) / len(spacings)
+        variance = sum([(s - avg_spacing) ** 2 for s in spacings]) / len(spacings)
         spacing_std = math.sqrt(variance)
         
+        # The list is no longer needed in document order, so sort it in place for the median
+        spacings.sort()
+        median_spacing = spacings[len(spacings) // 2]
+        
         return {
             "avg_spacing": avg_spacing,
             "median_spacing": median_spacing, 
             "spacing_std": spacing_std
         }
     
-    def identify_table_regions(self, word_coordinates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def identify_table_regions(self, word_coordinates: List[Dict[str, Any]],
+                               lines: Optional[List[List[Dict[str, Any]]]] = None) -> List[Dict[str, Any]]:
         """
         Identify potential table regions based on word alignment patterns
         
         Args:
             word_coordinates: List of word dictionaries
+            lines: Optional output of group_words_into_lines(word_coordinates) to reuse
             
         Returns:
             List of table region dictionaries
         """
-        lines = self.group_words_into_lines(word_coordinates)
+        if lines is None:
+            lines = self.group_words_into_lines(word_coordinates)
         table_regions = []
         
         # Look for lines with consistent column alignment
@@ -539,10 +587,10 @@ class SpatialPreprocessor:
         """
         # Get bounding box of entire table
         all_words = [word for line in table_lines for word in line]
-        min_x = min(w["x0"] for w in all_words)
-        max_x = max(w["x1"] for w in all_words)
-        min_y = min(w["y0"] for w in all_words)
-        max_y = max(w["y1"] for w in all_words)
+        min_x = min(map(itemgetter("x0"), all_words))
+        max_x = max(map(itemgetter("x1"), all_words))
+        min_y = min(map(itemgetter("y0"), all_words))
+        max_y = max(map(itemgetter("y1"), all_words))
         
         # Identify potential headers (first line)
         headers = [w["text"] for w in table_lines[0]]
@@ -5,21 +5,140 @@ Converts PDF pages to images and uses AI vision for accurate extraction
 
 import fitz  # PyMuPDF
 import base64
-import io
-from typing import Dict, List, Any, Optional, Tuple
-from PIL import Image
-from openai import OpenAI
+import hashlib
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple
+import httpx
+from openai import OpenAI, APIConnectionError, RateLimitError
 import json
 import time
 import os
+import random
+import threading
+import atexit
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import chain, repeat
+from config import GPTConfig
+from .prompts import VISION_DATA_EXTRACTION, VISION_FIELD_IDENTIFICATION, VISION_STRUCTURE_CLASSIFICATION
+
+class PageImage(NamedTuple):
+    """Encoded page image with the pixel size it was rendered at"""
+    image_data: bytes
+    width: int
+    height: int
+
+class RenderedPage(NamedTuple):
+    """Render cache entry: the encoded page image and its data URL for vision requests"""
+    image: PageImage
+    data_url: str
+
+def _render_page_image(page, dpi: int, image_format: str, jpeg_quality: int,
+                       grayscale: bool = True) -> PageImage:
+    """Render a fitz page to encoded image bytes (single-channel unless grayscale is False)"""
+    # Create transformation matrix for desired DPI
+    # PyMuPDF uses 72 DPI by default, so scale factor = desired_dpi / 72
+    scale_factor = dpi / 72.0
+    matrix = fitz.Matrix(scale_factor, scale_factor)
+    
+    # Render page to image (pixmap); the alpha channel is never used
+    pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY if grayscale else fitz.csRGB, alpha=False)
+    
+    # Convert to image bytes (jpg_quality only applies to JPEG output)
+    return PageImage(pix.tobytes(image_format, jpg_quality=jpeg_quality), pix.width, pix.height)
+
+def _render_page_chunk(pdf_path: str, page_nums: List[int], dpi: int, image_format: str,
+                       jpeg_quality: int, grayscale: bool = True) -> List[PageImage]:
+    """Render several pages with one document handle; module-level so worker processes can run it"""
+    with fitz.open(pdf_path) as doc:
+        for page_num in page_nums:
+            if page_num >= len(doc):
+                raise ValueError(f"Page {page_num} does not exist in PDF with {len(doc)} pages")
+        return [_render_page_image(doc[page_num], dpi, image_format, jpeg_quality, grayscale)
+                for page_num in page_nums]
+
+# Worker processes for multi-page rendering, created on first use and shared by all extractors.
+# Spawned rather than forked: forking the threaded Flask process can copy locks held by other
+# threads (MuPDF, allocator, HTTP pool) into the children and deadlock them.
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_lock = threading.Lock()
+
+def _get_render_pool(max_workers: int) -> ProcessPoolExecutor:
+    """The shared render process pool, started on first use"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=max_workers,
+                                               mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_render_pool.shutdown)
+        return _render_pool
+
+def _discard_render_pool(pool: ProcessPoolExecutor):
+    """Drop a broken render pool so the next multi-page render starts a new one"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is pool:
+            _render_pool = None
+    pool.shutdown(wait=False)
+
+def _drop_trailing_comma(chars: List[str]):
+    """Remove a comma (and the whitespace after it) from the end of a character buffer"""
+    i = len(chars) - 1
+    while i >= 0 and chars[i].isspace():
+        i -= 1
+    if i >= 0 and chars[i] == ',':
+        del chars[i:]
+
+_JSON_DECODER = json.JSONDecoder()
+# Debug copies of vision responses are written off the request path, one file at a time
+_debug_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vision-debug")
 
 class VisionBasedExtractor:
-    def __init__(self, api_key: str):
-        """Initialize the vision-based extractor with OpenAI API key"""
-        self.client = OpenAI(api_key=api_key)
+    # Rendered pages kept in memory; the structure, field and data steps all render the same page
+    RENDER_CACHE_SIZE = 16
+    # Page images sent to the model. High-detail vision scales every image to at most 768 px
+    # on the short side, so 200 DPI keeps all usable detail; JPEG is several times smaller than PNG
+    RENDER_DPI = 200
+    IMAGE_FORMAT = "jpeg"
+    IMAGE_MIME_TYPE = "image/jpeg"
+    JPEG_QUALITY = 85
+    # Printed forms and tables read the same in grayscale, at a third of the pixmap size of RGB;
+    # set False for documents where cell colour carries meaning
+    GRAYSCALE = True
+    # Worker processes for multi-page rendering (PyMuPDF holds the GIL while rendering);
+    # gains flatten out beyond about six workers
+    RENDER_WORKERS = 6
+    # Open document handles reused for in-process rendering
+    DOCUMENT_CACHE_SIZE = 4
+    # Seconds to wait for a vision response
+    REQUEST_TIMEOUT = 120
+    # Rate-limit, connection and timeout errors are retried (up to GPTConfig.MAX_RETRIES attempts)
+    # after a jittered exponential backoff, in seconds
+    RETRY_INITIAL_DELAY = 1.0
+    RETRY_MAX_DELAY = 30.0
+    RETRYABLE_ERRORS = (RateLimitError, APIConnectionError)  # APITimeoutError is an APIConnectionError
+    # Rendered extraction contexts kept per validated structure
+    CONTEXT_CACHE_SIZE = 32
+    # Parsed vision responses kept per (page image, request); requests run at temperature 0,
+    # so re-sending the same page with the same prompt during feedback rounds is answered locally
+    RESPONSE_CACHE_SIZE = 256
+    
+    def __init__(self, api_key: str, http_client: Optional[httpx.Client] = None):
+        """Initialize the vision-based extractor with OpenAI API key (and optionally a shared HTTP pool)"""
+        # Retries are handled (with jitter) in _vision_call rather than by the client
+        self.client = OpenAI(api_key=api_key, max_retries=0, http_client=http_client)
         self.model = "gpt-4o"  # GPT-4o with vision capabilities
+        self._render_cache = OrderedDict()  # (path, mtime, size, page_num, dpi) -> RenderedPage
+        self._render_cache_lock = threading.Lock()
+        self._documents = OrderedDict()  # (path, mtime, size) -> open fitz.Document
+        self._document_lock = threading.Lock()  # fitz.Document is not thread-safe, so renders are serialized
+        self._context_cache = OrderedDict()  # structure JSON -> data extraction context
+        self._context_cache_lock = threading.Lock()
+        self._response_cache = OrderedDict()  # (image digest, request digest) -> serialized parsed response
+        self._response_cache_lock = threading.Lock()
         
-    def convert_pdf_to_image(self, pdf_path: str, page_num: int = 0, dpi: int = 300) -> bytes:
+    def convert_pdf_to_image(self, pdf_path: str, page_num: int = 0, dpi: int = RENDER_DPI) -> bytes:
         """
         Convert PDF page to high-quality image
         
@@ -29,40 +148,134 @@ class VisionBasedExtractor:
             dpi: Resolution for image conversion (200 DPI recommended for text clarity)
             
         Returns:
-            Image data as bytes in PNG format
+            Image data as bytes in IMAGE_FORMAT
+        """
+        return self._render_page(pdf_path, page_num, dpi).image.image_data
+    
+    def _get_page_data_url(self, pdf_path: str, page_num: int = 0, dpi: int = RENDER_DPI) -> str:
+        """Base64 data URL of a PDF page image, as sent in vision requests"""
+        return self._render_page(pdf_path, page_num, dpi).data_url
+    
+    def render_pages(self, pdf_path: str, page_nums: List[int], dpi: int = RENDER_DPI) -> Dict[int, str]:
+        """
+        Page image data URLs for several pages. Pages not in the render cache are rendered
+        in the shared worker process pool, each task taking a contiguous chunk of pages.
         """
         try:
-            # Open PDF
-            doc = fitz.open(pdf_path)
-            
-            if page_num >= len(doc):
-                raise ValueError(f"Page {page_num} does not exist in PDF with {len(doc)} pages")
-            
-            # Get the page
-            page = doc[page_num]
-            
-            # Create transformation matrix for desired DPI
-            # PyMuPDF uses 72 DPI by default, so scale factor = desired_dpi / 72
-            scale_factor = dpi / 72.0
-            matrix = fitz.Matrix(scale_factor, scale_factor)
-            
-            # Render page to image (pixmap)
-            pix = page.get_pixmap(matrix=matrix)
-            
-            # Convert to PNG bytes
-            img_data = pix.tobytes("png")
-            
-            # Clean up
-            doc.close()
+            file_key = self._render_file_key(pdf_path)
+            images = {}
+            missing = []
+            with self._render_cache_lock:
+                for page_num in page_nums:
+                    cached = self._render_cache.get(file_key + (page_num, dpi))
+                    if cached is not None:
+                        images[page_num] = cached.data_url
+                    else:
+                        missing.append(page_num)
+            
+            pool_size = min(self.RENDER_WORKERS, os.cpu_count() or 1)
+            workers = min(pool_size, len(missing))
+            if workers > 1:
+                chunk_size = -(-len(missing) // workers)
+                chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+                pool = _get_render_pool(pool_size)
+                try:
+                    chunk_images = list(pool.map(
+                        _render_page_chunk, repeat(pdf_path), chunks, repeat(dpi),
+                        repeat(self.IMAGE_FORMAT), repeat(self.JPEG_QUALITY), repeat(self.GRAYSCALE)
+                    ))
+                except BrokenProcessPool:
+                    _discard_render_pool(pool)
+                    raise
+                rendered_pages = zip(missing, chain.from_iterable(chunk_images))
+            else:
+                rendered_pages = ((page_num, self._rasterize_page(pdf_path, file_key, page_num, dpi))
+                                  for page_num in missing)
+            
+            for page_num, image in rendered_pages:
+                rendered = RenderedPage(image, self._build_data_url(image.image_data))
+                self._store_render(file_key + (page_num, dpi), rendered)
+                images[page_num] = rendered.data_url
+            return images
             
-            return img_data
+        except Exception as e:
+            raise Exception(f"Failed to convert PDF to image: {str(e)}")
+    
+    def _render_file_key(self, pdf_path: str) -> Tuple[str, int, int]:
+        """Render cache key prefix identifying the current contents of a PDF file"""
+        stat = os.stat(pdf_path)
+        return (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+    
+    def _store_render(self, key: Tuple[Any, ...], rendered: RenderedPage):
+        """Add a rendered page to the render cache, evicting the least recently used"""
+        with self._render_cache_lock:
+            self._render_cache[key] = rendered
+            while len(self._render_cache) > self.RENDER_CACHE_SIZE:
+                self._render_cache.popitem(last=False)
+    
+    def _render_page(self, pdf_path: str, page_num: int, dpi: int) -> RenderedPage:
+        """Rendered page image and its data URL, served from the render cache when the file is unchanged"""
+        try:
+            file_key = self._render_file_key(pdf_path)
+            key = file_key + (page_num, dpi)
+            with self._render_cache_lock:
+                cached = self._render_cache.get(key)
+                if cached is not None:
+                    self._render_cache.move_to_end(key)
+                    return cached
+            
+            image = self._rasterize_page(pdf_path, file_key, page_num, dpi)
+            rendered = RenderedPage(image, self._build_data_url(image.image_data))
+            self._store_render(key, rendered)
+            return rendered
             
         except Exception as e:
             raise Exception(f"Failed to convert PDF to image: {str(e)}")
     
-    def encode_image_to_base64(self, image_data: bytes) -> str:
-        """Convert image bytes to base64 string for API"""
-        return base64.b64encode(image_data).decode('utf-8')
+    def _rasterize_page(self, pdf_path: str, file_key: Tuple[str, int, int], page_num: int, dpi: int) -> PageImage:
+        """Render one PDF page to IMAGE_FORMAT using a cached document handle"""
+        with self._document_lock:
+            doc = self._documents.get(file_key)
+            if doc is None:
+                doc = fitz.open(pdf_path)
+                self._documents[file_key] = doc
+                while len(self._documents) > self.DOCUMENT_CACHE_SIZE:
+                    self._documents.popitem(last=False)[1].close()
+            else:
+                self._documents.move_to_end(file_key)
+            
+            if page_num >= len(doc):
+                raise ValueError(f"Page {page_num} does not exist in PDF with {len(doc)} pages")
+            
+            return _render_page_image(doc[page_num], dpi, self.IMAGE_FORMAT, self.JPEG_QUALITY, self.GRAYSCALE)
+    
+    def invalidate(self, pdf_path: str):
+        """Drop cached renders, document handles and vision responses for a file so it is re-extracted"""
+        path = os.path.abspath(pdf_path)
+        with self._render_cache_lock:
+            stale = [key for key in self._render_cache if key[0] == path]
+            image_digests = {self._image_digest(self._render_cache.pop(key).data_url) for key in stale}
+        with self._response_cache_lock:
+            for key in [key for key in self._response_cache if key[0] in image_digests]:
+                del self._response_cache[key]
+        with self._document_lock:
+            for key in [key for key in self._documents if key[0] == path]:
+                self._documents.pop(key).close()
+    
+    def close(self):
+        """Close the cached document handles"""
+        with self._document_lock:
+            while self._documents:
+                self._documents.popitem()[1].close()
+    
+    @staticmethod
+    def _image_digest(image_url: str) -> bytes:
+        """Content digest of a page image data URL, for the response cache"""
+        return hashlib.blake2b(image_url.encode('ascii'), digest_size=16).digest()
+    
+    def _build_data_url(self, image_data: bytes) -> str:
+        """Base64 data URL for image bytes, assembled as bytes and decoded to str once"""
+        return (b"data:" + self.IMAGE_MIME_TYPE.encode('ascii') + b";base64," + base64.b64encode(image_data)).decode('ascii')
     
     def extract_structure_with_vision(self, pdf_path: str, page_num: int = 0) -> Dict[str, Any]:
         """
@@ -76,71 +289,14 @@ class VisionBasedExtractor:
             Structure classification result
         """
         try:
-            # Convert PDF to image
-            image_data = self.convert_pdf_to_image(pdf_path, page_num)
-            image_base64 = self.encode_image_to_base64(image_data)
+            # Convert PDF to image (shared with the other vision steps for this page)
+            image_url = self._get_page_data_url(pdf_path, page_num)
             
-            prompt = """
-            Analyze this document image and classify its structure. Look at the visual layout and organization.
-
-            Classify this page as one of:
-            1. "form" - Contains form fields with labels and values (like applications, invoices)
-            2. "table" - Contains tabular data with rows and columns  
-            3. "mixed" - Contains both form elements and tables
-
-            Also identify the main regions and provide confidence score.
-
-            You MUST respond with valid JSON only. No additional text or explanation.
-
-            {
-                "classification": "form|table|mixed",
-                "confidence": 0.85,
-                "reasoning": "Brief explanation of classification",
-                "regions": [
-                    {
-                        "type": "form|table", 
-                        "description": "Description of this region",
-                        "estimated_bounds": "top|middle|bottom"
-                    }
-                ]
-            }
-            """
+            prompt = VISION_STRUCTURE_CLASSIFICATION()
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{image_base64}",
-                                    "detail": "high"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=1000,
-                temperature=0.0
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Save debug information first
-            self._save_debug_response(content, "vision_classification", page_num)
-            
-            # Try to extract JSON from the response using multiple strategies
-            result = self._extract_json_from_vision_response(content)
-            
-            return {
-                "success": True,
-                "data": result,
-                "method": "vision",
-                "model": self.model
-            }
+            # Form/table/mixed is a coarse judgment: one low-detail tile is enough
+            return self._vision_call(prompt=prompt, image_url=image_url, max_tokens=1000,
+                                     task_type="vision_classification", page_num=page_num, detail="low")
             
         except Exception as e:
             return {
@@ -162,9 +318,8 @@ class VisionBasedExtractor:
             Field identification result
         """
         try:
-            # Convert PDF to image
-            image_data = self.convert_pdf_to_image(pdf_path, page_num)
-            image_base64 = self.encode_image_to_base64(image_data)
+            # Convert PDF to image (shared with the other vision steps for this page)
+            image_url = self._get_page_data_url(pdf_path, page_num)
             
             # Include user feedback in prompt if provided
             feedback_instruction = ""
@@ -177,97 +332,10 @@ class VisionBasedExtractor:
                 IMPORTANT: Apply the user's feedback and corrections. This is a refinement based on their input.
                 """
             
-            prompt = f"""
-            CRITICAL INSTRUCTION: You are analyzing this document image to identify STRUCTURE ONLY.
-
-            **VISUAL ANALYSIS GUIDELINES:**
-            1. Look for labels followed by colons (:) or values - these are FORM FIELDS
-            2. Look for organized columnar data with headers above rows - these are TABLES
-            3. Focus on visual layout, alignment, and spacing to distinguish structure
-
-            **FORM FIELDS (Individual data points):**
-            - Labels like "Employee Name:", "SSN:", "DOB:" followed by individual values
-            - Usually arranged vertically or in a grid pattern
-            - Each field appears once with its specific value
-            
-            **TABLE HEADERS (Column headers above tabular data):**
-            - Headers that appear above multiple rows of aligned data
-            - Look for clear column boundaries and repeated data patterns below headers
-            - Headers are typically in a different style (bold, centered, etc.)
-
-            **IMPORTANT DISTINCTIONS:**
-            - Section titles like "Rate Information" are NOT field names
-            - Page headers/footers are NOT form fields
-            - Individual values in table cells are NOT headers
-
-            {feedback_instruction}
-
-            **EXTRACTION RULES:**
-            - Only extract the LABEL/HEADER text, never the values
-            - For form fields: extract just the field label (e.g., "Employee Name", not "John Doe")
-            - For tables: extract just column headers (e.g., "Rate", not "19.00")
-            - Look carefully at visual alignment to group headers correctly
-
-            Respond with valid JSON in this EXACT format:
-            {{
-                "form_fields": [
-                    {{
-                        "field_name": "Employee Name"
-                    }},
-                    {{
-                        "field_name": "Birth Date"  
-                    }}
-                ],
-                "tables": [
-                    {{
-                        "table_name": "Rate/Salary Information",
-                        "headers": ["RateCode", "Description", "Rate", "Effective Dates"]
-                    }}
-                ],
-                "extraction_summary": {{
-                    "total_form_fields": 2,
-                    "total_tables": 1,
-                    "refinement_iteration": 1
-                }},
-                "feedback_response": "Initial extraction based on visual layout analysis"
-            }}
-            """
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{image_base64}",
-                                    "detail": "high"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=2000,
-                temperature=0.0
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Save debug information first
-            self._save_debug_response(content, "vision_field_identification", page_num)
+            prompt = VISION_FIELD_IDENTIFICATION(feedback_instruction=feedback_instruction)
             
-            # Try to extract JSON from the response using multiple strategies
-            result = self._extract_json_from_vision_response(content)
-            
-            return {
-                "success": True,
-                "data": result,
-                "method": "vision",
-                "model": self.model
-            }
+            return self._vision_call(prompt=prompt, image_url=image_url, max_tokens=2000,
+                                     task_type="vision_field_identification", page_num=page_num)
             
         except Exception as e:
             return {
@@ -289,9 +357,8 @@ class VisionBasedExtractor:
             Data extraction result
         """
         try:
-            # Convert PDF to image
-            image_data = self.convert_pdf_to_image(pdf_path, page_num)
-            image_base64 = self.encode_image_to_base64(image_data)
+            # Convert PDF to image (shared with the other vision steps for this page)
+            image_url = self._get_page_data_url(pdf_path, page_num)
             
             # Build extraction context from validated structure
             extraction_context = self._build_vision_extraction_context(field_structure)
@@ -307,98 +374,12 @@ class VisionBasedExtractor:
             IMPORTANT: Apply the user's feedback and corrections carefully. This is a refinement based on their input to improve extraction accuracy.
             """
             
-            prompt = f"""
-            You are a data extraction specialist. Extract actual data values from this document image using the VALIDATED field and table structure below.
-
-            {extraction_context}{feedback_section}
-
-            ## Extraction Instructions:
-
-            **For Form Fields:**
-            - Extract the exact actual values for each field listed above
-            - If a field exists but is empty, use null
-            - If a field is not found in the document, use null
-            - Preserve the exact formatting of values as they appear
-
-            **For Tables:**
-            - Extract ALL rows of data for each table
-            - Follow the exact column structure specified above
-            - Preserve formatting of values (dates, numbers, currency, etc.)
-            - If a cell is empty, use null
-            - Include the column headers in the output
-
-            **Quality Standards:**
-            - Be precise - extract only what is actually visible in the document
-            - Maintain original formatting and spacing
-            - Do not make assumptions or add data that isn't there
-            - Look carefully at the visual layout to ensure accurate extraction
-
-            Respond with valid JSON only:
-            {{
-                "extracted_data": {{
-                    "field_name": "actual_value_from_document"
-                }},
-                "table_data": [
-                    {{
-                        "table_name": "Table Name",
-                        "headers": ["Column1", "Column2", "Column3"],
-                        "rows": [
-                            {{
-                                "Column1": "value1",
-                                "Column2": "value2", 
-                                "Column3": "value3"
-                            }},
-                            {{
-                                "Column1": "value4",
-                                "Column2": "value5",
-                                "Column3": "value6"
-                            }}
-                        ]
-                    }}
-                ],
-                "extraction_summary": {{
-                    "total_extracted_fields": 0,
-                    "total_extracted_tables": 0,
-                    "extraction_success": true
-                }}
-            }}
-            """
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/png;base64,{image_base64}",
-                                    "detail": "high"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=4000,
-                temperature=0.0
+            prompt = VISION_DATA_EXTRACTION(
+                extraction_context=extraction_context, feedback_section=feedback_section
             )
             
-            content = response.choices[0].message.content.strip()
-            
-            # Save debug information first
-            self._save_debug_response(content, "vision_data_extraction", page_num)
-            
-            # Try to extract JSON from the response using multiple strategies
-            result = self._extract_json_from_vision_response(content)
-            
-            return {
-                "success": True,
-                "data": result,
-                "method": "vision",
-                "model": self.model
-            }
+            return self._vision_call(prompt=prompt, image_url=image_url, max_tokens=4000,
+                                     task_type="vision_data_extraction", page_num=page_num)
             
         except Exception as e:
             return {
@@ -407,108 +388,238 @@ class VisionBasedExtractor:
                 "method": "vision"
             }
     
+    def _vision_call(self, *, prompt: str, image_url: str, max_tokens: int, task_type: str,
+                     page_num: int, detail: str = "high") -> Dict[str, Any]:
+        """
+        Send a prompt with one page image, save the response for debugging and parse its JSON.
+        Transient API errors are retried with backoff; the last error, other API errors and
+        parsing errors propagate so each step can report them in its own words.
+        Parsed responses are cached per page image and request.
+        """
+        request_digest = hashlib.blake2b(
+            f"{self.model}\0{max_tokens}\0{detail}\0{prompt}".encode('utf-8'), digest_size=16
+        ).digest()
+        cache_key = (self._image_digest(image_url), request_digest)
+        with self._response_cache_lock:
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                self._response_cache.move_to_end(cache_key)
+        if cached is not None:
+            print(f"DEBUG - Vision response cache hit for {task_type} page {page_num + 1}")
+            return {
+                "success": True,
+                "data": json.loads(cached),  # Fresh copy, callers mutate results
+                "method": "vision",
+                "model": self.model,
+                "cache_hit": True
+            }
+        
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url,
+                            "detail": detail
+                        }
+                    }
+                ]
+            }
+        ]
+        
+        attempts = max(1, GPTConfig.MAX_RETRIES)
+        for attempt in range(attempts):
+            try:
+                response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=0.0,
+                    timeout=self.REQUEST_TIMEOUT
+                )
+                break
+            except self.RETRYABLE_ERRORS as e:
+                if attempt == attempts - 1:
+                    raise
+                delay = min(self.RETRY_MAX_DELAY, self.RETRY_INITIAL_DELAY * 2 ** attempt)
+                delay += random.uniform(0, delay)  # jitter so concurrent pages don't retry in lockstep
+                print(f"DEBUG - {task_type} page {page_num + 1}: {type(e).__name__}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+        
+        content = response.choices[0].message.content.strip()
+        
+        # Save debug information first
+        self._save_debug_response(content, task_type, page_num)
+        
+        # Try to extract JSON from the response using multiple strategies
+        result, repaired = self._extract_json_from_vision_response(content)
+        
+        # A reply cut off at max_tokens or patched up by _repair_json may be missing rows;
+        # leave it uncached so a retry asks the model again
+        if response.choices[0].finish_reason == "stop" and not repaired:
+            serialized = json.dumps(result)
+            with self._response_cache_lock:
+                self._response_cache[cache_key] = serialized
+                while len(self._response_cache) > self.RESPONSE_CACHE_SIZE:
+                    self._response_cache.popitem(last=False)
+        
+        return {
+            "success": True,
+            "data": result,
+            "method": "vision",
+            "model": self.model
+        }
+    
     def _build_vision_extraction_context(self, field_structure: Dict[str, Any]) -> str:
-        """Build extraction context for vision-based data extraction"""
-        context = "VALIDATED FIELD STRUCTURE FROM STEP 2:\n\n"
+        """Build extraction context for vision-based data extraction (memoized per structure content)"""
+        # Key only on the parts that affect the output so edits to the structure invalidate the entry
+        cache_key = json.dumps(
+            [field_structure.get("form_fields"), field_structure.get("tables")], sort_keys=True, default=str
+        )
+        with self._context_cache_lock:
+            cached = self._context_cache.get(cache_key)
+            if cached is not None:
+                self._context_cache.move_to_end(cache_key)
+                return cached
+        
+        context = self._render_vision_extraction_context(field_structure)
+        
+        with self._context_cache_lock:
+            self._context_cache[cache_key] = context
+            while len(self._context_cache) > self.CONTEXT_CACHE_SIZE:
+                self._context_cache.popitem(last=False)
+        return context
+    
+    def _render_vision_extraction_context(self, field_structure: Dict[str, Any]) -> str:
+        """Render the validated structure listing used in the data extraction prompt"""
+        parts = ["VALIDATED FIELD STRUCTURE FROM STEP 2:\n\n"]
         
         # Add form fields if present
         if field_structure.get("form_fields"):
-            context += "FORM FIELDS TO EXTRACT:\n"
+            parts.append("FORM FIELDS TO EXTRACT:\n")
             if isinstance(field_structure["form_fields"], list):
                 # Check if it's the new format (array of strings) or legacy format (array of objects)
                 if field_structure["form_fields"] and isinstance(field_structure["form_fields"][0], str):
                     # New format: ["Employee Name", "Birth Date", "Phone Number"]
                     for field_name in field_structure["form_fields"]:
-                        context += f"- {field_name}\n"
+                        parts.append(f"- {field_name}\n")
                 else:
                     # Legacy format: [{"field_name": "name"}]
                     for field in field_structure["form_fields"]:
                         if isinstance(field, dict):
                             field_name = field.get("field_name", field.get("label", "Unknown"))
-                            context += f"- {field_name}\n"
+                            parts.append(f"- {field_name}\n")
             elif isinstance(field_structure["form_fields"], dict):
                 # Very old format: {"field_name": "expected_value"}
                 for field_name in field_structure["form_fields"].keys():
-                    context += f"- {field_name}\n"
-            context += "\n"
+                    parts.append(f"- {field_name}\n")
+            parts.append("\n")
         
         # Add table structures if present
         if field_structure.get("tables"):
-            context += "TABLE STRUCTURES TO EXTRACT:\n"
+            parts.append("TABLE STRUCTURES TO EXTRACT:\n")
             for i, table in enumerate(field_structure["tables"], 1):
                 if isinstance(table, dict):
                     table_name = table.get("table_name", table.get("title", f"Table {i}"))
                     headers = table.get("headers", [])
                     
-                    context += f"Table: {table_name}\n"
-                    context += f"Columns: {', '.join(headers)}\n"
-                    context += f"Extract all rows of data for these columns.\n\n"
+                    parts.append(f"Table: {table_name}\n")
+                    parts.append(f"Columns: {', '.join(headers)}\n")
+                    parts.append("Extract all rows of data for these columns.\n\n")
         
-        return context
+        return "".join(parts)
     
-    def _extract_json_from_vision_response(self, content: str) -> dict:
-        """Extract JSON from vision response using multiple fallback strategies"""
-        import re
-        
+    def _extract_json_from_vision_response(self, content: str) -> Tuple[Any, bool]:
+        """
+        Extract JSON from a vision response, tolerating code fences, surrounding prose and truncation.
+        Returns the parsed value and whether it had to be repaired (so may be incomplete).
+        """
         # Strategy 1: Try direct JSON parsing
         try:
-            return json.loads(content)
+            return json.loads(content), False
         except json.JSONDecodeError:
             pass
         
-        # Strategy 2: Extract from markdown code blocks
-        json_match = re.search(r'```(?:json)?\s*(\{[\s\S]*?\})\s*```', content)
-        if json_match:
-            try:
-                json_str = json_match.group(1).strip()
-                cleaned_json = self._clean_json_string(json_str)
-                return json.loads(cleaned_json)
-            except json.JSONDecodeError:
-                pass
-        
-        # Strategy 3: Extract from response without code blocks
-        json_match = re.search(r'(\{[\s\S]*\})', content)
-        if json_match:
+        start = content.find('{')
+        if start != -1:
+            # Strategy 2: Decode the first object in place; any fence or prose after it is ignored
             try:
-                json_str = json_match.group(1).strip()
-                cleaned_json = self._clean_json_string(json_str)
-                return json.loads(cleaned_json)
+                return _JSON_DECODER.raw_decode(content, start)[0], False
             except json.JSONDecodeError:
                 pass
+            
+            # Strategy 3: Repair trailing commas and truncation, first on everything up to the
+            # closing fence (truncated output), then up to the last brace (prose after the object)
+            body = content[start:]
+            fence = body.rfind('```')
+            if fence != -1:
+                body = body[:fence]
+            for candidate in (body, body[:body.rfind('}') + 1]):
+                try:
+                    return json.loads(self._repair_json(candidate)), True
+                except json.JSONDecodeError:
+                    pass
         
         # If all strategies fail, raise an error
         raise json.JSONDecodeError(f"Could not extract valid JSON from vision response: {content[:200]}...", content, 0)
     
-    def _clean_json_string(self, json_str: str) -> str:
-        """Clean common JSON formatting issues"""
-        import re
-        
-        # Remove any trailing commas before closing brackets/braces
-        cleaned = re.sub(r',\s*([}\]])', r'\1', json_str)
-        
-        # Handle truncated JSON by trying to close open structures
-        open_braces = cleaned.count('{') - cleaned.count('}')
-        open_brackets = cleaned.count('[') - cleaned.count(']')
+    @staticmethod
+    def _repair_json(json_str: str) -> str:
+        """
+        Drop trailing commas and close the strings, objects and arrays a truncated response
+        left open, in a single pass that ignores brackets inside strings
+        """
+        out = []
+        closers = []
+        in_string = escaped = False
+        for ch in json_str:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == '{':
+                closers.append('}')
+            elif ch == '[':
+                closers.append(']')
+            elif ch == '}' or ch == ']':
+                _drop_trailing_comma(out)
+                if closers:
+                    closers.pop()
+            out.append(ch)
         
-        if open_braces > 0:
-            cleaned += '}' * open_braces
-        if open_brackets > 0:
-            cleaned += ']' * open_brackets
-            
-        return cleaned.strip()
+        if in_string:
+            out.append('"')
+        if closers:
+            _drop_trailing_comma(out)
+            out.extend(reversed(closers))
+        return "".join(out).strip()
     
     def _save_debug_response(self, content: str, task_type: str, page_num: int):
+        """Queue a debug copy of the response when SAVE_VISION_DEBUG_RESPONSES is enabled"""
+        if not GPTConfig.SAVE_VISION_DEBUG_RESPONSES:
+            return
+        _debug_writer.submit(self._write_debug_response, content, task_type, page_num, time.time())
+    
+    def _write_debug_response(self, content: str, task_type: str, page_num: int, timestamp: float):
         """Save debug response to file"""
         try:
             debug_dir = "debug_responses"
             os.makedirs(debug_dir, exist_ok=True)
-            debug_file = os.path.join(debug_dir, f"vision_response_{task_type}_page{page_num}_{int(time.time())}.txt")
+            debug_file = os.path.join(debug_dir, f"vision_response_{task_type}_page{page_num}_{int(timestamp)}.txt")
             
             with open(debug_file, 'w', encoding='utf-8') as f:
                 f.write(f"Task Type: {task_type} (Vision)\n")
                 f.write(f"Model: {self.model}\n")
                 f.write(f"Page: {page_num}\n")
-                f.write(f"Timestamp: {time.time()}\n")
+                f.write(f"Timestamp: {timestamp}\n")
                 f.write("=" * 50 + "\n")
                 f.write("VISION RESPONSE:\n")
                 f.write(content)
@@ -521,21 +632,18 @@ class VisionBasedExtractor:
     def get_image_info(self, pdf_path: str, page_num: int = 0) -> Dict[str, Any]:
         """Get information about the generated image for debugging"""
         try:
-            image_data = self.convert_pdf_to_image(pdf_path, page_num)
-            
-            # Load image to get dimensions
-            image = Image.open(io.BytesIO(image_data))
-            width, height = image.size
+            # The render records the pixmap size, so the encoded image is never decoded again
+            image = self._render_page(pdf_path, page_num, self.RENDER_DPI).image
             
             return {
                 "success": True,
-                "image_size_bytes": len(image_data),
+                "image_size_bytes": len(image.image_data),
                 "image_dimensions": {
-                    "width": width,
-                    "height": height
+                    "width": image.width,
+                    "height": image.height
                 },
-                "format": "PNG",
-                "dpi_equivalent": 200  # Our conversion DPI
+                "format": self.IMAGE_FORMAT.upper(),
+                "dpi_equivalent": self.RENDER_DPI  # Our conversion DPI
             }
             
         except Exception as e:
@@ -557,70 +665,17 @@ class VisionBasedExtractor:
             Dict with extraction results and metadata
         """
         try:
-            # Convert PDF page to image
-            image_data = self.convert_pdf_to_image(pdf_path, page_num)
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-
-            # Build vision request with enhanced prompt
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": enhanced_prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/png;base64,{base64_image}"}
-                        }
-                    ]
-                }
-            ]
-
-            # Make API request
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=4000,  # Sufficient for complex extractions
-                temperature=0.0,  # Deterministic for data extraction
-                timeout=120
-            )
-
-            # Extract and parse response
-            content = response.choices[0].message.content.strip()
-
-            # Try to parse JSON response
-            try:
-                result = json.loads(content)
-            except json.JSONDecodeError:
-                # Try to extract JSON from the response
-                result = self._extract_json_from_response(content)
-                if not result.get('success'):
-                    return result
-                result = result['data']
-
-            # Add metadata about enhanced extraction
-            if isinstance(result, dict):
-                result['vision_metadata'] = {
-                    'page_number': page_num + 1,
-                    'extraction_method': 'enhanced_vision',
-                    'model_used': self.model,
-                    'enhanced_prompt_used': True,
-                    'image_quality_dpi': 300
-                }
-
-                # Calculate extraction statistics
-                extracted_fields = len(result.get('extracted_data', {}))
-                extracted_tables = len(result.get('table_data', []))
+            # Convert PDF page to image (shared with the other vision steps for this page)
+            image_url = self._get_page_data_url(pdf_path, page_num)
 
-                result['extraction_summary'] = {
-                    'total_extracted_fields': extracted_fields,
-                    'total_extracted_tables': extracted_tables,
-                    'extraction_success': True,
-                    'extraction_method': 'enhanced_vision'
-                }
+            # Enhanced prompts leave the image detail level to the API ("auto")
+            result = self._vision_call(prompt=enhanced_prompt, image_url=image_url, max_tokens=4000,
+                                       task_type="vision_enhanced_extraction", page_num=page_num,
+                                       detail="auto")["data"]
 
             return {
                 'success': True,
-                'data': result
+                'data': self.annotate_enhanced_result(result, page_num)
             }
 
         except Exception as e:
@@ -629,33 +684,55 @@ class VisionBasedExtractor:
                 'error': f"Enhanced vision extraction failed: {str(e)}"
             }
 
-    def _extract_json_from_response(self, content: str) -> Dict[str, Any]:
-        """
-        Extract JSON from potentially malformed response content
-        """
-        # Try to find JSON blocks in the response
-        import re
+    def annotate_enhanced_result(self, result: Any, page_num: int) -> Any:
+        """Add enhanced-extraction metadata and statistics to a parsed response"""
+        if isinstance(result, dict):
+            result['vision_metadata'] = {
+                'page_number': page_num + 1,
+                'extraction_method': 'enhanced_vision',
+                'model_used': self.model,
+                'enhanced_prompt_used': True,
+                'image_quality_dpi': self.RENDER_DPI
+            }
 
-        # Look for JSON blocks between ```json and ``` or { and }
-        json_patterns = [
-            r'```json\s*(\{.*?\})\s*```',
-            r'```\s*(\{.*?\})\s*```',
-            r'(\{[^}]*"extracted_data"[^}]*\})',
-            r'(\{.*\})'
-        ]
+            # Calculate extraction statistics
+            extracted_fields = len(result.get('extracted_data', {}))
+            extracted_tables = len(result.get('table_data', []))
 
-        for pattern in json_patterns:
-            matches = re.findall(pattern, content, re.DOTALL | re.IGNORECASE)
-            for match in matches:
-                try:
-                    result = json.loads(match)
-                    return {'success': True, 'data': result}
-                except json.JSONDecodeError:
-                    continue
+            result['extraction_summary'] = {
+                'total_extracted_fields': extracted_fields,
+                'total_extracted_tables': extracted_tables,
+                'extraction_success': True,
+                'extraction_method': 'enhanced_vision'
+            }
+
+        return result
 
-        # If no JSON found, return error with original content
+    def build_batch_request(self, custom_id: str, prompt: str, image_url: str,
+                            max_tokens: int = 4000) -> Dict[str, Any]:
+        """
+        Batch API request line for a vision prompt over one page image data URL (see render_pages),
+        with the same payload extract_with_enhanced_prompt sends in realtime
+        """
         return {
-            'success': False,
-            'error': 'Could not extract valid JSON from response',
-            'raw_content': content
-        }
\ No newline at end of file
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": self.model,
+                "messages": [
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": {"url": image_url}
+                            }
+                        ]
+                    }
+                ],
+                "max_tokens": max_tokens,
+                "temperature": 0.0
+            }
+        }
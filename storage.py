@@ -1,13 +1,43 @@
 """
 Simple file-based storage system to replace SQLAlchemy
 """
+import heapq
 import json
 import os
+from operator import itemgetter
+import threading
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import uuid
 
+try:
+    import orjson  # Optional C codec; the storage file format is the same either way
+except ImportError:
+    orjson = None
+
+
+def _dumps(data: Any) -> bytes:
+    """Serialize storage data to compact, single-line UTF-8 JSON bytes"""
+    if orjson is not None:
+        # Non-string dict keys are stringified, as json.dumps does
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(raw: bytes) -> Any:
+    """Parse UTF-8 JSON bytes read from the storage file"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
 class Document:
+    # Fixed attribute set: no per-instance __dict__ for every document held in the storage cache
+    __slots__ = (
+        'id', 'filename', 'filepath', 'upload_time', 'current_step', 'is_completed',
+        'step1_result', 'step2_result', 'step2_validated_json', 'step3_result', 'feedback_history',
+        'validation_page_result', 'validation_page_num', 'enhanced_template', 'multipage_processing_status'
+    )
+    
     def __init__(self, id: str = None, filename: str = "", filepath: str = ""):
         self.id = id or str(uuid.uuid4())
         self.filename = filename
@@ -100,11 +130,11 @@ class Document:
     
     @classmethod
     def from_dict(cls, data: dict) -> 'Document':
-        doc = cls(
-            id=data['id'],
-            filename=data['filename'],
-            filepath=data['filepath']
-        )
+        # Every attribute is set below, so skip __init__ and its uuid4()/now() defaults
+        doc = cls.__new__(cls)
+        doc.id = data['id']
+        doc.filename = data['filename']
+        doc.filepath = data['filepath']
         doc.upload_time = datetime.fromisoformat(data['upload_time'])
         doc.current_step = data['current_step']
         doc.is_completed = data['is_completed']
@@ -122,64 +152,175 @@ class Document:
         return doc
 
 class FileStorage:
+    """
+    Documents live in storage_file plus an append-only journal (storage_file + '.log') with one
+    JSON record per add/update/delete, so a mutation writes one document instead of all of them.
+    The journal is folded back into storage_file once it grows larger than it.
+    Serialized documents are kept in memory until either file changes on disk; every read
+    returns a fresh Document, so unsaved edits never leak between callers.
+    """
+    # Journals smaller than this are never compacted, however small the main file is
+    COMPACT_MIN_JOURNAL_BYTES = 1024 * 1024
+    
     def __init__(self, storage_file: str = 'documents.json'):
         self.storage_file = storage_file
+        self.journal_file = f"{storage_file}.log"
+        self._documents: Optional[Dict[str, Tuple[datetime, bytes]]] = None  # id -> (upload_time, serialized doc), valid for _cache_stamp
+        self._cache_stamp = None
+        self._lock = threading.RLock()  # Flask serves requests on several threads
         self._ensure_file_exists()
+        self._drop_torn_journal_record()
     
     def _ensure_file_exists(self):
         if not os.path.exists(self.storage_file):
             with open(self.storage_file, 'w') as f:
                 json.dump([], f)
     
-    def _load_documents(self) -> List[Document]:
+    def _drop_torn_journal_record(self):
+        """Cut a partial record left by an interrupted append, so new records start on their own line"""
         try:
-            with open(self.storage_file, 'r') as f:
-                data = json.load(f)
-                return [Document.from_dict(doc_data) for doc_data in data]
-        except (json.JSONDecodeError, KeyError):
-            return []
+            with open(self.journal_file, 'rb+') as f:
+                journal = f.read()
+                if journal and not journal.endswith(b'\n'):
+                    f.truncate(journal.rfind(b'\n') + 1)
+        except FileNotFoundError:
+            pass
     
-    def _save_documents(self, documents: List[Document]):
-        with open(self.storage_file, 'w') as f:
-            data = [doc.to_dict() for doc in documents]
-            json.dump(data, f, indent=2)
+    def _file_stamp(self) -> Tuple[Optional[Tuple[int, int]], ...]:
+        """Modification time and size of the storage file and the journal (None when missing)"""
+        stamp = []
+        for path in (self.storage_file, self.journal_file):
+            try:
+                stat = os.stat(path)
+                stamp.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                stamp.append(None)
+        return tuple(stamp)
+    
+    def _load_documents(self) -> Dict[str, Tuple[datetime, bytes]]:
+        """
+        Stored (upload_time, serialized document) pairs by id, in storage order, re-read only
+        when the storage files have changed since the last read. Iterate over it while holding the lock.
+        """
+        with self._lock:
+            stamp = self._file_stamp()
+            if self._documents is None or stamp != self._cache_stamp:
+                self._documents = self._read_documents()
+                self._cache_stamp = stamp
+            return self._documents
+    
+    def _read_documents(self) -> Dict[str, Tuple[datetime, bytes]]:
+        """Parse the storage file and replay the journal over it"""
+        try:
+            with open(self.storage_file, 'rb') as f:
+                data = _loads(f.read())
+            documents = {doc_data['id']: doc_data for doc_data in data}
+        except (ValueError, KeyError):  # json and orjson decode errors are both ValueErrors
+            return {}
+        self._replay_journal(documents)
+        try:
+            return {
+                doc_id: (Document.from_dict(doc_data).upload_time, _dumps(doc_data))
+                for doc_id, doc_data in documents.items()
+            }
+        except KeyError:
+            return {}
+    
+    def _replay_journal(self, documents: Dict[str, dict]):
+        """Apply the journaled mutations, in order, to document dicts keyed by id"""
+        try:
+            with open(self.journal_file, 'rb') as f:
+                for line in f:
+                    try:
+                        record = _loads(line)
+                        if record['op'] == 'add':
+                            documents[record['doc']['id']] = record['doc']
+                        elif record['op'] == 'update':
+                            # Like the list-based update: documents that don't exist stay absent
+                            if record['doc']['id'] in documents:
+                                documents[record['doc']['id']] = record['doc']
+                        elif record['op'] == 'delete':
+                            documents.pop(record['id'], None)
+                    except (ValueError, KeyError, TypeError):
+                        continue  # skip a damaged record rather than losing the rest
+        except FileNotFoundError:
+            pass
+    
+    def _append_journal(self, record: Dict[str, Any]):
+        """
+        Append one mutation record, compacting once the journal outgrows the main file.
+        Callers hold the lock, load the cache first and apply the mutation to it afterwards.
+        """
+        with open(self.journal_file, 'ab') as f:
+            f.write(_dumps(record) + b'\n')
+            journal_size = f.tell()
+        if (journal_size > self.COMPACT_MIN_JOURNAL_BYTES
+                and journal_size > os.path.getsize(self.storage_file)):
+            self.compact()
+        self._cache_stamp = self._file_stamp()
+    
+    def _save_documents(self, serialized_docs: List[bytes]):
+        """Atomically write the full document list and clear the journal it supersedes"""
+        data = b'[' + b','.join(serialized_docs) + b']'
+        tmp_file = f"{self.storage_file}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # A crash leaves either the old file or the new one, never a partly written one
+        os.replace(tmp_file, self.storage_file)
+        if hasattr(os, 'O_DIRECTORY'):  # make the rename durable before the journal is emptied
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.storage_file)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        # Replaying records already folded in is harmless, so a crash before this point loses nothing
+        with open(self.journal_file, 'wb'):
+            pass
+    
+    def compact(self):
+        """Fold the journal into the main storage file"""
+        with self._lock:
+            documents = self._read_documents()
+            self._save_documents([raw for _, raw in documents.values()])
+            self._documents = documents
+            self._cache_stamp = self._file_stamp()
     
     def add_document(self, document: Document) -> Document:
-        documents = self._load_documents()
-        documents.append(document)
-        self._save_documents(documents)
+        doc_data = document.to_dict()
+        with self._lock:
+            self._load_documents()
+            self._append_journal({'op': 'add', 'doc': doc_data})
+            self._documents[document.id] = (document.upload_time, _dumps(doc_data))
         return document
     
     def get_document(self, doc_id: str) -> Optional[Document]:
-        documents = self._load_documents()
-        for doc in documents:
-            if doc.id == doc_id:
-                return doc
-        return None
+        entry = self._load_documents().get(doc_id)
+        return Document.from_dict(_loads(entry[1])) if entry is not None else None
     
     def update_document(self, document: Document) -> Document:
-        documents = self._load_documents()
-        for i, doc in enumerate(documents):
-            if doc.id == document.id:
-                documents[i] = document
-                break
-        self._save_documents(documents)
+        doc_data = document.to_dict()
+        with self._lock:
+            self._load_documents()
+            self._append_journal({'op': 'update', 'doc': doc_data})
+            if document.id in self._documents:
+                self._documents[document.id] = (document.upload_time, _dumps(doc_data))
         return document
     
     def get_recent_documents(self, limit: int = 10) -> List[Document]:
-        documents = self._load_documents()
-        # Sort by upload_time descending
-        documents.sort(key=lambda x: x.upload_time, reverse=True)
-        return documents[:limit]
+        # Newest upload_time first; nlargest keeps only `limit` candidates instead of sorting everything
+        with self._lock:
+            newest = heapq.nlargest(limit, self._load_documents().values(), key=itemgetter(0))
+        return [Document.from_dict(_loads(raw)) for _, raw in newest]
     
     def delete_document(self, doc_id: str) -> bool:
-        documents = self._load_documents()
-        original_len = len(documents)
-        documents = [doc for doc in documents if doc.id != doc_id]
-        if len(documents) < original_len:
-            self._save_documents(documents)
-            return True
-        return False
+        with self._lock:
+            if doc_id not in self._load_documents():
+                return False
+            self._append_journal({'op': 'delete', 'id': doc_id})
+            self._documents.pop(doc_id, None)
+        return True
 
 # Global storage instance
 storage = FileStorage()
\ No newline at end of file
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from storage import Document, FileStorage
+
+
+class FileStorageIsolationTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage = FileStorage(os.path.join(self.tmpdir.name, 'documents.json'))
+        document = Document(filename='a.pdf', filepath='/tmp/a.pdf')
+        document.step2_result = {'fields': {'name': 'original'}}
+        self.storage.add_document(document)
+        self.doc_id = document.id
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_unsaved_edits_are_not_visible_to_other_reads(self):
+        fetched = self.storage.get_document(self.doc_id)
+        fetched.step2_result['fields'].update({'name': 'edited'})
+        fetched.current_step = 3
+
+        again = self.storage.get_document(self.doc_id)
+        self.assertIsNot(again, fetched)
+        self.assertEqual(again.step2_result, {'fields': {'name': 'original'}})
+        self.assertEqual(again.current_step, 1)
+
+    def test_saved_document_is_not_shared_with_the_caller(self):
+        document = self.storage.get_document(self.doc_id)
+        validated = {'name': 'validated'}
+        document.set_step2_validated_json(validated)
+        document.set_step_result(2, validated)
+        self.storage.update_document(document)
+        validated['name'] = 'edited after save'
+
+        stored = self.storage.get_document(self.doc_id)
+        self.assertEqual(stored.step2_result, {'name': 'validated'})
+        stored.step2_result['name'] = 'changed'
+        self.assertEqual(stored.step2_validated_json, {'name': 'validated'})
+        self.assertEqual(self.storage.get_recent_documents()[0].step2_result, {'name': 'validated'})
+
+
+if __name__ == '__main__':
+    unittest.main()